@@ -0,0 +1,253 @@
+"""
+NARF load-testing harness
+
+Starts the sample NARF app on a local WSGI server and drives it with concurrent clients:
+
+    python -m benchmarks.loadtest --mode threaded --concurrency 16 --duration 10
+    python -m benchmarks.loadtest --mode prefork --workers 4 --mix json/10*3 --mix collection/100
+
+Each --mix entry is CONTENT_TYPE/SIZE[/QUERY][*WEIGHT] where CONTENT_TYPE is json, collection,
+html or a full mimetype, SIZE is the list size and QUERY holds additional filters such as
+name=item-1. The report contains throughput, p50/p95/p99 latency and the peak RSS of every server
+process. Everything runs on the local machine.
+"""
+from argparse import ArgumentParser
+from httplib import HTTPConnection
+from json import dumps
+from multiprocessing import Process, Queue
+from random import Random
+from resource import RUSAGE_CHILDREN, getrusage
+from sys import exit, stdout
+from threading import Thread
+from time import sleep
+from timeit import default_timer
+
+from werkzeug.serving import WSGIRequestHandler, make_server
+
+from benchmarks.sample_app import create_app
+
+
+CONTENT_TYPE_ALIASES = {
+    'json': 'application/json',
+    'collection': 'application/vnd.collection+json',
+    'html': 'text/html',
+}
+
+
+class QuietRequestHandler(WSGIRequestHandler):
+
+    def log_request(self, *args, **kwargs):
+        pass
+
+
+def parse_mix(entries):
+    """
+    Parse --mix entries into a list of (path, accept, weight)
+    """
+    mix = []
+    for entry in entries or ['json/10']:
+        weight = 1
+        if '*' in entry:
+            entry, weight = entry.rsplit('*', 1)
+            weight = int(weight)
+        parts = entry.split('/', 2)
+        accept = CONTENT_TYPE_ALIASES.get(parts[0], parts[0])
+        size = int(parts[1]) if len(parts) > 1 else 10
+        path = '/items?size={0}'.format(size)
+        if len(parts) > 2 and parts[2]:
+            path = '{0}&{1}'.format(path, parts[2])
+        mix.append((path, accept, weight))
+    return mix
+
+
+def serve(server):
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+def start_server(mode, workers):
+    """
+    Start the sample app on an ephemeral local port
+
+    threaded: a single process handling every request in a new thread
+    prefork: several single threaded processes accepting on the same listening socket
+    """
+    app, _ = create_app()
+    server = make_server(
+        '127.0.0.1', 0, app, threaded=(mode == 'threaded'), request_handler=QuietRequestHandler
+    )
+    processes = []
+    for _ in xrange(workers if mode == 'prefork' else 1):
+        process = Process(target=serve, args=(server,))
+        process.daemon = True
+        process.start()
+        processes.append(process)
+    server.socket.close()
+    return server.server_port, processes
+
+
+def peak_rss(pid):
+    """
+    Peak resident set size of a process in KiB, or None when /proc is unavailable
+    """
+    try:
+        with open('/proc/{0}/status'.format(pid)) as status:
+            for line in status:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1])
+    except IOError:
+        return None
+
+
+def client_worker(port, mix, deadline, seed, results):
+    """
+    Issue requests from the mix until the deadline and record (latency, status, size)
+    """
+    random = Random(seed)
+    weighted = [(path, accept) for path, accept, weight in mix for _ in xrange(weight)]
+    while default_timer() < deadline:
+        path, accept = random.choice(weighted)
+        start = default_timer()
+        try:
+            connection = HTTPConnection('127.0.0.1', port)
+            connection.request('GET', path, headers={'Accept': accept})
+            response = connection.getresponse()
+            size = len(response.read())
+            status = response.status
+            connection.close()
+        except Exception:
+            size, status = 0, 0
+        results.append((default_timer() - start, status, size))
+
+
+def client_process(port, mix, duration, concurrency, seed, queue):
+    deadline = default_timer() + duration
+    results = []
+    threads = [
+        Thread(target=client_worker, args=(port, mix, deadline, seed + index, results))
+        for index in xrange(concurrency)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    queue.put(results)
+
+
+def percentile(ordered, fraction):
+    """
+    Nearest-rank percentile of a sorted list
+    """
+    if not ordered:
+        return 0.0
+    index = max(0, min(len(ordered) - 1, int(round(fraction * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+
+def drive(port, mix, duration, concurrency, client_processes, seed=0):
+    """
+    Drive the server with concurrency clients spread over client_processes processes
+    """
+    queue = Queue()
+    per_process = [concurrency // client_processes] * client_processes
+    for index in xrange(concurrency % client_processes):
+        per_process[index] += 1
+    processes = []
+    for index, threads in enumerate(per_process):
+        if not threads:
+            continue
+        process = Process(
+            target=client_process,
+            args=(port, mix, duration, threads, seed + index * 1000, queue)
+        )
+        process.start()
+        processes.append(process)
+    results = []
+    for _ in processes:
+        results.extend(queue.get())
+    for process in processes:
+        process.join()
+    return results
+
+
+def build_report(results, duration, server_processes, rss):
+    latencies = sorted(latency for latency, _, _ in results)
+    errors = sum(1 for _, status, _ in results if not 200 <= status < 300)
+    return {
+        'requests': len(results),
+        'errors': errors,
+        'bytes': sum(size for _, _, size in results),
+        'duration': duration,
+        'rps': len(results) / duration if duration else 0.0,
+        'latency_ms': {
+            'p50': percentile(latencies, 0.50) * 1000,
+            'p95': percentile(latencies, 0.95) * 1000,
+            'p99': percentile(latencies, 0.99) * 1000,
+            'max': (latencies[-1] if latencies else 0.0) * 1000,
+        },
+        'server_processes': server_processes,
+        'peak_rss_kb': rss,
+    }
+
+
+def print_report(report):
+    stdout.write('requests:    {0} ({1} errors, {2} bytes)\n'.format(
+        report['requests'], report['errors'], report['bytes']
+    ))
+    stdout.write('throughput:  {0:.1f} req/s\n'.format(report['rps']))
+    latency = report['latency_ms']
+    stdout.write(
+        'latency:     p50 {0:.2f} ms, p95 {1:.2f} ms, p99 {2:.2f} ms, max {3:.2f} ms\n'.format(
+            latency['p50'], latency['p95'], latency['p99'], latency['max']
+        )
+    )
+    stdout.write('peak RSS:    {0}\n'.format(', '.join(
+        '{0:.1f} MiB'.format(kb / 1024.0) if kb is not None else 'n/a'
+        for kb in report['peak_rss_kb']
+    )))
+
+
+def main(argv=None):
+    parser = ArgumentParser(description='Load test the sample NARF app on a local server')
+    parser.add_argument('--mode', choices=('threaded', 'prefork'), default='threaded')
+    parser.add_argument('--workers', type=int, default=4, help='server processes in prefork mode')
+    parser.add_argument('--concurrency', type=int, default=8, help='concurrent client connections')
+    parser.add_argument('--client-processes', type=int, default=1,
+                        help='processes the client connections are spread over')
+    parser.add_argument('--duration', type=float, default=5.0, help='seconds to drive load')
+    parser.add_argument('--warmup', type=float, default=1.0, help='seconds of unrecorded load')
+    parser.add_argument('--mix', action='append', help='request mix entry, may be repeated')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', action='store_true', help='print the report as JSON')
+    args = parser.parse_args(argv)
+
+    mix = parse_mix(args.mix)
+    port, processes = start_server(args.mode, args.workers)
+    try:
+        sleep(0.2)
+        if args.warmup > 0:
+            drive(port, mix, args.warmup, args.concurrency, args.client_processes, args.seed)
+        start = default_timer()
+        results = drive(port, mix, args.duration, args.concurrency, args.client_processes,
+                        args.seed)
+        elapsed = default_timer() - start
+        rss = [peak_rss(process.pid) for process in processes]
+    finally:
+        for process in processes:
+            process.terminate()
+            process.join()
+    if None in rss:
+        # Without /proc fall back to the largest peak of any finished child (clients included)
+        rss = [getrusage(RUSAGE_CHILDREN).ru_maxrss]
+    report = build_report(results, elapsed, len(processes), rss)
+    if args.json:
+        stdout.write(dumps(report, indent=2, sort_keys=True) + '\n')
+    else:
+        print_report(report)
+    return 1 if report['errors'] else 0
+
+
+if __name__ == '__main__':
+    exit(main())
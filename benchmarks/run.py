@@ -0,0 +1,266 @@
+"""
+NARF benchmark suite
+
+Run from the repository root:
+
+    python -m benchmarks.run --output baseline.json
+    python -m benchmarks.run --compare baseline.json --threshold 0.1
+
+Results are stored as JSON (seconds per call) so they can be kept as baselines. In compare mode
+every benchmark whose median got slower than the threshold is flagged and the exit status is 1.
+"""
+from argparse import ArgumentParser
+from datetime import datetime
+from decimal import Decimal
+from json import dump, load
+from math import sqrt
+from platform import platform, python_version
+from sys import exit, stdout
+from time import time
+from timeit import default_timer
+
+from flask.ext.narf.content_types import JSON, CollectionPlusJSON
+from flask.ext.narf.fields import DateTimeField, DecimalField, IntegerField
+from flask.ext.narf.serializers import Serializer
+from flask.ext.narf.sorting import SortKey, sort_items
+
+from benchmarks.sample_app import LIST_SIZES, ItemFilterSet, ItemSerializer, create_app, make_items
+
+
+BENCHMARKS = []
+
+
+def benchmark(name, path='/', query_string=None):
+    """
+    Register a benchmark
+
+    The decorated factory is called with the sample app and api and returns the callable to time.
+    The callable runs inside a request context for the given path and query string.
+    """
+    def decorator(factory):
+        BENCHMARKS.append((name, factory, path, query_string))
+        return factory
+    return decorator
+
+
+@benchmark('serializer_construction', path='/items')
+def serializer_construction(app, api):
+    item = make_items(1)[0]
+    return lambda: ItemSerializer(raw_data=item)
+
+
+def content_type_benchmark(content_type_class, size):
+    def factory(app, api):
+        items = make_items(size)
+        content_type = content_type_class(api.endpoints['items'])
+        return lambda: content_type.serialize(items)
+    return factory
+
+
+for size in LIST_SIZES:
+    benchmark('serialize_json_{0}'.format(size), path='/items')(
+        content_type_benchmark(JSON, size)
+    )
+    benchmark('serialize_collection_json_{0}'.format(size), path='/items')(
+        content_type_benchmark(CollectionPlusJSON, size)
+    )
+
+
+@benchmark('related_uri_field', path='/items')
+def related_uri_field(app, api):
+    serializer = ItemSerializer(raw_data=make_items(1)[0])
+    return serializer.related.serialize_value
+
+
+class TypedSerializer(Serializer):
+    id = IntegerField(pk=True)
+    price = DecimalField(places=2)
+    created = DateTimeField()
+
+
+@benchmark('typed_fields', path='/items')
+def typed_fields(app, api):
+    # rows created within the same second, as in bulk inserts
+    items = [
+        {'id': i, 'price': Decimal(i) / 4, 'created': datetime(2015, 10, 21, 16, 29, 1, i)}
+        for i in xrange(100)
+    ]
+
+    def run():
+        for item in items:
+            for field in TypedSerializer(raw_data=item).fields:
+                field.serialize_value()
+    return run
+
+
+@benchmark('filterset_validate_inputs', path='/items', query_string='size=10&name=item-1')
+def filterset_validate_inputs(app, api):
+    def run():
+        filter_set = ItemFilterSet()
+        filter_set.validate_inputs()
+    return run
+
+
+@benchmark('filterset_parse', path='/items', query_string='size=10&name=item-1')
+def filterset_parse(app, api):
+    return ItemFilterSet.parse
+
+
+# a page of 10 items by score then name, as in `sort=-score,name` with `Range: items=0-9`
+SORT_KEYS = (SortKey('score', 'score', True), SortKey('name', 'name', False))
+
+
+def sort_benchmark(limit):
+    def factory(app, api):
+        items = [
+            dict(item, score=index * 7919 % 1000) for index, item in enumerate(make_items(1000))
+        ]
+        return lambda: sort_items(items, SORT_KEYS, limit)[:10]
+    return factory
+
+
+benchmark('sort_full_1000', path='/items')(sort_benchmark(None))
+benchmark('sort_top_k_1000', path='/items')(sort_benchmark(10))
+
+
+def request_benchmark(content_type, size):
+    def factory(app, api):
+        client = app.test_client()
+        path = '/items?size={0}'.format(size)
+        headers = {'Accept': content_type}
+        return lambda: client.get(path, headers=headers)
+    return factory
+
+
+for size in LIST_SIZES:
+    benchmark('request_json_{0}'.format(size))(
+        request_benchmark(JSON.CONTENT_TYPE, size)
+    )
+    benchmark('request_collection_json_{0}'.format(size))(
+        request_benchmark(CollectionPlusJSON.CONTENT_TYPE, size)
+    )
+
+
+def time_callable(func, rounds, min_time):
+    """
+    Time a callable, returning the per-call time of each round
+
+    The number of calls per round is calibrated so a round takes at least min_time seconds.
+    """
+    number = 1
+    while True:
+        start = default_timer()
+        for _ in xrange(number):
+            func()
+        elapsed = default_timer() - start
+        if elapsed >= min_time:
+            break
+        number *= 10 if elapsed < min_time / 10 else 2
+    timings = [elapsed / number]
+    for _ in xrange(rounds - 1):
+        start = default_timer()
+        for _ in xrange(number):
+            func()
+        timings.append((default_timer() - start) / number)
+    return timings, number
+
+
+def summarize(timings, number):
+    ordered = sorted(timings)
+    middle = len(ordered) // 2
+    if len(ordered) % 2:
+        median = ordered[middle]
+    else:
+        median = (ordered[middle - 1] + ordered[middle]) / 2.0
+    mean = sum(ordered) / len(ordered)
+    stdev = sqrt(sum((timing - mean) ** 2 for timing in ordered) / len(ordered))
+    return {
+        'min': ordered[0],
+        'max': ordered[-1],
+        'mean': mean,
+        'median': median,
+        'stdev': stdev,
+        'rounds': len(ordered),
+        'calls_per_round': number,
+    }
+
+
+def run_benchmarks(name_filter=None, rounds=5, min_time=0.05):
+    app, api = create_app()
+    results = {}
+    for name, factory, path, query_string in BENCHMARKS:
+        if name_filter and name_filter not in name:
+            continue
+        with app.test_request_context(path, query_string=query_string):
+            func = factory(app, api)
+            timings, number = time_callable(func, rounds, min_time)
+        results[name] = summarize(timings, number)
+        stdout.write('{0:<40} {1:>12.2f} us\n'.format(name, results[name]['median'] * 1e6))
+    return {
+        'meta': {
+            'python': python_version(),
+            'platform': platform(),
+            'timestamp': int(time()),
+            'unit': 'seconds',
+        },
+        'results': results,
+    }
+
+
+def compare(baseline, current, threshold):
+    """
+    Compare current results against a baseline, returning the names of regressed benchmarks
+    """
+    regressions = []
+    stdout.write('{0:<40} {1:>12} {2:>12} {3:>8}\n'.format(
+        'benchmark', 'baseline', 'current', 'ratio'
+    ))
+    for name in sorted(current['results']):
+        if name not in baseline['results']:
+            continue
+        old = baseline['results'][name]['median']
+        new = current['results'][name]['median']
+        ratio = new / old if old else float('inf')
+        if ratio > 1 + threshold:
+            status = 'REGRESSION'
+            regressions.append(name)
+        elif ratio < 1 - threshold:
+            status = 'improved'
+        else:
+            status = ''
+        stdout.write('{0:<40} {1:>9.2f} us {2:>9.2f} us {3:>7.2f}x {4}\n'.format(
+            name, old * 1e6, new * 1e6, ratio, status
+        ))
+    return regressions
+
+
+def main(argv=None):
+    parser = ArgumentParser(description='Run the NARF benchmark suite')
+    parser.add_argument('--output', help='write the results as JSON to this file')
+    parser.add_argument('--compare', help='baseline JSON file to compare the results against')
+    parser.add_argument('--threshold', type=float, default=0.1,
+                        help='relative slowdown of the median that counts as a regression')
+    parser.add_argument('--filter', dest='name_filter', help='only run benchmarks matching this')
+    parser.add_argument('--rounds', type=int, default=5)
+    parser.add_argument('--min-time', type=float, default=0.05,
+                        help='minimum duration of a single round in seconds')
+    args = parser.parse_args(argv)
+
+    results = run_benchmarks(args.name_filter, args.rounds, args.min_time)
+    if args.output:
+        with open(args.output, 'w') as output:
+            dump(results, output, indent=2, sort_keys=True)
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            baseline = load(baseline_file)
+        regressions = compare(baseline, results, args.threshold)
+        if regressions:
+            stdout.write('{0} regression(s): {1}\n'.format(
+                len(regressions), ', '.join(regressions)
+            ))
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    exit(main())
@@ -0,0 +1,64 @@
+"""
+Sample NARF app used by the benchmarks and the load-testing harness
+"""
+from flask import Flask
+
+from flask.ext.narf import NARF
+from flask.ext.narf.fields import Field, StringField, URIField, RelatedURIField, FieldRef
+from flask.ext.narf.filters import Filter, FilterSet
+from flask.ext.narf.serializers import Serializer
+
+
+LIST_SIZES = (1, 10, 100, 1000)
+
+
+class ItemSerializer(Serializer):
+    id = Field(pk=True, display_prompt='ID')
+    name = StringField(display_prompt='Name')
+    description = StringField()
+    homepage = URIField(relation='homepage')
+    related = RelatedURIField('items', filters={'name': FieldRef('name')})
+
+
+class ItemFilterSet(FilterSet):
+    size = Filter(Field())
+    name = Filter(StringField())
+
+
+def make_item(index):
+    return {
+        'id': index,
+        'name': 'item-{0}'.format(index),
+        'description': 'Description for item number {0}'.format(index),
+        'homepage': 'http://example.com/items/{0}'.format(index),
+    }
+
+
+def make_items(size):
+    return [make_item(index) for index in xrange(size)]
+
+
+def create_app():
+    """
+    Create the sample app with a plain and a filtered list endpoint
+    """
+    app = Flask(__name__)
+    api = NARF(app)
+    cached_items = dict((size, make_items(size)) for size in LIST_SIZES)
+
+    @api.register(ItemSerializer)
+    @api.register(ItemFilterSet)
+    @api.endpoint('/items')
+    def items(filterset):
+        size = int(filterset.size.validated_value or 10)
+        item_list = cached_items.get(size) or make_items(size)
+        name = filterset.name.validated_value
+        if name is not None:
+            item_list = [item for item in item_list if item['name'] == name]
+        return item_list
+
+    @api.endpoint('/free')
+    def free():
+        return {'hello': 'world'}
+
+    return app, api
@@ -1,12 +1,36 @@
+from contextlib import contextmanager
+from hashlib import md5
 from re import sub
 from sys import exc_info
+from timeit import default_timer
+from weakref import WeakSet
 
-from flask import request
+from flask import (
+    _app_ctx_stack, copy_current_request_context, current_app, has_app_context, json, request,
+    Response, url_for
+)
+from werkzeug.http import unquote_etag
+from werkzeug.local import Local
 
 from flask.ext.narf.filters import FilterSet
+from flask.ext.narf.aggregation import Aggregate, Aggregates, GroupBy, aggregate
 from flask.ext.narf.serializers import Serializer
 from flask.ext.narf.deserializers import Deserializer
-from flask.ext.narf.content_types import ContentType, JSON, CollectionPlusJSON
+from flask.ext.narf.batch import BatchDispatcher
+from flask.ext.narf.cache import LRUCache, pack_response, unpack_response
+from flask.ext.narf.coalescing import SingleFlight
+from flask.ext.narf.concurrency import ConcurrencyLimiter
+from flask.ext.narf.coroutines import EventLoop
+from flask.ext.narf.content_types import (
+    ContentType, JSON, CollectionPlusJSON, byte_length, is_content_type, is_item_list
+)
+from flask.ext.narf.exceptions import ConfigurationError, NotFound, ServiceUnavailable
+from flask.ext.narf.fields import FieldRef, RelatedURIField
+from flask.ext.narf.jobs import JobManager
+from flask.ext.narf.profiling import MemoryTracker, Profiler
+from flask.ext.narf.ranges import ItemRange, select_bytes
+from flask.ext.narf.resources import Reply
+from flask.ext.narf.sorting import Sort, sort_items
 
 
 class Endpoint(object):
@@ -22,13 +46,88 @@ class Endpoint(object):
         """
         Initialize with default endpoint behavior.
         """
+        # per-request state lives in a context local so concurrent requests don't share it
+        self.local = Local()
         self.FilterSet = None
         self.Deserializer = None
         self.content_type = None
         self.Serializer = None
-        self.content_type_map = {}
+        # content-type overrides of this endpoint, the defaults come from the app config
+        self.content_types = {}
         self.filter_set = None
-        self.content_type = None
+        self.item_range = None
+        self.compiled = False
+        self.sort_filter = None
+        self.aggregate_filter = None
+        self.group_filter = None
+        # bumped by every registration, so the per-app negotiation tables can tell they're stale
+        self.revision = 0
+        self.api = None
+        self.methods = ['GET']
+        self.head_hook = None
+        self.limiter = None
+        self.coalesce = False
+        self.cache_timeout = None
+        self.job = False
+        self.coroutine = False
+
+    @property
+    def content_type(self):
+        """
+        ContentType negotiated for the current request
+        """
+        return getattr(self.local, 'content_type', None)
+
+    @content_type.setter
+    def content_type(self, content_type):
+        self.local.content_type = content_type
+
+    @property
+    def filter_set(self):
+        """
+        FilterValues validated for the current request
+        """
+        return getattr(self.local, 'filter_set', None)
+
+    @filter_set.setter
+    def filter_set(self, filter_set):
+        self.local.filter_set = filter_set
+
+    @property
+    def item_range(self):
+        """
+        ItemRange requested by the current request
+        """
+        return getattr(self.local, 'item_range', None)
+
+    @item_range.setter
+    def item_range(self, item_range):
+        self.local.item_range = item_range
+
+    @property
+    def content_type_map(self):
+        """
+        ContentType classes by Content-Type of this endpoint for the current app
+        """
+        if self.api is None:
+            return dict(self.content_types)
+        return self.api.state.negotiation_table(self)[0]
+
+    @property
+    def accept_types(self):
+        """
+        Content-Types the current app negotiates for this endpoint
+        """
+        return self.api.state.negotiation_table(self)[1]
+
+    @property
+    def coalescer(self):
+        """
+        SingleFlight of this endpoint for the current app, if it coalesces requests
+        """
+        if not self.coalesce:
+            return None
+        return self.api.state.coalescer(self)
 
     def bind(self, api, path, func, decorated):
         """
@@ -39,30 +138,120 @@ class Endpoint(object):
         self.func = func
         self.decorated = decorated
         self.base_path = sub(r'<.+?>', '', path)
-        if api.app:
-            self.init_app(api.app)
+        for app in api.apps:
+            self.init_app(app)
 
     def init_app(self, app):
         """
-        Initialize this endpoint with the Flask app when it's available
+        Add the URL rules of this endpoint to a Flask app
+
+        Everything else about the endpoint is shared by the apps, the app specific state is kept
+        by the AppState of the app.
+        """
+        app.add_url_rule(
+            self.path, self.func.__name__, view_func=self.decorated,
+            methods=self.methods + ['OPTIONS']
+        )
+        if self.job:
+            app.add_url_rule(
+                '{0}/jobs/<job_id>'.format(self.path.rstrip('/')), self.func.__name__ + '_job',
+                view_func=self.job_status
+            )
+
+    def compile(self):
+        """
+        Precompute the per-class setup (fields, filters) of this endpoint, shared by every app
+
+        Happens lazily on the first request unless the endpoint was warmed up. Registering another
+        component on the endpoint invalidates it.
+        """
+        if self.Serializer:
+            self.Serializer.compile()
+            self.Serializer.pk_source()
+        if self.FilterSet:
+            self.sort_filter = self.aggregate_filter = self.group_filter = None
+            for filter_name, filter_obj in self.FilterSet.compile():
+                if isinstance(filter_obj, Sort):
+                    self.sort_filter = filter_name
+                elif isinstance(filter_obj, Aggregate):
+                    self.aggregate_filter = filter_name
+                elif isinstance(filter_obj, GroupBy):
+                    self.group_filter = filter_name
+            self.FilterSet.sources()
+        self.compiled = True
+
+    def describe(self):
+        """
+        Describe this endpoint for introspection (OPTIONS requests and the schema route)
+        """
+        return {
+            'name': self.func.__name__,
+            'path': self.path,
+            'methods': sorted(set(self.methods) | set(['HEAD', 'OPTIONS'])),
+            'content_types': sorted(self.content_type_map.keys()),
+            'serializer': self.Serializer.describe() if self.Serializer else None,
+            'deserializer': self.Deserializer.__name__ if self.Deserializer else None,
+            'filter_set': self.FilterSet.describe() if self.FilterSet else None,
+        }
+
+    def validate(self, app):
+        """
+        Check the endpoint configuration against the app, returning a list of problems
+        """
+        problems = []
+        if not hasattr(self, 'path'):
+            return ['registered components but no endpoint']
+        for content_type, content_type_class in self.content_type_map.items():
+            if not is_content_type(content_type_class):
+                problems.append('{0} is not handled by a ContentType'.format(content_type))
+        if self.Serializer:
+            fields = dict(self.Serializer.compile())
+            for field_name, field in fields.items():
+                if not isinstance(field, RelatedURIField):
+                    continue
+                if field.related_endpoint not in app.view_functions:
+                    problems.append('{0}.{1} relates to unknown endpoint "{2}"'.format(
+                        self.Serializer.__name__, field_name, field.related_endpoint
+                    ))
+                for param, value in field.filters.items():
+                    if isinstance(value, FieldRef) and value.source not in fields:
+                        problems.append('{0}.{1} filter "{2}" refers to unknown field "{3}"'.format(
+                            self.Serializer.__name__, field_name, param, value.source
+                        ))
+        return problems
+
+    def warm_up(self, app):
+        """
+        Compile the endpoint and precompute its app specific data, returning configuration problems
+        """
+        self.compile()
+        problems = self.validate(app)
+        if self.Serializer:
+            for field_name, field in self.Serializer.compile():
+                field.prepare(app)
+        for content_type_class in set(self.content_type_map.values()):
+            if is_content_type(content_type_class):
+                content_type_class.precompute_error_bodies()
+        return problems
+
+    def negotiate(self):
+        """
+        The ContentType class best matching the Accept header of the current request
         """
-        app.add_url_rule(self.path, self.func.__name__, view_func=self.decorated)
-        # Generate the content_type_map with this priority:
-        #   1. endpoint content-type overrides
-        #   2. global content-type overrides
-        #   3. default content-types
-        for content_type, content_type_class in app.config['DEFAULT_CONTENT_TYPE_MAP'].items():
-            self.content_type_map.setdefault(content_type, content_type_class)
+        if not self.compiled:
+            self.compile()
+        content_type_map, accept_types = self.api.state.negotiation_table(self)
+        best = request.accept_mimetypes.best_match(accept_types) or 'text/html'
+        return content_type_map[best]
 
     def setup_request(self):
         """
         Setup the request for this endpoint
         """
-        best = request.accept_mimetypes.best_match(self.content_type_map.keys()) or 'text/html'
-        self.content_type = self.content_type_map[best](self)
+        self.content_type = self.negotiate()(self)
         if self.FilterSet:
-            self.filter_set = self.FilterSet()
-            self.filter_set.validate_inputs()
+            self.filter_set = self.FilterSet.parse()
+        self.item_range = ItemRange.from_request() if self.Serializer else None
 
     def teardown_request(self):
         """
@@ -70,24 +259,441 @@ class Endpoint(object):
         """
         self.content_type = None
         self.filter_set = None
+        self.item_range = None
+
+    def make_head_response(self, args, kwargs):
+        """
+        Build the response to a HEAD request without keeping a serialized body around
+
+        The head hook (called like the view function) can provide the headers directly, skipping
+        the view and serialization. Otherwise the body is serialized in chunks that are only
+        counted.
+        """
+        headers = self.head_hook(*args, **kwargs) if self.head_hook else None
+        if headers is not None:
+            status = 304 if self.not_modified(dict(headers).get('ETag')) else None
+            return self.content_type.make_head_response(headers, status)
+        if self.content_type.STREAMING:
+            # a stream has no length, so there's nothing to learn from running the view
+            return self.content_type.make_head_response({'Cache-Control': 'no-cache'})
+        returned_object, status, headers = self.run_view(args, kwargs)
+        headers = dict(headers or {})
+        if status in (None, 200) and self.not_modified(headers.get('ETag')):
+            return self.content_type.make_head_response(headers, 304)
+        if isinstance(returned_object, Aggregates):
+            content_length = byte_length(self.serialize(returned_object))
+        else:
+            content_length = self.content_type.content_length(returned_object)
+        headers['Content-Length'] = str(content_length)
+        return self.content_type.make_head_response(headers, status)
+
+    def run_view(self, args, kwargs):
+        """
+        Run the view function, returning its result with the status and headers of the response
+        """
+        return self.process_result(self.call_view(*args, **kwargs))
+
+    def process_result(self, returned_object):
+        """
+        Apply the current request to the result of the view function, returning it with the status
+        and headers of the response
+
+        List results are sorted in the order of the Sort filter of the endpoint, if any. A requested
+        item range is pushed down to list results (206 Partial Content), so the skipped items are
+        never serialized, and only the items up to its end are sorted. Requests for aggregates get
+        the Aggregates of list results instead of their items. A Reply gives its own status and
+        headers.
+        """
+        status = headers = None
+        if isinstance(returned_object, Reply):
+            status, headers = returned_object.status, returned_object.headers
+            returned_object = returned_object.obj
+        if (self.aggregate_filter or self.group_filter) and is_item_list(returned_object):
+            specs, group = (), None
+            if self.aggregate_filter:
+                specs = getattr(self.filter_set, self.aggregate_filter).validated_value
+            if self.group_filter:
+                group = getattr(self.filter_set, self.group_filter).validated_value
+            if specs or group is not None:
+                return aggregate(returned_object, specs, group, self.Serializer), status, headers
+        item_range = self.item_range
+        total = None
+        if self.sort_filter and is_item_list(returned_object):
+            sort_keys = getattr(self.filter_set, self.sort_filter).validated_value
+            limit = None
+            if item_range is not None and hasattr(returned_object, '__len__'):
+                # only the items up to the end of the range are kept, so the total is kept aside
+                limit, total = item_range.limit(), len(returned_object)
+            returned_object = sort_items(returned_object, sort_keys, limit)
+        if item_range is not None and is_item_list(returned_object):
+            returned_object, content_range = item_range.select(returned_object, total)
+            status, headers = 206, dict(headers or {})
+            headers['Content-Range'] = content_range
+        if self.Serializer and isinstance(returned_object, (list, tuple)):
+            self.Serializer.prime_loaders(returned_object)
+        return returned_object, status, headers
+
+    @contextmanager
+    def track(self, phase):
+        """
+        Measure the memory allocated by a phase of the request when its memory is tracked
+        """
+        sample = getattr(self.local, 'memory_sample', None)
+        if sample is None:
+            yield
+            return
+        with self.api.memory.phase(sample, phase):
+            yield
+
+    def not_modified(self, etag):
+        """
+        Whether the current GET or HEAD request has the version with this ETag already
+        (If-None-Match)
+        """
+        return (
+            etag is not None and request.method in ('GET', 'HEAD') and
+            request.if_none_match.contains_weak(unquote_etag(etag)[0])
+        )
+
+    def build_response(self, args, kwargs, conditional=True):
+        """
+        Run the view function and serialize its result into a response
+
+        When conditional, a result the client has already (see not_modified) is answered with
+        304 Not Modified without being serialized. Responses shared with other requests are
+        built unconditionally.
+        """
+        with self.track('view'):
+            returned_object, status, headers = self.run_view(args, kwargs)
+        if conditional and headers and self.not_modified(headers.get('ETag')):
+            return self.content_type.make_head_response(headers, 304)
+        with self.track('serialization'):
+            body = self.serialize(returned_object)
+        with self.track('response'):
+            return self.content_type.make_response(body, status, headers)
+
+    def serialize(self, returned_object):
+        """
+        Serialize the result of the view function (or its Aggregates) in the negotiated format
+        """
+        if isinstance(returned_object, Aggregates):
+            return self.content_type.serialize_aggregates(returned_object)
+        return self.content_type.serialize(returned_object)
+
+    def call_view(self, *args, **kwargs):
+        """
+        Call the view function, on the event loop if it's a coroutine
+        """
+        if self.coroutine:
+            return self.api.loop.run(self.func(*args, **kwargs))
+        return self.func(*args, **kwargs)
+
+    def request_key(self):
+        """
+        Requests with the same key get the same response
+
+        The whole query string is part of the key (normalized to the sorted parameters), since
+        views can read parameters the FilterSet doesn't declare.
+        """
+        filter_key = repr(self.filter_set.key()) if self.filter_set else ''
+        range_key = repr(self.item_range.key()) if self.item_range else ''
+        query_key = repr(sorted(request.args.items(multi=True)))
+        return u'\x00'.join((
+            request.method, self.func.__name__, request.url_root, request.path, query_key,
+            filter_key, range_key, self.content_type.CONTENT_TYPE
+        )).encode('utf-8')
+
+    def render(self, args, kwargs):
+        """
+        Run the view function and render the response as (status, headers, body)
+        """
+        response = self.build_response(args, kwargs, conditional=False)
+        return response.status_code, list(response.headers), response.get_data()
+
+    def respond(self, args, kwargs):
+        """
+        Run the view function and serialize its result into a response
+
+        Rendered GET responses are shared through the response cache and request coalescing when
+        the endpoint uses them. Byte ranges and If-None-Match are applied to those bodies for each
+        request. Other methods and streamed Content-Types always run the view function for their
+        own request.
+        """
+        shared = request.method == 'GET' and not self.content_type.STREAMING
+        response_cache = (
+            self.api.response_cache if shared and self.cache_timeout is not None else None
+        )
+        coalescer = self.coalescer if shared else None
+        if response_cache is None and coalescer is None:
+            return self.build_response(args, kwargs)
+        key = self.request_key()
+        cached = response_cache.get(key) if response_cache is not None else None
+        if cached is not None:
+            status, headers, body = unpack_response(cached)
+        else:
+            if coalescer is not None:
+                status, headers, body = coalescer.do(key, lambda: self.render(args, kwargs))
+            else:
+                status, headers, body = self.render(args, kwargs)
+            if response_cache is not None and status in (200, 206):
+                response_cache.set(key, pack_response(status, headers, body), self.cache_timeout)
+        if status == 200 and self.not_modified(dict(headers).get('ETag')):
+            return self.content_type.make_head_response(headers, 304)
+        if status == 200:
+            selected = select_bytes(body)
+            if selected is not None:
+                body, content_range = selected
+                status = 206
+                headers = headers + [('Content-Range', content_range)]
+        return Response(body, status=status, headers=headers)
+
+    def dispatch(self, *args, **kwargs):
+        """
+        Admit the request through the concurrency limiter and handle it, profiled or with its
+        memory tracked when selected
+        """
+        limiter = self.limiter
+        if limiter is not None and not limiter.acquire():
+            error = ServiceUnavailable(retry_after=limiter.retry_after)
+            return self.negotiate()(self).make_error_response(ServiceUnavailable, error, None)
+        try:
+            profiler = self.api.profiler
+            if profiler is not None and profiler.should_profile():
+                return profiler.run(self, args, kwargs)
+            memory = self.api.memory
+            if memory is not None and memory.should_track():
+                return memory.run(self, args, kwargs)
+            return self.handle_request(*args, **kwargs)
+        finally:
+            if limiter is not None:
+                limiter.release()
+
+    def metrics(self):
+        """
+        Instrumentation of this endpoint
+        """
+        metrics = {}
+        if self.limiter is not None:
+            metrics['concurrency'] = self.limiter.stats()
+        if self.coalescer is not None:
+            metrics['coalescing'] = self.coalescer.stats()
+        return metrics
+
+    def submit_job(self, args, kwargs):
+        """
+        Run the view function on the job pool and respond with 202 Accepted and the job status URL
+        """
+        jobs = self.api.jobs
+        func = self.call_view if self.coroutine else self.func
+        if not jobs.processes:
+            # worker threads run the view in a copy of the request context
+            func = copy_current_request_context(func)
+        # the result is processed for the submitting request once it's served
+        context = (self.filter_set, self.item_range)
+        job = jobs.submit(self.func.__name__, func, args, kwargs, context)
+        return self.make_job_response(job)
+
+    def make_job_response(self, job):
+        """
+        Response describing a job that isn't done (202) or failed
+        """
+        url_args = dict(request.view_args or {}, job_id=job.id)
+        url = url_for(self.func.__name__ + '_job', _external=True, **url_args)
+        body = json.dumps({'job': job.id, 'status': job.status, 'href': url})
+        headers = {'Location': url}
+        if job.status == 'pending':
+            headers['Retry-After'] = '1'
+        return Response(body, status=202, headers=headers, mimetype=JSON.CONTENT_TYPE)
+
+    def job_status(self, job_id, **kwargs):
+        """
+        Respond with the status of a job of this endpoint, or with its result once it's done
+
+        The result is processed like the result of a view function for the request that submitted
+        the job (sort, item range, aggregates, Reply), then serialized in the ContentType negotiated
+        by the status request. A failed job responds with the error it raised.
+        """
+        try:
+            self.content_type = self.negotiate()(self)
+            job = self.api.jobs.get(job_id)
+            if job is None or job.endpoint != self.func.__name__:
+                raise NotFound('Unknown or expired job')
+            if not job.ready():
+                response = self.make_job_response(job)
+            else:
+                self.filter_set, self.item_range = job.context
+                returned_object, status, headers = self.process_result(job.result())
+                response = self.content_type.make_response(
+                    self.serialize(returned_object), status, headers
+                )
+        except Exception:
+            exc_type, exc_value, exc_traceback = exc_info()
+            content_type = self.content_type or JSON(self)
+            response = content_type.make_error_response(exc_type, exc_value, exc_traceback)
+        finally:
+            self.teardown_request()
+        return response
+
+    def handle_request(self, *args, **kwargs):
+        """
+        Run the view function for this endpoint and build the response
+        """
+        try:
+            self.setup_request()
+            if self.filter_set:
+                kwargs['filterset'] = self.filter_set
+            if request.method == 'HEAD':
+                response = self.make_head_response(args, kwargs)
+            elif self.job:
+                response = self.submit_job(args, kwargs)
+            else:
+                response = self.respond(args, kwargs)
+        except Exception:
+            exc_type, exc_value, exc_traceback = exc_info()
+            # errors before content negotiation finished are reported as JSON
+            content_type = self.content_type or JSON(self)
+            response = content_type.make_error_response(exc_type, exc_value, exc_traceback)
+        finally:
+            self.teardown_request()
+        return response
+
+
+class AppState(object):
+    """
+    State of a NARF extension for one Flask app, kept in app.extensions['narf'] by extension
+
+    Endpoints and their compiled Serializers and FilterSets are shared by every app the extension
+    is initialized with. What depends on the app config (caches, pools of workers and resources,
+    negotiation tables, schemas) is kept here, so an app factory can create any number of apps
+    and an app can use several NARF extensions.
+    """
+
+    def __init__(self, api, app):
+        self.api = api
+        self.app = app
+        config = app.config
+        # per-request profiling is only set up when enabled in the config
+        self.profiler = Profiler.from_config(config)
+        # so is sampled per-request memory tracking
+        self.memory = MemoryTracker.from_config(config)
+        # serialized items of Serializers with CACHE_ITEMS are shared across responses
+        self.item_cache = LRUCache(
+            max_entries=config.get('NARF_ITEM_CACHE_MAX_ENTRIES', 100000),
+            max_bytes=config.get('NARF_ITEM_CACHE_MAX_BYTES', 64 * 1024 * 1024)
+        )
+        # rendered responses of endpoints with a cache_timeout; NARF_RESPONSE_CACHE can provide a
+        # backend shared between processes, such as a SharedMemoryCache
+        self.response_cache = config.get('NARF_RESPONSE_CACHE') or LRUCache(
+            max_bytes=config.get('NARF_RESPONSE_CACHE_MAX_BYTES', 64 * 1024 * 1024),
+            sizeof=len
+        )
+        # view functions of job endpoints run on a worker pool started by the first job
+        self.jobs = JobManager.from_config(config)
+        # coroutine views run on an event loop with an I/O pool started by the first call
+        self.loop = EventLoop.from_config(config)
+        # open EventStream responses are capped, as each one holds a connection and a thread
+        self.streams = ConcurrencyLimiter(max_in_flight=config.get('NARF_MAX_STREAMS', 100))
+        self.batch = None
+        if config.get('NARF_BATCH_URL'):
+            self.batch = BatchDispatcher.from_config(api, config)
+        self.warm_up_report = None
+        self.schemas = {}
+        self.negotiation_tables = {}
+        self.coalescers = {}
+        # named ResourcePools views check out resources from with NARF.acquire
+        self.pools = {}
+
+    def negotiation_table(self, endpoint):
+        """
+        ContentType classes by Content-Type of an endpoint with the list of the Content-Types
+
+        Endpoint overrides take priority over the app's DEFAULT_CONTENT_TYPE_MAP. Built once per
+        registration of the endpoint.
+        """
+        table = self.negotiation_tables.get(endpoint)
+        if table is None or table[0] != endpoint.revision:
+            content_type_map = dict(self.app.config['DEFAULT_CONTENT_TYPE_MAP'])
+            content_type_map.update(endpoint.content_types)
+            table = (endpoint.revision, content_type_map, list(content_type_map.keys()))
+            self.negotiation_tables[endpoint] = table
+        return table[1:]
+
+    def coalescer(self, endpoint):
+        """
+        SingleFlight coalescing the requests of an endpoint for this app
+        """
+        coalescer = self.coalescers.get(endpoint)
+        if coalescer is None:
+            coalescer = self.coalescers.setdefault(endpoint, SingleFlight())
+        return coalescer
+
+
+def app_state_property(name):
+    """
+    Property reading an attribute of the AppState of the current app
+    """
+
+    def get(self):
+        state = self.state
+        return getattr(state, name) if state is not None else None
+
+    def set(self, value):
+        setattr(self.state, name, value)
+
+    return property(get, set, doc='{0} of the current app'.format(name))
 
 
 class NARF():
     """
     Not Another Rest Framework
+
+    Can be initialized with several apps. The state of the app handling the current request (or
+    of the last app initialized outside of requests) is available as attributes of the extension.
     """
 
+    profiler = app_state_property('profiler')
+    memory = app_state_property('memory')
+    item_cache = app_state_property('item_cache')
+    response_cache = app_state_property('response_cache')
+    jobs = app_state_property('jobs')
+    batch = app_state_property('batch')
+    loop = app_state_property('loop')
+    streams = app_state_property('streams')
+    pools = app_state_property('pools')
+    warm_up_report = app_state_property('warm_up_report')
+
     def __init__(self, app=None):
         self.app = app
+        self.apps = WeakSet()
         self.endpoints = {}
         if app is not None:
             self.init_app(app)
 
+    @property
+    def state(self):
+        """
+        AppState of the current app, falling back to the last app initialized
+        """
+        app = current_app._get_current_object() if has_app_context() else self.app
+        if app is None:
+            return None
+        state = self.state_of(app)
+        if state is None and self.app is not None:
+            state = self.state_of(self.app)
+        return state
+
+    def state_of(self, app):
+        """
+        AppState of this extension for an app, None if it wasn't initialized with it
+        """
+        return getattr(app, 'extensions', {}).get('narf', {}).get(self)
+
     def init_app(self, app):
         """
         Initialize the NARF extension with this app
         """
         self.app = app
+        self.apps.add(app)
         # setup the default content-types taking into account global overrides
         app.config.setdefault(
             'DEFAULT_CONTENT_TYPE_MAP',
@@ -97,6 +703,9 @@ class NARF():
                 CollectionPlusJSON.CONTENT_TYPE: CollectionPlusJSON
             }
         )
+        if not hasattr(app, 'extensions'):
+            app.extensions = {}
+        state = app.extensions.setdefault('narf', {})[self] = AppState(self, app)
         # Use the newstyle teardown_appcontext if it's available,
         # otherwise fall back to the request context
         if hasattr(app, 'teardown_appcontext'):
@@ -105,15 +714,161 @@ class NARF():
             app.teardown_request(self.teardown)
         # initialize all the endpoints
         for endpoint in self.endpoints.values():
-            endpoint.init_app(app)
+            if endpoint.api is not None:
+                endpoint.init_app(app)
+        schema_url = app.config.get('NARF_SCHEMA_URL')
+        if schema_url:
+            app.add_url_rule(schema_url, 'narf_schema', view_func=self.schema_response)
+        metrics_url = app.config.get('NARF_METRICS_URL')
+        if metrics_url:
+            # exposes internals, so only route it where clients are trusted
+            app.add_url_rule(metrics_url, 'narf_metrics', view_func=self.metrics_response)
+        if state.batch is not None:
+            app.add_url_rule(
+                app.config['NARF_BATCH_URL'], 'narf_batch', view_func=state.batch.respond,
+                methods=['POST']
+            )
+        if app.config.get('NARF_WARM_UP'):
+            self.warm_up(app, strict=True)
+
+    def warm_up(self, app=None, strict=False):
+        """
+        Compile every registered endpoint ahead of the first request
+
+        Call this once all endpoints are declared (NARF_WARM_UP does it in init_app for app
+        factories that declare endpoints first). Returns the setup time in seconds per endpoint.
+        Configuration problems are logged as warnings, or raised as a ConfigurationError when
+        strict.
+        """
+        app = app or self.app
+        report = {}
+        problems = []
+        with app.app_context():
+            for name, endpoint in self.endpoints.items():
+                start = default_timer()
+                for problem in endpoint.warm_up(app):
+                    problems.append('{0}: {1}'.format(name, problem))
+                report[name] = default_timer() - start
+        if problems:
+            if strict:
+                raise ConfigurationError('\n'.join(problems))
+            for problem in problems:
+                app.logger.warning('NARF configuration problem in %s', problem)
+        app.logger.info('NARF warmed up %d endpoints in %.6fs', len(report), sum(report.values()))
+        self.state_of(app).warm_up_report = report
+        return report
+
+    def schema(self, name=None):
+        """
+        Serialized description and ETag of one endpoint, or of every endpoint without a name
+
+        Built once per app and served from memory until the endpoints change.
+        """
+        schemas = self.state.schemas
+        schema = schemas.get(name)
+        if schema is None:
+            if name is None:
+                description = {'endpoints': [
+                    endpoint.describe() for _, endpoint in sorted(self.endpoints.items())
+                    if hasattr(endpoint, 'path')
+                ]}
+            else:
+                description = self.endpoints[name].describe()
+            body = json.dumps(description)
+            schema = schemas[name] = (body, md5(body).hexdigest())
+        return schema
+
+    def schema_response(self, name=None):
+        """
+        Respond with a schema, or with 304 Not Modified when the client has it already
+        """
+        body, etag = self.schema(name)
+        if request.if_none_match.contains(etag):
+            response = Response(status=304)
+        else:
+            response = Response(body, mimetype='application/json')
+        response.set_etag(etag)
+        return response
+
+    def metrics(self):
+        """
+        Instrumentation of the endpoints and caches
+        """
+        endpoints = {}
+        for name, endpoint in self.endpoints.items():
+            endpoint_metrics = endpoint.metrics()
+            if endpoint_metrics:
+                endpoints[name] = endpoint_metrics
+        metrics = {'endpoints': endpoints}
+        if self.memory is not None:
+            metrics['memory'] = self.memory.stats()
+        if self.item_cache is not None:
+            metrics['item_cache'] = self.item_cache.stats()
+        if self.response_cache is not None:
+            metrics['response_cache'] = self.response_cache.stats()
+        if self.jobs is not None and self.jobs.submitted:
+            metrics['jobs'] = self.jobs.stats()
+        if self.batch is not None:
+            metrics['batch'] = self.batch.stats()
+        if self.loop is not None and self.loop.coroutines:
+            metrics['coroutines'] = self.loop.stats()
+        if self.streams is not None and self.streams.admitted:
+            metrics['streams'] = self.streams.stats()
+        if self.pools:
+            metrics['pools'] = {name: pool.stats() for name, pool in self.pools.items()}
+        return metrics
+
+    def metrics_response(self):
+        """
+        Respond with the metrics as JSON
+        """
+        return Response(json.dumps(self.metrics()), mimetype='application/json')
+
+    def add_pool(self, name, pool, app=None):
+        """
+        Register a named ResourcePool whose resources views check out with acquire
+
+        The pool belongs to app, by default the current app (or the last app initialized).
+        """
+        state = self.state_of(app) if app is not None else self.state
+        state.pools[name] = pool
+        return pool
+
+    def acquire(self, name):
+        """
+        Resource of the named pool for the current app context
+
+        Checked out from the pool on first use and returned on teardown, also when handling the
+        request failed.
+        """
+        ctx = _app_ctx_stack.top
+        resources = getattr(ctx, 'narf_resources', None)
+        if resources is None:
+            resources = ctx.narf_resources = {}
+        pool = self.pools[name]
+        resource = resources.get(pool)
+        if resource is None:
+            resource = resources[pool] = pool.acquire()
+        return resource
 
     def teardown(self, exception):
         """
         Cleanup app context
+
+        Returns the pooled resources checked out during it.
         """
-        pass
+        ctx = _app_ctx_stack.top
+        resources = getattr(ctx, 'narf_resources', None)
+        if not resources:
+            return
+        ctx.narf_resources = None
+        for pool, resource in resources.items():
+            pool.release(resource)
 
     def get_endpoint(self, name):
+        # any change to the endpoints makes the cached schemas stale
+        for app in self.apps:
+            self.state_of(app).schemas.clear()
         endpoint = self.endpoints.get(name)
         if endpoint is None:
             endpoint = Endpoint()
@@ -124,6 +879,8 @@ class NARF():
         def decorator(func):
             endpoint = self.get_endpoint(func.__name__)
             endpoint.FilterSet = target
+            endpoint.compiled = False
+            endpoint.revision += 1
             return func
         return decorator
 
@@ -131,6 +888,8 @@ class NARF():
         def decorator(func):
             endpoint = self.get_endpoint(func.__name__)
             endpoint.Deserializer = target
+            endpoint.compiled = False
+            endpoint.revision += 1
             return func
         return decorator
 
@@ -138,13 +897,17 @@ class NARF():
         def decorator(func):
             endpoint = self.get_endpoint(func.__name__)
             endpoint.Serializer = target
+            endpoint.compiled = False
+            endpoint.revision += 1
             return func
         return decorator
 
     def register_content_type(self, target):
         def decorator(func):
             endpoint = self.get_endpoint(func.__name__)
-            endpoint.content_type_map[target.CONTENT_TYPE] = target
+            endpoint.content_types[target.CONTENT_TYPE] = target
+            endpoint.compiled = False
+            endpoint.revision += 1
             return func
         return decorator
 
@@ -161,30 +924,47 @@ class NARF():
         if issubclass(target, ContentType):
             return self.register_content_type(target)
 
-    def endpoint(self, path):
+    def endpoint(self, path, head=None, limiter=None, coalesce=False, cache_timeout=None,
+                 job=False, coroutine=False, methods=None):
         """
         Define an endpoint in the API
+
+        head is an optional cheap hook for HEAD requests. It gets the view function arguments and
+        returns the response headers (e.g. Content-Length or ETag), or None to fall back to the
+        view function.
+        limiter is an optional ConcurrencyLimiter for admission control of this endpoint.
+        coalesce makes concurrent GET requests with the same path, filter values and Content-Type
+        share a single run of the view function and its rendered response.
+        cache_timeout caches successful rendered responses in the response cache for that many
+        seconds (0 for no expiry).
+        job runs the view function in the background on the job pool. Requests are answered with
+        202 Accepted and the URL of the job status (path/jobs/<job_id>), which serves the result
+        once the job is done.
+        coroutine runs the view function, a generator based coroutine, on the event loop (see
+        flask_narf.coroutines.EventLoop).
+        methods are the HTTP methods routed to the view function, GET by default.
         """
         # decorate the endpoint
         def decorator(func):
             def decorated(*args, **kwargs):
-                try:
-                    endpoint.setup_request()
-                    if endpoint.filter_set:
-                        kwargs['filterset'] = endpoint.filter_set
-                    returned_object = func(*args, **kwargs)
-                    serialized_data = endpoint.content_type.serialize(returned_object)
-                    response = endpoint.content_type.make_response(serialized_data)
-                except Exception:
-                    exc_type, exc_value, exc_traceback = exc_info()
-                    response = endpoint.content_type.make_error_response(
-                        exc_type, exc_value, exc_traceback
-                    )
-                endpoint.teardown_request()
-                return response
+                if request.method == 'OPTIONS':
+                    response = self.schema_response(func.__name__)
+                    response.headers['Allow'] = ', '.join(sorted(request.url_rule.methods))
+                    return response
+                return endpoint.dispatch(*args, **kwargs)
+
+            # OPTIONS is answered with the endpoint description instead of Flask's default
+            decorated.provide_automatic_options = False
 
             # setup the endpoint
             endpoint = self.get_endpoint(func.__name__)
+            endpoint.head_hook = head
+            endpoint.limiter = limiter
+            endpoint.coalesce = coalesce
+            endpoint.cache_timeout = cache_timeout
+            endpoint.job = job
+            endpoint.coroutine = coroutine
+            endpoint.methods = list(methods or ['GET'])
             endpoint.bind(self, path, func, decorated)
 
             return func
@@ -193,6 +973,32 @@ class NARF():
 
     def resource(self, cls):
         """
-        Define an entire resource
+        Define an entire resource from a Resource class, generating its routes (see Resource)
+
+        Used as a class decorator, returns the class. The Resource instance serving the routes is
+        kept as cls.instance.
         """
-        pass
+        if not cls.path or cls.storage is None or cls.Serializer is None:
+            raise ConfigurationError(
+                '{0} needs a path, a storage and a Serializer'.format(cls.__name__)
+            )
+        resource = cls.instance = cls()
+
+        def collection(**kwargs):
+            return resource.collection(**kwargs)
+
+        def item(**kwargs):
+            return resource.item(**kwargs)
+
+        collection.__name__ = resource.name
+        item.__name__ = resource.item_name
+        for components, func, path, methods in (
+            ((cls.Serializer, cls.Deserializer, cls.FilterSet), collection, cls.path,
+             resource.collection_methods),
+            ((cls.Serializer, cls.Deserializer), item, resource.item_path, resource.item_methods),
+        ):
+            for component in components:
+                if component is not None:
+                    self.register(component)(func)
+            self.endpoint(path, methods=methods)(func)
+        return cls
@@ -0,0 +1,297 @@
+from collections import namedtuple
+from decimal import Decimal
+
+from flask.ext.narf.fields import ListField, TypedField, get_raw_value
+from flask.ext.narf.filters import Filter
+from flask.ext.narf.sorting import field_sources
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+FUNCTIONS = ('count', 'sum', 'min', 'max', 'avg')
+
+# a validated aggregate, field_name and source are None when counting items
+AggregateSpec = namedtuple('AggregateSpec', ['function', 'field_name', 'source'])
+
+# a validated field to group aggregates by
+GroupField = namedtuple('GroupField', ['field_name', 'source'])
+
+# what aggregating without any aggregate but a group gives
+COUNT = AggregateSpec('count', None, None)
+
+
+class Aggregates(object):
+    """
+    Rows of values aggregated from a list result, which ContentTypes serialize instead of items
+    """
+
+    def __init__(self, rows):
+        self.rows = rows
+
+
+class Aggregate(Filter):
+    """
+    Aggregates of a list result, from a comma separated list (`aggregate=count,sum:price`)
+
+    count counts the items (count:field the items with a value for the field); sum, min, max and
+    avg aggregate the values of a field of serializer_class (only those in `fields` when given).
+    Missing values are skipped. The value validates to a tuple of AggregateSpecs.
+
+    Endpoints with an Aggregate filter answer requests for aggregates with rows of aggregated
+    values instead of the items (see aggregate), grouped by the GroupBy filter of the FilterSet.
+    """
+
+    def __init__(self, serializer_class, fields=None, **kwargs):
+        super(Aggregate, self).__init__(ListField(TypedField(), **kwargs))
+        self.serializer_class = serializer_class
+        self.fields = fields
+        # shared by the clones bound to requests, filled on first use
+        self.sources = {}
+
+    def aggregatable(self):
+        """
+        Source on the raw items of every field that can be aggregated
+        """
+        if not self.sources:
+            self.sources.update(field_sources(self.serializer_class, self.fields))
+        return self.sources
+
+    def validate_input(self):
+        aggregatable = self.aggregatable()
+        specs = []
+        for name in self.field_type.deserialize_value() or ():
+            function, _, field_name = name.partition(':')
+            if function not in FUNCTIONS:
+                raise ValueError('unknown aggregate "{0}"'.format(function))
+            if not field_name:
+                if function != 'count':
+                    raise ValueError('{0} needs a field, as in {0}:field'.format(function))
+                specs.append(COUNT)
+                continue
+            if field_name not in aggregatable:
+                raise ValueError('can not aggregate "{0}"'.format(field_name))
+            specs.append(AggregateSpec(function, field_name, aggregatable[field_name]))
+        self.validated_value = tuple(specs)
+
+    def describe(self, filter_field):
+        description = super(Aggregate, self).describe(filter_field)
+        description['functions'] = list(FUNCTIONS)
+        description['aggregatable'] = sorted(self.aggregatable())
+        return description
+
+
+class GroupBy(Filter):
+    """
+    Field of serializer_class to group the aggregates of a list result by (`group_by=category`)
+
+    The value validates to a GroupField, or None without the parameter. Grouping without any
+    aggregate counts the items of every group.
+    """
+
+    def __init__(self, serializer_class, fields=None, **kwargs):
+        super(GroupBy, self).__init__(TypedField(**kwargs))
+        self.serializer_class = serializer_class
+        self.fields = fields
+        self.sources = {}
+
+    def groupable(self):
+        """
+        Source on the raw items of every field that can be grouped by
+        """
+        if not self.sources:
+            self.sources.update(field_sources(self.serializer_class, self.fields))
+        return self.sources
+
+    def validate_input(self):
+        field_name = self.field_type.deserialize_value()
+        if field_name is None:
+            self.validated_value = None
+            return
+        groupable = self.groupable()
+        if field_name not in groupable:
+            raise ValueError('can not group by "{0}"'.format(field_name))
+        self.validated_value = GroupField(field_name, groupable[field_name])
+
+    def describe(self, filter_field):
+        description = super(GroupBy, self).describe(filter_field)
+        description['groupable'] = sorted(self.groupable())
+        return description
+
+
+def result_name(spec):
+    """
+    Name of the value of an aggregate in the rows
+    """
+    if spec.field_name is None:
+        return spec.function
+    return '{0}_{1}'.format(spec.function, spec.field_name)
+
+
+def aggregate_items(items, specs, group=None):
+    """
+    Aggregate rows of any iterable of raw items, in a single pass over them
+
+    Only the running values of every group are kept, so lazy iterables are never held in memory.
+    """
+    group_source = group.source if group is not None else None
+    groups = {}
+    for item in items:
+        key = get_raw_value(item, group_source) if group_source is not None else None
+        states = groups.get(key)
+        if states is None:
+            # [count, running value] of every aggregate
+            states = groups[key] = [[0, None] for _ in specs]
+        for spec, state in zip(specs, states):
+            if spec.source is None:
+                state[0] += 1
+                continue
+            value = get_raw_value(item, spec.source)
+            if value is None:
+                continue
+            state[0] += 1
+            current = state[1]
+            if current is None:
+                state[1] = value
+            elif spec.function in ('sum', 'avg'):
+                state[1] = current + value
+            elif spec.function == 'min':
+                if value < current:
+                    state[1] = value
+            elif spec.function == 'max':
+                if value > current:
+                    state[1] = value
+    if group is None and not groups:
+        groups[None] = [[0, None] for _ in specs]
+    rows = []
+    for key in sorted(groups):
+        row = {group.field_name: key} if group is not None else {}
+        for spec, (count, value) in zip(specs, groups[key]):
+            if spec.function == 'count':
+                value = count
+            elif spec.function == 'sum' and value is None:
+                value = 0
+            elif spec.function == 'avg' and value is not None:
+                value = (value if isinstance(value, Decimal) else float(value)) / count
+            row[result_name(spec)] = value
+        rows.append(row)
+    return rows
+
+
+def python_value(value):
+    """
+    Python version of a numpy scalar or array
+    """
+    return value.tolist() if hasattr(value, 'tolist') else value
+
+
+def aggregate_array(array, specs, group=None):
+    """
+    Aggregate rows of a numpy structured array, with vectorized operations on its columns
+
+    Arrays have no missing values, NaNs are aggregated as they are.
+    """
+    if group is None:
+        size = len(array)
+        row = {}
+        for spec in specs:
+            if spec.function == 'count':
+                value = size
+            elif not size:
+                value = 0 if spec.function == 'sum' else None
+            else:
+                column = array[spec.source]
+                value = {
+                    'sum': column.sum, 'min': column.min, 'max': column.max, 'avg': column.mean,
+                }[spec.function]()
+            row[result_name(spec)] = python_value(value)
+        return [row]
+    keys, inverse = numpy.unique(array[group.source], return_inverse=True)
+    if not len(keys):
+        return []
+    counts = numpy.bincount(inverse, minlength=len(keys))
+    # items ordered by group, with the index of the first item of every group
+    order = numpy.argsort(inverse, kind='mergesort')
+    starts = numpy.searchsorted(inverse[order], numpy.arange(len(keys)))
+    columns = []
+    for spec in specs:
+        if spec.function == 'count':
+            values = counts
+        else:
+            column = array[spec.source]
+            if spec.function == 'sum':
+                values = numpy.bincount(inverse, weights=column, minlength=len(keys))
+                if column.dtype.kind in 'iu':
+                    values = values.astype(column.dtype)
+            elif spec.function == 'avg':
+                values = numpy.bincount(inverse, weights=column, minlength=len(keys)) / counts
+            elif spec.function == 'min':
+                values = numpy.minimum.reduceat(column[order], starts)
+            else:
+                values = numpy.maximum.reduceat(column[order], starts)
+        columns.append(python_value(values))
+    rows = []
+    for index, key in enumerate(python_value(keys)):
+        row = {group.field_name: key}
+        for spec, values in zip(specs, columns):
+            row[result_name(spec)] = values[index]
+        rows.append(row)
+    return rows
+
+
+def output_converters(serializer_class):
+    """
+    Functions converting raw values to their serialized form, by field name
+    """
+    if serializer_class is None:
+        return {}
+    return {
+        field_name: field.to_output for field_name, field in serializer_class.compile()
+        if isinstance(field, TypedField)
+    }
+
+
+def format_rows(rows, specs, group, serializer_class):
+    """
+    Serialize the raw values of aggregated rows like the fields they come from
+
+    Minimums, maximums and group values keep the type of the field. Sums and averages are
+    numbers, but decimals are serialized by their field to keep them exact.
+    """
+    converters = output_converters(serializer_class)
+    formats = []
+    for spec in specs:
+        convert = converters.get(spec.field_name)
+        if convert is not None and spec.function != 'count':
+            formats.append((result_name(spec), spec.function, convert))
+    group_convert = converters.get(group.field_name) if group is not None else None
+    for row in rows:
+        for name, function, convert in formats:
+            value = row.get(name)
+            if value is None or (function in ('sum', 'avg') and not isinstance(value, Decimal)):
+                continue
+            row[name] = convert(value)
+        if group_convert is not None and row.get(group.field_name) is not None:
+            row[group.field_name] = group_convert(row[group.field_name])
+    return rows
+
+
+def aggregate(items, specs, group=None, serializer_class=None):
+    """
+    Aggregates of the items of a view function result
+
+    Results with an aggregate_by method (such as a query of a data source) aggregate themselves:
+    aggregate_by is called with the AggregateSpecs and the GroupField (or None) and returns the
+    rows as dicts. numpy structured arrays are aggregated with vectorized operations, any other
+    iterable in a single pass over its items. Rows are sorted by group.
+    """
+    specs = specs or (COUNT,)
+    if hasattr(items, 'aggregate_by'):
+        rows = items.aggregate_by(specs, group)
+    elif numpy is not None and isinstance(items, numpy.ndarray) and items.dtype.names:
+        rows = aggregate_array(items, specs, group)
+    else:
+        rows = aggregate_items(items, specs, group)
+    return Aggregates(format_rows(rows, specs, group, serializer_class))
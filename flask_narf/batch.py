@@ -0,0 +1,192 @@
+from itertools import count
+from multiprocessing.pool import ThreadPool
+from sys import exc_info
+from threading import Lock
+
+from flask import current_app, json, request
+from werkzeug.exceptions import MethodNotAllowed as RoutingMethodNotAllowed
+from werkzeug.test import EnvironBuilder
+
+from flask.ext.narf.content_types import JSON
+from flask.ext.narf.exceptions import BadRequest, MethodNotAllowed, NotAcceptable, NotFound
+
+
+# headers of the batch request that don't apply to its sub-requests; conditional and range
+# headers are about the batch response, not about the responses it holds
+BATCH_ONLY_HEADERS = (
+    'Accept', 'Content-Length', 'Content-Type', 'If-Match', 'If-Modified-Since', 'If-None-Match',
+    'If-Range', 'If-Unmodified-Since', 'Range'
+)
+
+
+class BatchDispatcher(object):
+    """
+    Runs a batch of sub-requests through the registered endpoints
+
+    A batch is a JSON list of sub-requests: {"method": "GET", "path": "/items", "query": "a=1"
+    (or an object), "accept": "application/json"}, of which only the path is required. Each
+    sub-request gets its own request context (with the headers of the batch request) and is
+    dispatched to the endpoint its path routes to like any request of the app, through its
+    before_request, after_request and teardown functions (so guards apply to batches too).
+
+    Sub-requests are independent and run on a thread pool of `workers` threads shared by every
+    batch; a batch uses at most `concurrency` of them at once. Responses come back in the order
+    of the sub-requests, JSON bodies spliced in as they are.
+    """
+
+    def __init__(self, api, workers=8, concurrency=4, max_requests=50):
+        self.api = api
+        self.workers = workers
+        self.concurrency = concurrency
+        self.max_requests = max_requests
+        self.lock = Lock()
+        self.pool = None
+        self.batches = 0
+        self.sub_requests = 0
+
+    @classmethod
+    def from_config(cls, api, config):
+        return cls(
+            api,
+            workers=config.get('NARF_BATCH_WORKERS', 8),
+            concurrency=config.get('NARF_BATCH_CONCURRENCY', 4),
+            max_requests=config.get('NARF_BATCH_MAX_REQUESTS', 50),
+        )
+
+    def parse(self, data):
+        """
+        Validated list of sub-requests from the batch request body
+        """
+        try:
+            sub_requests = json.loads(data)
+        except ValueError:
+            raise BadRequest('The batch is not valid JSON')
+        if not isinstance(sub_requests, list):
+            raise BadRequest('The batch must be a list of requests')
+        if len(sub_requests) > self.max_requests:
+            raise BadRequest('A batch can hold at most {0} requests'.format(self.max_requests))
+        for sub_request in sub_requests:
+            if not isinstance(sub_request, dict) or not sub_request.get('path'):
+                raise BadRequest('Every request of the batch needs a path')
+        return sub_requests
+
+    def environ(self, sub_request):
+        """
+        WSGI environ of a sub-request of the current batch request
+        """
+        headers = [
+            (name, value) for name, value in request.headers if name not in BATCH_ONLY_HEADERS
+        ]
+        if sub_request.get('accept'):
+            headers.append(('Accept', sub_request['accept']))
+        return EnvironBuilder(
+            path=sub_request['path'],
+            base_url=request.url_root,
+            method=sub_request.get('method', 'GET').upper(),
+            query_string=sub_request.get('query'),
+            headers=headers,
+        ).get_environ()
+
+    def dispatch(self, app, environ):
+        """
+        Dispatch a sub-request to its endpoint, returning (status, headers, body)
+
+        Streamed responses (such as event streams) can't be held in a batch, they are closed
+        right away and answered with 406 Not Acceptable.
+        """
+        with app.request_context(environ):
+            response = None
+            try:
+                if request.routing_exception is not None:
+                    if isinstance(request.routing_exception, RoutingMethodNotAllowed):
+                        raise MethodNotAllowed()
+                    raise NotFound()
+                endpoint = self.api.endpoints.get(request.url_rule.endpoint)
+                if endpoint is None or not hasattr(endpoint, 'path'):
+                    raise NotFound()
+                response = app.full_dispatch_request()
+                if response.is_streamed:
+                    raise NotAcceptable('Streamed responses can not be batched')
+                body = None if request.method == 'HEAD' else response.get_data()
+                return response.status_code, dict(response.headers), response.mimetype, body
+            except Exception:
+                error = JSON(None).make_error_response(*exc_info())
+                return error.status_code, dict(error.headers), error.mimetype, error.get_data()
+            finally:
+                if response is not None:
+                    # releases what the response holds, such as the slot of an event stream
+                    response.close()
+
+    def run(self, sub_requests):
+        """
+        Run the sub-requests, at most `concurrency` at once, returning their results in order
+        """
+        app = current_app._get_current_object()
+        environs = [self.environ(sub_request) for sub_request in sub_requests]
+        results = [None] * len(environs)
+        indexes = count()
+        indexes_lock = Lock()
+
+        def lane():
+            # every lane keeps taking the next sub-request until none are left
+            while True:
+                with indexes_lock:
+                    index = next(indexes)
+                if index >= len(environs):
+                    return
+                results[index] = self.dispatch(app, environs[index])
+
+        with self.lock:
+            if self.pool is None:
+                self.pool = ThreadPool(self.workers)
+            self.batches += 1
+            self.sub_requests += len(environs)
+        lanes = [
+            self.pool.apply_async(lane) for _ in xrange(min(self.concurrency, len(environs)))
+        ]
+        for pending_lane in lanes:
+            pending_lane.get()
+        return results
+
+    def render(self, results):
+        """
+        Body of the batch response
+        """
+        responses = []
+        for status, headers, mimetype, body in results:
+            if not body:
+                body = 'null'
+            elif mimetype != JSON.CONTENT_TYPE and not mimetype.endswith('+json'):
+                body = json.dumps(body.decode('utf-8', 'replace'))
+            responses.append('{{"status": {0}, "headers": {1}, "body": {2}}}'.format(
+                status, json.dumps(headers), body
+            ))
+        return '{{"responses": [{0}]}}'.format(', '.join(responses))
+
+    def respond(self):
+        """
+        Respond to the current batch request
+        """
+        try:
+            results = self.run(self.parse(request.get_data()))
+        except Exception:
+            return JSON(None).make_error_response(*exc_info())
+        return current_app.response_class(self.render(results), mimetype=JSON.CONTENT_TYPE)
+
+    def close(self):
+        with self.lock:
+            if self.pool is not None:
+                self.pool.terminate()
+                self.pool = None
+
+    def stats(self):
+        """
+        Counters of the batches run
+        """
+        with self.lock:
+            return {
+                'workers': self.workers,
+                'concurrency': self.concurrency,
+                'batches': self.batches,
+                'sub_requests': self.sub_requests,
+            }
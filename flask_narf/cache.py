@@ -0,0 +1,128 @@
+from collections import OrderedDict
+from struct import Struct
+from sys import getsizeof
+from threading import Lock
+from time import time
+
+
+# status code and length of the headers of a packed response
+RESPONSE_HEADER = Struct('!HI')
+
+
+def pack_response(status, headers, body):
+    """
+    Pack a rendered response (status, list of header tuples, body) into bytes for a response cache
+    """
+    headers = '\r\n'.join('{0}: {1}'.format(name, value) for name, value in headers)
+    headers = headers.encode('latin-1')
+    return RESPONSE_HEADER.pack(status, len(headers)) + headers + body
+
+
+def unpack_response(data):
+    """
+    Unpack a packed response into (status, headers, body)
+    """
+    status, headers_length = RESPONSE_HEADER.unpack_from(data)
+    start = RESPONSE_HEADER.size
+    end = start + headers_length
+    headers = [tuple(line.split(': ', 1)) for line in data[start:end].split('\r\n') if line]
+    return status, headers, data[end:]
+
+
+def approximate_size(obj):
+    """
+    Approximate memory footprint in bytes of a serialized value (and everything it contains)
+    """
+    size = getsizeof(obj)
+    if isinstance(obj, dict):
+        for key, value in obj.iteritems():
+            size += approximate_size(key) + approximate_size(value)
+    elif isinstance(obj, (list, tuple)):
+        for value in obj:
+            size += approximate_size(value)
+    return size
+
+
+class LRUCache(object):
+    """
+    Thread safe least recently used cache
+
+    Bounded by the number of entries and by the approximate memory size of the cached values.
+    Entries can expire after a timeout. Keeps hit, miss and eviction counters.
+    """
+
+    def __init__(self, max_entries=None, max_bytes=None, sizeof=approximate_size):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self.lock = Lock()
+        self.entries = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default=None):
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            if entry is not None and entry[2] and entry[2] < time():
+                self.bytes -= entry[1]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return default
+            # re-insert to mark it as most recently used
+            self.entries[key] = entry
+            self.hits += 1
+            return entry[0]
+
+    def set(self, key, value, timeout=None):
+        size = self.sizeof(value) if self.max_bytes is not None else 0
+        if self.max_bytes is not None and size > self.max_bytes:
+            return False
+        expires = time() + timeout if timeout else 0
+        with self.lock:
+            previous = self.entries.pop(key, None)
+            if previous is not None:
+                self.bytes -= previous[1]
+            self.entries[key] = (value, size, expires)
+            self.bytes += size
+            while (
+                (self.max_entries is not None and len(self.entries) > self.max_entries) or
+                (self.max_bytes is not None and self.bytes > self.max_bytes)
+            ):
+                _, (_, evicted_size, _) = self.entries.popitem(last=False)
+                self.bytes -= evicted_size
+                self.evictions += 1
+        return True
+
+    def delete(self, key):
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            if entry is not None:
+                self.bytes -= entry[1]
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.bytes = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def stats(self):
+        """
+        Snapshot of the cache size and counters
+        """
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self.entries),
+                'bytes': self.bytes,
+                'max_entries': self.max_entries,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': float(self.hits) / lookups if lookups else 0.0,
+            }
@@ -0,0 +1,70 @@
+from threading import Event, Lock
+
+
+class Call(object):
+    """
+    An in-flight call that other callers with the same key can wait on
+    """
+
+    def __init__(self):
+        self.event = Event()
+        self.result = None
+        self.error = None
+        self.followers = 0
+
+
+class SingleFlight(object):
+    """
+    Request coalescing
+
+    Concurrent calls with the same key run the function once: the first caller (the leader)
+    computes the result, every caller arriving while it is in flight waits and shares it.
+    """
+
+    def __init__(self):
+        self.lock = Lock()
+        self.calls = {}
+        self.executions = 0
+        self.shared = 0
+
+    def do(self, key, func):
+        """
+        Run func, or wait for the in-flight call with the same key, and return its result
+
+        Exceptions raised by func are raised for the leader and every follower.
+        """
+        with self.lock:
+            call = self.calls.get(key)
+            leader = call is None
+            if leader:
+                call = self.calls[key] = Call()
+                self.executions += 1
+            else:
+                call.followers += 1
+                self.shared += 1
+        if not leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+        try:
+            call.result = func()
+        except Exception as error:
+            call.error = error
+            raise
+        finally:
+            with self.lock:
+                del self.calls[key]
+            call.event.set()
+        return call.result
+
+    def stats(self):
+        """
+        Counters of executed and shared calls
+        """
+        with self.lock:
+            return {
+                'in_flight': len(self.calls),
+                'executions': self.executions,
+                'shared': self.shared,
+            }
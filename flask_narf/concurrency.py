@@ -0,0 +1,86 @@
+from threading import Condition, Lock
+from time import time
+
+
+class ConcurrencyLimiter(object):
+    """
+    Admission control for an endpoint
+
+    Admits up to max_in_flight concurrent requests. Further requests wait in a queue of at most
+    max_queue requests for up to queue_timeout seconds (None waits until admitted). Requests that
+    find the queue full or time out are shed and should be answered with a 503 that asks the
+    client to retry after retry_after seconds.
+    """
+
+    def __init__(self, max_in_flight, max_queue=0, queue_timeout=None, retry_after=1):
+        self.max_in_flight = max_in_flight
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.retry_after = retry_after
+        self.condition = Condition(Lock())
+        self.in_flight = 0
+        self.queued = 0
+        self.admitted = 0
+        self.shed = 0
+        self.timed_out = 0
+        self.peak_in_flight = 0
+        self.peak_queued = 0
+
+    def _admit(self):
+        self.in_flight += 1
+        self.admitted += 1
+        if self.in_flight > self.peak_in_flight:
+            self.peak_in_flight = self.in_flight
+
+    def acquire(self):
+        """
+        Wait for a slot, returning False when the request is shed
+        """
+        with self.condition:
+            if self.in_flight < self.max_in_flight and not self.queued:
+                self._admit()
+                return True
+            if self.queued >= self.max_queue:
+                self.shed += 1
+                return False
+            self.queued += 1
+            if self.queued > self.peak_queued:
+                self.peak_queued = self.queued
+            deadline = time() + self.queue_timeout if self.queue_timeout is not None else None
+            try:
+                while self.in_flight >= self.max_in_flight:
+                    remaining = deadline - time() if deadline is not None else None
+                    if remaining is not None and remaining <= 0:
+                        self.shed += 1
+                        self.timed_out += 1
+                        return False
+                    self.condition.wait(remaining)
+            finally:
+                self.queued -= 1
+            self._admit()
+            return True
+
+    def release(self):
+        """
+        Free the slot of a finished request
+        """
+        with self.condition:
+            self.in_flight -= 1
+            self.condition.notify()
+
+    def stats(self):
+        """
+        Snapshot of the limiter state and counters
+        """
+        with self.condition:
+            return {
+                'max_in_flight': self.max_in_flight,
+                'max_queue': self.max_queue,
+                'in_flight': self.in_flight,
+                'queued': self.queued,
+                'admitted': self.admitted,
+                'shed': self.shed,
+                'timed_out': self.timed_out,
+                'peak_in_flight': self.peak_in_flight,
+                'peak_queued': self.peak_queued,
+            }
@@ -1,8 +1,86 @@
+from Queue import Empty, Full, Queue
+from collections import Mapping
+from sys import exc_info
+from threading import Lock, Thread
 from traceback import format_tb
 
-from flask import request, Response, json
+from flask import (
+    copy_current_request_context, current_app, request, Response, json, stream_with_context
+)
 
-from flask.ext.narf.fields import URIField
+from flask.ext.narf.exceptions import (
+    NARFError, BadRequest, ValidationError, NotFound, NotAcceptable, RangeNotSatisfiable,
+    ServiceUnavailable
+)
+from flask.ext.narf.fields import URIField, get_raw_value
+
+
+# Errors whose bodies are precomputed when warming up
+COMMON_ERRORS = (
+    NARFError, BadRequest, ValidationError, NotFound, NotAcceptable, RangeNotSatisfiable,
+    ServiceUnavailable
+)
+
+# (title, code, message) of the common errors with their default message, the only memoized ones
+DEFAULT_ERRORS = frozenset(
+    (error_class.title, str(error_class.status_code), error_class.message)
+    for error_class in COMMON_ERRORS
+)
+
+# Upper bound on the number of events a stream producer gets ahead of the client
+STREAM_BUFFER_SIZE = 64
+
+
+def include_tracebacks():
+    """
+    Whether error responses should contain stacktraces (NARF_ERROR_TRACEBACKS, defaults to debug)
+    """
+    setting = current_app.config.get('NARF_ERROR_TRACEBACKS')
+    return current_app.debug if setting is None else setting
+
+
+def is_item_list(obj):
+    """
+    Whether a view function result is a list of items
+
+    Lists and lazy iterables (generators, database queries) are, mappings and objects are single
+    items.
+    """
+    return hasattr(obj, '__iter__') and not isinstance(obj, Mapping)
+
+
+def as_item_list(obj):
+    """
+    The items of a view function result; anything but a list of items is a single item
+    """
+    if not is_item_list(obj):
+        return [obj]
+    return obj
+
+
+def byte_length(chunk):
+    """
+    Length in bytes of a serialized chunk once encoded for the response
+    """
+    if isinstance(chunk, unicode):
+        return len(chunk.encode('utf-8'))
+    return len(chunk)
+
+
+def last_event_id():
+    """
+    Id of the last event an EventStream client received before reconnecting, if any
+
+    Views of stream endpoints use it to resume the feed after that event.
+    """
+    return request.headers.get('Last-Event-ID')
+
+
+def is_content_type(obj):
+    """
+    Whether obj is a ContentType class
+    """
+    return isinstance(obj, type) and issubclass(obj, ContentType)
 
 
 class ContentType(object):
@@ -13,21 +91,67 @@ class ContentType(object):
     """
 
     CONTENT_TYPE = None
+    # streamed Content-Types respond with an open ended body, which is never cached or counted
+    STREAMING = False
 
     def __init__(self, endpoint):
         self.endpoint = endpoint
 
+    @classmethod
+    def error_body(cls, title, code, message):
+        """
+        Serialized error body without a stacktrace
+
+        The bodies of the common errors with their default message are memoized per Content-Type.
+        Custom messages (which can hold client input) are serialized every time.
+        """
+        key = (title, code, message)
+        if key not in DEFAULT_ERRORS:
+            return cls.serialize_error(title, code, message)
+        cache = cls.__dict__.get('_error_bodies')
+        if cache is None:
+            cache = {}
+            setattr(cls, '_error_bodies', cache)
+        body = cache.get(key)
+        if body is None:
+            body = cache[key] = cls.serialize_error(title, code, message)
+        return body
+
+    @classmethod
+    def precompute_error_bodies(cls):
+        """
+        Memoize the bodies of the common errors ahead of time
+        """
+        for error_class in COMMON_ERRORS:
+            cls.error_body(error_class.title, str(error_class.status_code), error_class.message)
+
     def serialize(self, obj):
         """
         Serialize the result of the view function into the correct format for this Content-Type
         """
-        if not isinstance(obj, list):
-            item_list = [obj]
-        else:
-            item_list = obj
-        items = self.serialize_item_list(item_list)
+        items = self.serialize_item_list(as_item_list(obj))
         return self.serialize_response(items)
 
+    def iter_serialize(self, obj):
+        """
+        Serialize the result of the view function in chunks instead of building the whole body
+
+        Joining the chunks gives the same body as serialize.
+        """
+        yield self.serialize(obj)
+
+    def content_length(self, obj):
+        """
+        Length in bytes of the serialized view function result, without keeping the body
+        """
+        return sum(byte_length(chunk) for chunk in self.iter_serialize(obj))
+
+    def serialize_aggregates(self, aggregates):
+        """
+        Serialize the Aggregates of a list result instead of its items
+        """
+        raise NotAcceptable('{0} can not represent aggregates'.format(self.CONTENT_TYPE))
+
     def serialize_item(self, item):
         """
         Serialize a single item
@@ -39,14 +163,80 @@ class ContentType(object):
         """
         Serialize a list of items according to the Content-Type format
         """
-        items = [self.serialize_item(item) for item in item_list]
+        serialize_item = self.item_serializer()
+        items = [serialize_item(item) for item in item_list]
         return items
 
-    def make_response(self, return_format):
+    def item_serializer(self):
+        """
+        Function serializing a single item, through the item cache if the Serializer uses it
+        """
+        Serializer = self.endpoint.Serializer
+        item_cache = self.endpoint.api.item_cache
+        if item_cache is None or not Serializer.CACHE_ITEMS:
+            return self.serialize_item
+        # serialized items contain URLs, so they depend on the request root and endpoint as well
+        key_prefix = (Serializer, self.__class__, request.url_root, self.endpoint.base_path)
+
+        def serialize_cached_item(item):
+            item_key = Serializer.cache_key(item)
+            if item_key is None:
+                return self.serialize_item(item)
+            key = key_prefix + item_key
+            serialized_item = item_cache.get(key)
+            if serialized_item is None:
+                serialized_item = self.serialize_item(item)
+                item_cache.set(key, serialized_item)
+            return serialized_item
+
+        return serialize_cached_item
+
+    def make_response(self, return_format, status=None, headers=None):
         """
         Make a response with Content-Type: application/collection+json
         """
-        return Response(return_format, mimetype=self.CONTENT_TYPE)
+        return Response(return_format, status=status, headers=headers, mimetype=self.CONTENT_TYPE)
+
+    def make_head_response(self, headers, status=None):
+        """
+        Make a bodiless response for a HEAD request
+        """
+        return Response(status=status, headers=headers, mimetype=self.CONTENT_TYPE)
+
+    def make_error_response(self, exc_type, exc_value, exc_traceback):
+        """
+        Make an error response for an exception raised while handling the request
+
+        NARFErrors keep their status code and message. Anything else is a 500 and is logged.
+        The traceback is only formatted when tracebacks are enabled, otherwise the body is
+        memoized.
+        """
+        if isinstance(exc_value, NARFError):
+            status, headers = exc_value.status_code, exc_value.headers
+            title, message = exc_value.title, exc_value.message
+        else:
+            status, headers = NARFError.status_code, None
+            title, message = NARFError.title, NARFError.message
+            current_app.logger.error(
+                'Exception on %s', request.path, exc_info=(exc_type, exc_value, exc_traceback)
+            )
+        if include_tracebacks():
+            if not isinstance(exc_value, NARFError):
+                title, message = str(exc_type), str(exc_value)
+            body = self.serialize_error(title, str(status), message, format_tb(exc_traceback))
+        else:
+            body = self.error_body(title, str(status), message)
+        return Response(body, status=status, headers=headers, mimetype=self.CONTENT_TYPE)
+
+    @staticmethod
+    def serialize_error(title, code, message, stacktrace=None):
+        """
+        Serialize an error according to the Content-Type format
+        """
+        lines = ['{0} ({1}): {2}'.format(title, code, message)]
+        if stacktrace is not None:
+            lines.extend(stacktrace)
+        return '\n'.join(lines)
 
 
 class JSON(ContentType):
@@ -65,81 +255,373 @@ class JSON(ContentType):
         else:
             return super(JSON, self).serialize(obj)
 
+    def iter_serialize(self, obj):
+        if self.endpoint.Serializer is None:
+            yield json.dumps(obj)
+            return
+        yield '{"items": ['
+        serialize_item = self.item_serializer()
+        for index, item in enumerate(as_item_list(obj)):
+            if index:
+                yield ', '
+            yield json.dumps(serialize_item(item))
+        yield ']}'
+
     def serialize_response(self, items):
         return json.dumps({'items': items})
 
-    def make_error_response(self, exc_type, exc_value, exc_traceback):
-        return Response(
-            json.dumps(
-                {
-                    'error': str(exc_type),
-                    'message': str(exc_value),
-                    'stacktrace': format_tb(exc_traceback)
-                }
-            ),
-            status=500
-        )
+    def serialize_aggregates(self, aggregates):
+        return json.dumps({'aggregates': aggregates.rows})
+
+    @staticmethod
+    def serialize_error(title, code, message, stacktrace=None):
+        error = {'error': title, 'code': code, 'message': message}
+        if stacktrace is not None:
+            error['stacktrace'] = stacktrace
+        return json.dumps(error)
 
 
 class CollectionPlusJSON(ContentType):
     """
     Content-Type: application/vnd.collection+json
+
+    The layout of the items of a Serializer (which fields are links, their relations and prompts,
+    the pk field) is computed once, so serializing an item only fills in the values. Items
+    without a pk field have no href. With NARF_COLLECTION_TEMPLATES the collection also describes
+    the input of the Deserializer (template) and the filters of the FilterSet (queries).
     """
 
     CONTENT_TYPE = 'application/vnd.collection+json'
 
+    @classmethod
+    def layout(cls, Serializer):
+        """
+        Layout of the items of a Serializer, as (entries, index of the pk field or None)
+
+        An entry per field, in the order of the Serializer fields: (is_link, the dict the field
+        fills in with its value).
+        """
+        layouts = cls.__dict__.get('_layouts')
+        if layouts is None:
+            layouts = {}
+            setattr(cls, '_layouts', layouts)
+        layout = layouts.get(Serializer)
+        if layout is None:
+            entries = []
+            pk_index = None
+            for index, (field_name, field) in enumerate(Serializer.compile()):
+                if field.pk and pk_index is None:
+                    pk_index = index
+                if isinstance(field, URIField):
+                    entry = {'rel': field.relation or field_name}
+                else:
+                    entry = {'name': field_name}
+                if field.display_prompt:
+                    entry['prompt'] = field.display_prompt
+                entries.append((isinstance(field, URIField), entry))
+            layout = layouts[Serializer] = (entries, pk_index)
+        return layout
+
+    @classmethod
+    def input_data(cls, component):
+        """
+        Empty data of the fields of a Deserializer, or of the filters of a FilterSet
+        """
+        inputs = cls.__dict__.get('_inputs')
+        if inputs is None:
+            inputs = {}
+            setattr(cls, '_inputs', inputs)
+        data = inputs.get(component)
+        if data is None:
+            data = []
+            for name, declared in sorted(component.compile()):
+                field = getattr(declared, 'field_type', declared)
+                entry = {'name': field._source or name, 'value': ''}
+                if field.display_prompt:
+                    entry['prompt'] = field.display_prompt
+                data.append(entry)
+            inputs[component] = data
+        return data
+
+    def collection_extras(self):
+        """
+        The template and queries of the collection, when NARF_COLLECTION_TEMPLATES is set
+        """
+        extras = {}
+        if not current_app.config.get('NARF_COLLECTION_TEMPLATES'):
+            return extras
+        if self.endpoint.Deserializer:
+            extras['template'] = {'data': self.input_data(self.endpoint.Deserializer)}
+        if self.endpoint.FilterSet:
+            extras['queries'] = [{
+                'href': request.base_url, 'rel': 'search',
+                'data': self.input_data(self.endpoint.FilterSet),
+            }]
+        return extras
+
     def serialize_item(self, item):
         """
         Serialize a specific item according to the Content-Type format
         """
+        Serializer = self.endpoint.Serializer
+        entries, pk_index = self.layout(Serializer)
         data = []
         links = []
-        serializer = self.endpoint.Serializer(item)
-        for field in serializer.fields:
+        obj = {}
+        for index, field in enumerate(Serializer(item).fields):
             value = field.serialize_value()
-            prompt = field.display_prompt
-            if field.pk:
-                pk_field = field
-            if isinstance(field, URIField):
-                relation = field.relation or field.field_name
-                field_data = {'href': value, 'rel': relation}
-                if prompt:
-                    field_data['prompt'] = prompt
-                links.append(field_data)
+            is_link, entry = entries[index]
+            if is_link:
+                links.append(dict(entry, href=value))
             else:
-                field_data = {'name': field.field_name, 'value': value}
-                if prompt:
-                    field_data['prompt'] = prompt
-                data.append(field_data)
-        # TODO(Dom): Handle missing pk_field error better
-        obj = {
-            'href': '%s%s/%s' % (
-                request.url_root.rstrip('/'), self.endpoint.base_path, pk_field.serialize_value()
-            )
-        }
+                data.append(dict(entry, value=value))
+            if index == pk_index:
+                obj['href'] = '%s%s/%s' % (
+                    request.url_root.rstrip('/'), self.endpoint.base_path.rstrip('/'), value
+                )
         if data:
             obj['data'] = data
         if links:
             obj['links'] = links
         return obj
 
+    def iter_serialize(self, obj):
+        yield '{"collection": {"href": '
+        yield json.dumps(request.url)
+        has_items = False
+        serialize_item = self.item_serializer()
+        for item in as_item_list(obj):
+            yield ', ' if has_items else ', "items": ['
+            has_items = True
+            yield json.dumps(serialize_item(item))
+        if has_items:
+            yield ']'
+        for name, value in sorted(self.collection_extras().items()):
+            yield ', {0}: {1}'.format(json.dumps(name), json.dumps(value))
+        yield '}}'
+
     def serialize_response(self, items):
         collection = {'href': request.url}
         if items:
             collection['items'] = items
+        collection.update(self.collection_extras())
         return json.dumps({'collection': collection})
 
-    def make_error_response(self, exc_type, exc_value, exc_traceback):
-        return Response(
-            json.dumps(
-                {
-                    'collection': {
-                        'title': str(exc_type),
-                        'code': str(exc_type),
-                        'message': str(exc_value),
-                        'stacktrace': format_tb(exc_traceback)
-                    }
-                }
-            ),
-            status=500
+    def serialize_aggregates(self, aggregates):
+        """
+        Aggregated rows are items without a URL of their own
+        """
+        items = [
+            {'data': [{'name': name, 'value': value} for name, value in sorted(row.items())]}
+            for row in aggregates.rows
+        ]
+        return self.serialize_response(items)
+
+    @staticmethod
+    def serialize_error(title, code, message, stacktrace=None):
+        error = {'title': title, 'code': code, 'message': message}
+        if stacktrace is not None:
+            error['stacktrace'] = stacktrace
+        return json.dumps({'collection': error})
+
+
+class Event(object):
+    """
+    An event of an EventStream, for views that set its id or type themselves
+
+    data is an item serialized with the Serializer of the endpoint (or as is without one).
+    """
+
+    def __init__(self, data, id=None, event=None):
+        self.data = data
+        self.id = id
+        self.event = event
+
+
+class StreamSlot(object):
+    """
+    An open stream slot of the streams limiter, held by a response and by the producer thread
+    of its events
+
+    The slot is released once every holder is done, so a producer still blocked on an idle feed
+    after its client went away keeps counting as an open stream.
+    """
+
+    def __init__(self, streams):
+        self.streams = streams
+        self.lock = Lock()
+        self.holders = 1
+
+    def hold(self):
+        with self.lock:
+            self.holders += 1
+
+    def release(self):
+        with self.lock:
+            self.holders -= 1
+            last = not self.holders
+        if last:
+            self.streams.release()
+
+
+class EventStream(ContentType):
+    """
+    Content-Type: text/event-stream
+
+    Pushes the items (or Events) of the view function result as Server-Sent Events while the view
+    produces them, so a single connection replaces polling the collection. Events get the pk of
+    their item as id, which clients send back as Last-Event-ID when they reconnect (see
+    last_event_id). A comment is sent after NARF_STREAM_HEARTBEAT seconds (15) without events to
+    keep the connection open, and NARF_STREAM_RETRY sets the reconnection delay of clients in
+    milliseconds. At most NARF_MAX_STREAMS streams (100) are open at once; further requests are
+    answered with 503 Service Unavailable; a stream counts as open until both its response is
+    closed and the thread producing its events has stopped.
+    """
+
+    CONTENT_TYPE = 'text/event-stream'
+    STREAMING = True
+
+    def __init__(self, endpoint):
+        super(EventStream, self).__init__(endpoint)
+        # StreamSlot of the response, set by make_response
+        self.slot = None
+
+    def serialize(self, obj):
+        return self.iter_serialize(obj)
+
+    def iter_serialize(self, obj):
+        config = current_app.config
+        retry = config.get('NARF_STREAM_RETRY')
+        if retry is not None:
+            yield 'retry: {0}\n\n'.format(int(retry))
+        format_event = self.event_formatter()
+        heartbeat = config.get('NARF_STREAM_HEARTBEAT', 15)
+        items = as_item_list(obj)
+        idle = object()
+        if heartbeat:
+            items = self.iter_with_heartbeats(items, heartbeat, idle)
+        try:
+            for item in items:
+                yield ': heartbeat\n\n' if item is idle else format_event(item)
+        except Exception:
+            exc_type, exc_value, exc_traceback = exc_info()
+            # the response has started, so errors end the stream with an error event
+            if not isinstance(exc_value, NARFError):
+                current_app.logger.error(
+                    'Exception on %s', request.path, exc_info=(exc_type, exc_value, exc_traceback)
+                )
+                exc_value = NARFError()
+            yield self.error_body(exc_value.title, str(exc_value.status_code), exc_value.message)
+
+    def iter_with_heartbeats(self, items, heartbeat, idle):
+        """
+        Iterate over items produced on another thread, giving idle after heartbeat idle seconds
+        """
+        queue = Queue(STREAM_BUFFER_SIZE)
+        done = object()
+        stopped = []
+
+        def put(entry):
+            # gives up once the client is gone instead of blocking on a full queue forever
+            while not stopped:
+                try:
+                    queue.put(entry, timeout=heartbeat)
+                    return True
+                except Full:
+                    pass
+            return False
+
+        slot = self.slot
+
+        @copy_current_request_context
+        def produce():
+            try:
+                for item in items:
+                    if not put((item, None)):
+                        return
+            except Exception:
+                put((done, exc_info()))
+            else:
+                put((done, None))
+            finally:
+                if slot is not None:
+                    slot.release()
+
+        if slot is not None:
+            slot.hold()
+        producer = Thread(target=produce)
+        producer.daemon = True
+        producer.start()
+        try:
+            while True:
+                try:
+                    item, error = queue.get(timeout=heartbeat)
+                except Empty:
+                    yield idle
+                    continue
+                if item is done:
+                    if error is not None:
+                        raise error[0], error[1], error[2]
+                    return
+                yield item
+        finally:
+            stopped.append(True)
+
+    def event_formatter(self):
+        """
+        Function formatting an item or Event as a Server-Sent Event
+        """
+        Serializer = self.endpoint.Serializer
+        serialize_item = self.item_serializer() if Serializer else None
+        pk_source = Serializer.pk_source() if Serializer else None
+
+        def format_event(item):
+            if isinstance(item, Event):
+                data, event_id, event_type = item.data, item.id, item.event
+            else:
+                data, event_id, event_type = item, None, None
+            if event_id is None and pk_source is not None:
+                event_id = get_raw_value(data, pk_source)
+            lines = []
+            if event_id is not None:
+                lines.append(u'id: {0}'.format(event_id))
+            if event_type is not None:
+                lines.append(u'event: {0}'.format(event_type))
+            payload = json.dumps(serialize_item(data) if serialize_item else data)
+            lines.extend(u'data: ' + line for line in payload.split('\n'))
+            return u'\n'.join(lines) + u'\n\n'
+
+        return format_event
+
+    def serialize_aggregates(self, aggregates):
+        """
+        A stream of the single event of the aggregated rows
+        """
+        return ['event: aggregates\ndata: {0}\n\n'.format(json.dumps(aggregates.rows))]
+
+    def make_response(self, return_format, status=None, headers=None):
+        """
+        Make a streamed response, holding one of the open stream slots until it's closed (and its
+        producer thread stopped)
+        """
+        streams = self.endpoint.api.streams
+        if not streams.acquire():
+            raise ServiceUnavailable('Too many open streams', retry_after=streams.retry_after)
+        self.slot = StreamSlot(streams)
+        response = Response(
+            stream_with_context(return_format), status=status, headers=headers,
+            mimetype=self.CONTENT_TYPE
         )
+        response.headers['Cache-Control'] = 'no-cache'
+        # keeps proxies such as nginx from buffering the events
+        response.headers['X-Accel-Buffering'] = 'no'
+        # called once the server is done with the response, also when the client went away
+        response.call_on_close(self.slot.release)
+        return response
+
+    @staticmethod
+    def serialize_error(title, code, message, stacktrace=None):
+        error = {'error': title, 'code': code, 'message': message}
+        if stacktrace is not None:
+            error['stacktrace'] = stacktrace
+        return 'event: error\ndata: {0}\n\n'.format(json.dumps(error))
@@ -0,0 +1,311 @@
+from Queue import Queue
+from multiprocessing.pool import ThreadPool
+from sys import exc_info
+from threading import Lock
+from types import GeneratorType
+
+from flask import _app_ctx_stack, copy_current_request_context, has_request_context
+
+
+class Return(Exception):
+    """
+    Raised by a coroutine to return a value
+    """
+
+    def __init__(self, value=None):
+        super(Return, self).__init__(value)
+        self.value = value
+
+
+class Call(object):
+    """
+    A function call to run on the I/O thread pool
+    """
+
+    def __init__(self, func, args, kwargs):
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+
+
+class Load(object):
+    """
+    Values to get from a BatchLoader
+    """
+
+    def __init__(self, loader, keys, many):
+        self.loader = loader
+        self.keys = keys
+        self.many = many
+
+
+def call(func, *args, **kwargs):
+    """
+    Run func on the I/O thread pool, in a copy of the request context
+    """
+    return Call(func, args, kwargs)
+
+
+def gather(*awaitables):
+    """
+    Wait for several things at once, resolving to the list of their results
+    """
+    return list(awaitables)
+
+
+def run_call(func, args, kwargs):
+    """
+    Run a call, returning (value, exc_info) instead of raising
+    """
+    try:
+        return func(*args, **kwargs), None
+    except Exception:
+        return None, exc_info()
+
+
+class BatchLoader(object):
+    """
+    Loads values by key in batches, caching them for the current app context
+
+    load_many is called with a list of keys and returns a dict of the values by key (keys it
+    leaves out load as None). Coroutines waiting on the same loader at the same time share a
+    single call; LoadedFields use it to load the related values of a whole list of items at once.
+    At most max_batch keys are loaded per call.
+    """
+
+    def __init__(self, load_many, max_batch=None):
+        self.load_many_func = load_many
+        self.max_batch = max_batch
+
+    @property
+    def cache(self):
+        ctx = _app_ctx_stack.top
+        caches = getattr(ctx, 'narf_loader_caches', None)
+        if caches is None:
+            caches = ctx.narf_loader_caches = {}
+        cache = caches.get(self)
+        if cache is None:
+            cache = caches[self] = {}
+        return cache
+
+    def load(self, key):
+        return Load(self, [key], many=False)
+
+    def load_many(self, keys):
+        return Load(self, list(keys), many=True)
+
+    def fetch(self, keys):
+        """
+        Call load_many for keys, in batches of max_batch, returning the values by key
+        """
+        batch_size = self.max_batch or len(keys) or 1
+        values = {}
+        for start in xrange(0, len(keys), batch_size):
+            batch = keys[start:start + batch_size]
+            loaded = self.load_many_func(batch)
+            for key in batch:
+                values[key] = loaded.get(key)
+        return values
+
+    def missing(self, keys):
+        """
+        Distinct keys that are not cached yet, in order
+        """
+        cache = self.cache
+        seen = set()
+        missing = []
+        for key in keys:
+            if key not in cache and key not in seen:
+                seen.add(key)
+                missing.append(key)
+        return missing
+
+    def prime(self, keys):
+        """
+        Load every key that isn't cached yet with as few calls as possible
+        """
+        missing = self.missing(keys)
+        if missing:
+            self.cache.update(self.fetch(missing))
+
+    def get(self, key):
+        """
+        Value of a key, loaded on its own if it wasn't primed
+        """
+        cache = self.cache
+        if key not in cache:
+            self.prime([key])
+        return cache[key]
+
+
+class EventLoop(object):
+    """
+    Runs coroutine views on the thread serving the request
+
+    Python 2 has no async def, so coroutine views are generator functions: they yield what they
+    wait for and raise Return with their result. They can yield
+        - call(func, *args, **kwargs) to run func on the I/O thread pool
+        - loader.load(key) or loader.load_many(keys) for values of a BatchLoader
+        - another coroutine, which runs concurrently with the caller's other work
+        - a list or tuple of these (see gather), resolved concurrently into a list
+
+    Calls run on a pool of `workers` threads (started on first use) while the loop resumes the
+    coroutines whose calls completed, so coroutines never hold a pool thread.
+    """
+
+    def __init__(self, workers=8):
+        self.workers = workers
+        self.lock = Lock()
+        self.pool = None
+        self.coroutines = 0
+        self.calls = 0
+        self.loads = 0
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(workers=config.get('NARF_COROUTINE_WORKERS', 8))
+
+    def submit(self, func, args, kwargs, resume, queue):
+        """
+        Run func on the pool and resume with its outcome through the loop queue
+        """
+        with self.lock:
+            if self.pool is None:
+                self.pool = ThreadPool(self.workers)
+            self.calls += 1
+        if has_request_context():
+            func = copy_current_request_context(func)
+        self.pool.apply_async(
+            run_call, (func, args, kwargs), callback=lambda outcome: queue.put(
+                lambda: resume(*outcome)
+            )
+        )
+
+    def run(self, coroutine):
+        """
+        Run a coroutine to completion, returning its result or raising its exception
+        """
+        with self.lock:
+            self.coroutines += 1
+        queue = Queue()
+        # loaders waited on during this loop tick, with the keys and resumes waiting on them
+        state = {'loads': {}}
+        outcome = []
+        self.start(coroutine, lambda value, error: outcome.append((value, error)), queue, state)
+        while not outcome:
+            queue.get()()
+        value, error = outcome[0]
+        if error is not None:
+            raise error[0], error[1], error[2]
+        return value
+
+    def start(self, coroutine, finish, queue, state):
+        self.step(coroutine, None, None, finish, queue, state)
+
+    def step(self, coroutine, value, error, finish, queue, state):
+        try:
+            if error is not None:
+                yielded = coroutine.throw(*error)
+            else:
+                yielded = coroutine.send(value)
+        except Return as returned:
+            finish(returned.value, None)
+        except StopIteration:
+            finish(None, None)
+        except Exception:
+            finish(None, exc_info())
+        else:
+            self.wait(
+                yielded,
+                lambda value, error: self.step(coroutine, value, error, finish, queue, state),
+                queue, state
+            )
+
+    def wait(self, yielded, resume, queue, state):
+        """
+        Resolve something a coroutine yielded, then resume it with the value or the error
+        """
+        if isinstance(yielded, Call):
+            self.submit(yielded.func, yielded.args, yielded.kwargs, resume, queue)
+        elif isinstance(yielded, Load):
+            self.wait_load(yielded, resume, queue, state)
+        elif isinstance(yielded, GeneratorType):
+            self.start(yielded, resume, queue, state)
+        elif isinstance(yielded, (list, tuple)):
+            self.wait_all(yielded, resume, queue, state)
+        else:
+            resume(None, (
+                TypeError, TypeError('Coroutines can not wait for {0!r}'.format(yielded)), None
+            ))
+
+    def wait_all(self, awaitables, resume, queue, state):
+        if not awaitables:
+            resume([], None)
+            return
+        results = [None] * len(awaitables)
+        remaining = [len(awaitables)]
+        errors = []
+
+        def collect(index):
+            def collected(value, error):
+                results[index] = value
+                if error is not None:
+                    errors.append(error)
+                remaining[0] -= 1
+                if not remaining[0]:
+                    resume(results, errors[0] if errors else None)
+            return collected
+
+        for index, awaitable in enumerate(awaitables):
+            self.wait(awaitable, collect(index), queue, state)
+
+    def wait_load(self, load, resume, queue, state):
+        loader = load.loader
+        cache = loader.cache
+        if not loader.missing(load.keys):
+            values = [cache[key] for key in load.keys]
+            resume(values if load.many else values[0], None)
+            return
+        pending = state['loads'].get(loader)
+        if pending is None:
+            # every load of this loader waited on before the dispatch shares one call
+            pending = state['loads'][loader] = []
+            queue.put(lambda: self.dispatch_loads(loader, queue, state))
+        pending.append((load, resume))
+
+    def dispatch_loads(self, loader, queue, state):
+        pending = state['loads'].pop(loader)
+        keys = loader.missing([key for load, _ in pending for key in load.keys])
+        with self.lock:
+            self.loads += 1
+
+        def loaded(values, error):
+            if error is None:
+                loader.cache.update(values)
+            cache = loader.cache
+            for load, resume in pending:
+                if error is not None:
+                    resume(None, error)
+                else:
+                    values = [cache[key] for key in load.keys]
+                    resume(values if load.many else values[0], None)
+
+        self.submit(loader.fetch, (keys,), {}, loaded, queue)
+
+    def close(self):
+        with self.lock:
+            if self.pool is not None:
+                self.pool.terminate()
+                self.pool = None
+
+    def stats(self):
+        """
+        Counters of the coroutines run
+        """
+        with self.lock:
+            return {
+                'workers': self.workers,
+                'coroutines': self.coroutines,
+                'calls': self.calls,
+                'loads': self.loads,
+            }
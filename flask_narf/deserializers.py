@@ -1,4 +1,5 @@
-# TODO(Dom): No testing here yet
+from flask.ext.narf.fields import Field
+
 
 class Deserializer(object):
     """
@@ -7,8 +8,40 @@ class Deserializer(object):
     For defining the input object of an endpoint
     """
 
-    def __init__(self, **kwargs):
+    def __init__(self, raw_data=None, **kwargs):
+        """
+        Initialize the Deserializer
+
+        Collect all the defined Field's bound to the input data
+        """
         super(Deserializer, self).__init__(**kwargs)
+        self.raw_data = raw_data
+        self.fields = []
+        for field_name, declared_field in self.compile():
+            field = declared_field.clone()
+            setattr(self, field_name, field)
+            field.bind(self, field_name, raw_data)
+            self.fields.append(field)
+
+    @classmethod
+    def compile(cls):
+        """
+        Collect the Field's defined on this Deserializer once per class
+        """
+        declared_fields = cls.__dict__.get('_declared_fields')
+        if declared_fields is None:
+            declared_fields = [
+                (field_name, field) for field_name, field in cls.__dict__.items()
+                if isinstance(field, Field)
+            ]
+            cls._declared_fields = declared_fields
+        return declared_fields
+
+    def deserialize(self):
+        """
+        The input converted by the fields, keyed by field name
+        """
+        return {field.field_name: field.deserialize_value() for field in self.fields}
 
     def validate(self):
         pass
@@ -0,0 +1,82 @@
+class ConfigurationError(Exception):
+    """
+    Raised when endpoints are declared with an invalid configuration
+    """
+    pass
+
+
+class NARFError(Exception):
+    """
+    NARFError Base class
+
+    For errors that should be reported to the client with a specific HTTP status code.
+    Raising one of these from a view (or while validating inputs) produces an error response in
+    the negotiated Content-Type instead of a generic 500.
+    """
+
+    status_code = 500
+    title = 'Internal Server Error'
+    message = 'The server encountered an unexpected error'
+
+    def __init__(self, message=None, headers=None):
+        if message is not None:
+            self.message = message
+        self.headers = headers or {}
+        super(NARFError, self).__init__(self.message)
+
+
+class BadRequest(NARFError):
+    status_code = 400
+    title = 'Bad Request'
+    message = 'The request could not be understood'
+
+
+class ValidationError(BadRequest):
+    title = 'Validation Error'
+    message = 'The request input is invalid'
+
+
+class NotFound(NARFError):
+    status_code = 404
+    title = 'Not Found'
+    message = 'The requested resource could not be found'
+
+
+class NotAcceptable(NARFError):
+    status_code = 406
+    title = 'Not Acceptable'
+    message = 'None of the accepted Content-Types can be produced'
+
+
+class ServiceUnavailable(NARFError):
+    status_code = 503
+    title = 'Service Unavailable'
+    message = 'The service is temporarily unable to handle the request'
+
+    def __init__(self, message=None, headers=None, retry_after=None):
+        super(ServiceUnavailable, self).__init__(message, headers)
+        if retry_after is not None:
+            self.headers['Retry-After'] = str(int(retry_after))
+
+
+class RangeNotSatisfiable(NARFError):
+    status_code = 416
+    title = 'Range Not Satisfiable'
+    message = 'The requested range does not overlap the available data'
+
+    def __init__(self, message=None, headers=None, content_range=None):
+        super(RangeNotSatisfiable, self).__init__(message, headers)
+        if content_range is not None:
+            self.headers['Content-Range'] = content_range
+
+
+class MethodNotAllowed(NARFError):
+    status_code = 405
+    title = 'Method Not Allowed'
+    message = 'The method is not allowed for the requested URL'
+
+
+class PreconditionFailed(NARFError):
+    status_code = 412
+    title = 'Precondition Failed'
+    message = 'The resource does not match the preconditions of the request'
@@ -1,10 +1,23 @@
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
 from urllib import urlencode
+from weakref import WeakKeyDictionary
 
-from flask import request, url_for
+from flask import current_app, request, url_for
+from werkzeug.routing import BuildError
 
 from flask.ext.narf.filters import Filter
 
 
+def get_raw_value(raw_data, source):
+    """
+    Look up source on a raw item, either a dict or an object
+    """
+    if isinstance(raw_data, dict):
+        return raw_data.get(source)
+    return getattr(raw_data, source, None)
+
+
 class Field(object):
     """
     Base Field Serializer/deserializer
@@ -31,13 +44,39 @@ class Field(object):
         return self.raw_value
 
     def _populate_raw_value(self):
-        if isinstance(self.raw_data, dict):
-            self.raw_value = self.raw_data.get(self.source)
-        else:
-            self.raw_value = getattr(self.raw_data, self.source, None)
+        self.raw_value = get_raw_value(self.raw_data, self.source)
         if self.raw_value is None and self.required:
             raise ValueError('Missing required field "{}"'.format(self.source))
 
+    def describe(self, field_name):
+        """
+        Describe this field for endpoint introspection
+        """
+        description = {
+            'name': field_name,
+            'type': self.__class__.__name__,
+            'pk': self.pk,
+        }
+        if self.display_prompt:
+            description['prompt'] = self.display_prompt
+        if self._source is not None:
+            description['source'] = self._source
+        return description
+
+    def prepare(self, app):
+        """
+        Precompute anything this field needs for serving requests on app
+        """
+        pass
+
+    def clone(self):
+        """
+        Shallow copy of this field, so the declared field is never bound to request data
+        """
+        field = self.__class__.__new__(self.__class__)
+        field.__dict__.update(self.__dict__)
+        return field
+
     def bind(self, parent, field_name, raw_data):
         if self.required is None:
             if isinstance(parent, Filter):
@@ -63,6 +102,322 @@ class StringField(Field):
         return unicode(self.raw_value) if self.raw_value is not None else None
 
 
+class TypedField(Field):
+    """
+    Base class for fields of a specific type
+
+    The converters are built once per declared field (bound copies share them), so converting a
+    value is a single call. None is passed through as is.
+    """
+
+    def __init__(self, **kwargs):
+        super(TypedField, self).__init__(**kwargs)
+        self.to_output = self.build_serializer()
+        self.to_python = self.build_deserializer()
+
+    def build_serializer(self):
+        """
+        Function converting a raw value to its serialized form
+        """
+        return lambda value: value
+
+    def build_deserializer(self):
+        """
+        Function converting an input value to its python type, raising ValueError when invalid
+        """
+        return lambda value: value
+
+    def serialize_value(self):
+        value = self.raw_value
+        return None if value is None else self.to_output(value)
+
+    def deserialize_value(self):
+        value = self.raw_value
+        return None if value is None else self.to_python(value)
+
+
+class IntegerField(TypedField):
+
+    def build_serializer(self):
+        def serialize(value):
+            if type(value) is int:
+                return value
+            return int(value)
+        return serialize
+
+    def build_deserializer(self):
+        return int
+
+
+class FloatField(TypedField):
+
+    def build_serializer(self):
+        def serialize(value):
+            if type(value) is float:
+                return value
+            return float(value)
+        return serialize
+
+    def build_deserializer(self):
+        return float
+
+
+class BooleanField(TypedField):
+    """
+    Boolean values, raw strings and numbers being read with the TRUE_VALUES and FALSE_VALUES
+    spellings
+    """
+
+    TRUE_VALUES = ('true', '1', 'yes', 'on')
+    FALSE_VALUES = ('false', '0', 'no', 'off', '')
+
+    def spellings(self):
+        values = dict.fromkeys(self.TRUE_VALUES, True)
+        values.update(dict.fromkeys(self.FALSE_VALUES, False))
+        return values
+
+    def build_serializer(self):
+        values = self.spellings()
+
+        def serialize(value):
+            if type(value) is bool:
+                return value
+            # raw values such as 'false' or '0' from a text column aren't truthy
+            return values.get(unicode(value).strip().lower(), bool(value))
+        return serialize
+
+    def build_deserializer(self):
+        values = self.spellings()
+
+        def deserialize(value):
+            if type(value) is bool:
+                return value
+            try:
+                return values[unicode(value).strip().lower()]
+            except KeyError:
+                raise ValueError('"{0}" is not a boolean'.format(value))
+        return deserialize
+
+
+class DecimalField(TypedField):
+    """
+    Decimal values, serialized as strings so no precision is lost
+
+    places quantizes the serialized values to that many decimal places.
+    """
+
+    def __init__(self, places=None, **kwargs):
+        self.places = places
+        super(DecimalField, self).__init__(**kwargs)
+
+    def build_serializer(self):
+        if self.places is None:
+            return lambda value: unicode(value)
+        exponent = Decimal(1).scaleb(-self.places)
+
+        def serialize(value):
+            if type(value) is not Decimal:
+                value = Decimal(unicode(value))
+            return unicode(value.quantize(exponent))
+        return serialize
+
+    def build_deserializer(self):
+        def deserialize(value):
+            try:
+                return Decimal(unicode(value).strip())
+            except InvalidOperation:
+                raise ValueError('"{0}" is not a decimal'.format(value))
+        return deserialize
+
+
+class DateTimeField(TypedField):
+    """
+    Datetimes, ISO 8601 formatted unless a strftime format is given
+
+    Formatting is memoized per second since many items share timestamps; only the microseconds
+    are added to the memoized form. Input without a format accepts ISO 8601 without an offset
+    (a trailing Z is ignored).
+    """
+
+    # distinct seconds memoized per field before the memo is cleared
+    MEMO_SIZE = 1024
+
+    def __init__(self, format=None, **kwargs):
+        self.format = format
+        super(DateTimeField, self).__init__(**kwargs)
+
+    def describe(self, field_name):
+        description = super(DateTimeField, self).describe(field_name)
+        if self.format:
+            description['format'] = self.format
+        return description
+
+    def build_serializer(self):
+        date_format = self.format
+        if date_format is not None and '%f' in date_format:
+            return lambda value: value.strftime(date_format)
+        memo = self.memo = {}
+        memo_size = self.MEMO_SIZE
+
+        def serialize(value):
+            second = value.replace(microsecond=0)
+            key = (second, second.utcoffset())
+            parts = memo.get(key)
+            if parts is None:
+                if len(memo) >= memo_size:
+                    memo.clear()
+                if date_format is None:
+                    # split around where isoformat puts the microseconds
+                    formatted = second.isoformat()
+                    parts = memo[key] = (formatted[:19], formatted[19:])
+                else:
+                    parts = memo[key] = (second.strftime(date_format), None)
+            if parts[1] is None:
+                return parts[0]
+            if value.microsecond:
+                return '{0}.{1:06d}{2}'.format(parts[0], value.microsecond, parts[1])
+            return parts[0] + parts[1]
+        return serialize
+
+    def build_deserializer(self):
+        date_format = self.format
+
+        def deserialize(value):
+            if isinstance(value, datetime):
+                return value
+            if date_format is not None:
+                return datetime.strptime(value, date_format)
+            value = value.rstrip('Z')
+            if '.' in value:
+                return datetime.strptime(value, '%Y-%m-%dT%H:%M:%S.%f')
+            return datetime.strptime(value, '%Y-%m-%dT%H:%M:%S')
+        return deserialize
+
+
+class DateField(TypedField):
+
+    def build_serializer(self):
+        return lambda value: value.isoformat()
+
+    def build_deserializer(self):
+        def deserialize(value):
+            if isinstance(value, datetime):
+                return value.date()
+            if hasattr(value, 'isoformat'):
+                return value
+            return datetime.strptime(value, '%Y-%m-%d').date()
+        return deserialize
+
+
+class EnumField(TypedField):
+    """
+    One of a fixed set of choices
+
+    Input is matched against the text of the choices and gives back the choice itself.
+    """
+
+    def __init__(self, choices, **kwargs):
+        self.choices = list(choices)
+        super(EnumField, self).__init__(**kwargs)
+
+    def describe(self, field_name):
+        description = super(EnumField, self).describe(field_name)
+        description['choices'] = self.choices
+        return description
+
+    def build_deserializer(self):
+        choices = {unicode(choice): choice for choice in self.choices}
+
+        def deserialize(value):
+            try:
+                return choices[unicode(value)]
+            except KeyError:
+                raise ValueError('"{0}" is not one of {1}'.format(
+                    value, ', '.join(sorted(choices))
+                ))
+        return deserialize
+
+
+class ListField(TypedField):
+    """
+    List of values of another typed field
+
+    Input can also be a comma separated string (as in query strings).
+    """
+
+    def __init__(self, field, **kwargs):
+        self.field = field
+        super(ListField, self).__init__(**kwargs)
+
+    def describe(self, field_name):
+        description = super(ListField, self).describe(field_name)
+        description['items'] = self.field.describe(None)
+        return description
+
+    def build_serializer(self):
+        to_output = self.field.to_output
+        return lambda values: [None if value is None else to_output(value) for value in values]
+
+    def build_deserializer(self):
+        to_python = self.field.to_python
+
+        def deserialize(values):
+            if isinstance(values, basestring):
+                values = values.split(',') if values else []
+            return [None if value is None else to_python(value) for value in values]
+        return deserialize
+
+
+class NestedField(TypedField):
+    """
+    Item serialized with its own Serializer
+    """
+
+    def __init__(self, serializer_class, **kwargs):
+        self.serializer_class = serializer_class
+        super(NestedField, self).__init__(**kwargs)
+
+    def describe(self, field_name):
+        description = super(NestedField, self).describe(field_name)
+        description['serializer'] = self.serializer_class.describe()
+        return description
+
+    def build_serializer(self):
+        serializer_class = self.serializer_class
+
+        def serialize(value):
+            serializer = serializer_class(raw_data=value)
+            return {field.field_name: field.serialize_value() for field in serializer.fields}
+        return serialize
+
+    def build_deserializer(self):
+        serializer_class = self.serializer_class
+
+        def deserialize(value):
+            if not isinstance(value, dict):
+                raise ValueError('expected an object')
+            serializer = serializer_class(raw_data=value)
+            return {field.field_name: field.deserialize_value() for field in serializer.fields}
+        return deserialize
+
+
+class LoadedField(Field):
+    """
+    Value loaded by a BatchLoader, keyed by the raw value
+
+    Endpoints prime the loader with the keys of all the items of a list before serializing it,
+    so the related values are loaded in batches instead of once per item.
+    """
+
+    def __init__(self, loader, **kwargs):
+        self.loader = loader
+        super(LoadedField, self).__init__(**kwargs)
+
+    def serialize_value(self):
+        key = self.raw_value
+        return None if key is None else self.loader.get(key)
+
+
 class FieldRef(Field):
 
     def _populate_raw_value(self):
@@ -74,6 +429,12 @@ class FieldRef(Field):
     def serialize_value(self):
         return getattr(self.parent, self.source).serialize_value()
 
+    def resolve(self, parent, field_name):
+        """
+        The field of parent this reference points to when used as field_name
+        """
+        return getattr(parent, self._source if self._source is not None else field_name)
+
 
 class URIField(StringField):
     """
@@ -86,14 +447,38 @@ class URIField(StringField):
         self.relation = relation
         super(URIField, self).__init__(**kwargs)
 
+    def describe(self, field_name):
+        description = super(URIField, self).describe(field_name)
+        description['relation'] = self.relation or field_name
+        return description
+
 
 class RelatedURIField(URIField):
 
     def __init__(self, related_endpoint, filters=None, **kwargs):
         self.related_endpoint = related_endpoint.lstrip('/')
         self.filters = filters or {}
+        self.url_paths = WeakKeyDictionary()
         super(RelatedURIField, self).__init__(**kwargs)
 
+    def describe(self, field_name):
+        description = super(RelatedURIField, self).describe(field_name)
+        description['related_endpoint'] = self.related_endpoint
+        return description
+
+    def prepare(self, app):
+        """
+        Build the path of the related endpoint once per app instead of calling url_for per item
+
+        The path is built without the script root, which serialize_value gets from the url root
+        of the request, so links are the same with or without it.
+        """
+        adapter = app.url_map.bind(app.config.get('SERVER_NAME') or 'localhost')
+        try:
+            self.url_paths[app] = adapter.build(self.related_endpoint)
+        except BuildError:
+            pass
+
     def _populate_raw_value(self):
         """
         Override to avoid looking for the raw_value since we generate it
@@ -105,9 +490,13 @@ class RelatedURIField(URIField):
         url_root = request.url_root.rstrip('/')
         for param, value in self.filters.items():
             if isinstance(value, FieldRef):
-                value.bind(self.parent, param, self.raw_data)
-                params[param] = value.serialize_value()
+                params[param] = value.resolve(self.parent, param).serialize_value()
             else:
                 params[param] = value
         param_string = '?{0}'.format(urlencode(params)) if params else ''
-        return u'{0}{1}{2}'.format(url_root, url_for(self.related_endpoint), param_string)
+        url_path = self.url_paths.get(current_app._get_current_object()) if self.url_paths else None
+        if url_path is None:
+            # url_for includes the script root, which the url root has as well
+            url_root = request.host_url.rstrip('/')
+            url_path = url_for(self.related_endpoint)
+        return u'{0}{1}{2}'.format(url_root, url_path, param_string)
@@ -1,5 +1,84 @@
+from collections import namedtuple
+
 from flask import request
 
+from flask.ext.narf.cache import LRUCache
+from flask.ext.narf.exceptions import ValidationError
+
+
+def freeze(value):
+    """
+    Hashable version of a validated value
+    """
+    if isinstance(value, (list, tuple)):
+        return tuple(freeze(item) for item in value)
+    if isinstance(value, dict):
+        return tuple(sorted((key, freeze(item)) for key, item in value.items()))
+    return value
+
+
+# validated value of a filter, as held by FilterValues
+FilterValue = namedtuple('FilterValue', ['filter_field', 'validated_value'])
+
+
+class FilterValues(object):
+    """
+    Immutable validated values of a FilterSet
+
+    Every filter is available as an attribute holding a FilterValue, like on a validated
+    FilterSet, so views can use either. The other attributes of the FilterSet class (methods,
+    properties, constants) are bound to the values, keeping the interface of FilterSet
+    subclasses. Instances are shared by concurrent requests with the same filters, so list
+    values are held as tuples.
+    """
+
+    __slots__ = ('filter_set_class', 'filters', '_key')
+
+    def __init__(self, filter_set_class, filters, key):
+        object.__setattr__(self, 'filter_set_class', filter_set_class)
+        object.__setattr__(self, 'filters', filters)
+        object.__setattr__(self, '_key', key)
+
+    @classmethod
+    def from_filter_set(cls, filter_set):
+        """
+        Values of a validated FilterSet
+        """
+        filters = tuple(
+            FilterValue(
+                filter_obj.filter_field,
+                tuple(filter_obj.validated_value)
+                if isinstance(filter_obj.validated_value, list) else filter_obj.validated_value
+            )
+            for filter_obj in filter_set.filters
+        )
+        return cls(filter_set.__class__, filters, filter_set.key())
+
+    def __reduce__(self):
+        # pickled (e.g. for job processes) by its state, since attributes can't be set
+        return (self.__class__, (self.filter_set_class, self.filters, self._key))
+
+    def __getattr__(self, name):
+        for filter_value in self.filters:
+            if filter_value.filter_field == name:
+                return filter_value
+        for klass in self.filter_set_class.__mro__:
+            if name in klass.__dict__:
+                attribute = klass.__dict__[name]
+                if hasattr(attribute, '__get__'):
+                    return attribute.__get__(self, self.filter_set_class)
+                return attribute
+        raise AttributeError(name)
+
+    def __setattr__(self, name, value):
+        raise AttributeError('FilterValues are immutable')
+
+    def key(self):
+        """
+        Hashable key of the validated filter values
+        """
+        return self._key
+
 
 class Filter(object):
 
@@ -9,12 +88,31 @@ class Filter(object):
     def validate_input(self):
         self.validated_value = self.field_type.deserialize_value()
 
-    def bind(self, filter_field):
+    def clone(self):
+        """
+        Copy of this filter (and its field), so the declared filter is never bound to a request
+        """
+        filter_obj = self.__class__.__new__(self.__class__)
+        filter_obj.__dict__.update(self.__dict__)
+        filter_obj.field_type = self.field_type.clone()
+        return filter_obj
+
+    def describe(self, filter_field):
+        """
+        Describe this filter for endpoint introspection
+        """
+        description = self.field_type.describe(filter_field)
+        description.pop('pk', None)
+        return description
+
+    def bind(self, filter_field, args=None):
         """
         Bind the name of the filter - this is what appears to the API
+
+        The value is looked up in args, the query string of the current request by default.
         """
         self.filter_field = filter_field
-        self.field_type.bind(self, self.filter_field, request.args)
+        self.field_type.bind(self, self.filter_field, request.args if args is None else args)
 
 
 class FilterSet(object):
@@ -22,15 +120,101 @@ class FilterSet(object):
     FilterSet Base class
 
     For defining various kinds of filters
+
+    parse() validates the filters once per distinct query string and caches the resulting
+    FilterValues in an LRU of PARSE_CACHE_SIZE entries per FilterSet.
     """
 
-    def __init__(self):
+    PARSE_CACHE_SIZE = 1024
+
+    def __init__(self, args=None):
         self.filters = []
-        for filter_name, filter_obj in self.__class__.__dict__.items():
-            if isinstance(filter_obj, Filter):
-                filter_obj.bind(filter_name)
-                self.filters.append(filter_obj)
+        for filter_name, declared_filter in self.compile():
+            filter_obj = declared_filter.clone()
+            setattr(self, filter_name, filter_obj)
+            filter_obj.bind(filter_name, args)
+            self.filters.append(filter_obj)
+
+    @classmethod
+    def compile(cls):
+        """
+        Collect the Filter's defined on this FilterSet once per class
+        """
+        declared_filters = cls.__dict__.get('_declared_filters')
+        if declared_filters is None:
+            declared_filters = [
+                (filter_name, filter_obj) for filter_name, filter_obj in cls.__dict__.items()
+                if isinstance(filter_obj, Filter)
+            ]
+            cls._declared_filters = declared_filters
+        return declared_filters
+
+    @classmethod
+    def sources(cls):
+        """
+        Query string parameters read by the filters, once per class
+        """
+        sources = cls.__dict__.get('_sources')
+        if sources is None:
+            sources = tuple(
+                filter_obj.field_type._source if filter_obj.field_type._source is not None
+                else filter_name
+                for filter_name, filter_obj in cls.compile()
+            )
+            cls._sources = sources
+        return sources
+
+    @classmethod
+    def parse(cls, args=None):
+        """
+        FilterValues validated from args, the query string of the current request by default
+
+        The query string is normalized to the values of the parameters the filters read, so
+        ignored parameters and their order don't matter. Invalid input raises a ValidationError
+        every time and is never cached.
+        """
+        if args is None:
+            args = request.args
+        parse_cache = cls.__dict__.get('_parse_cache')
+        if parse_cache is None:
+            parse_cache = LRUCache(max_entries=cls.PARSE_CACHE_SIZE)
+            cls._parse_cache = parse_cache
+        key = tuple(args.get(source) for source in cls.sources())
+        values = parse_cache.get(key)
+        if values is None:
+            filter_set = cls(args)
+            filter_set.validate_inputs()
+            values = FilterValues.from_filter_set(filter_set)
+            parse_cache.set(key, values)
+        return values
+
+    def key(self):
+        """
+        Hashable key of the validated filter values
+        """
+        return tuple(sorted(
+            (filter_obj.filter_field, freeze(filter_obj.validated_value))
+            for filter_obj in self.filters
+        ))
 
     def validate_inputs(self):
         for filter_obj in self.filters:
-            filter_obj.validate_input()
+            try:
+                filter_obj.validate_input()
+            except ValueError as error:
+                raise ValidationError(
+                    'Invalid value for filter "{0}": {1}'.format(filter_obj.filter_field, error)
+                )
+
+    @classmethod
+    def describe(cls):
+        """
+        Describe this FilterSet's filters for endpoint introspection
+        """
+        return {
+            'name': cls.__name__,
+            'filters': sorted(
+                (filter_obj.describe(filter_name) for filter_name, filter_obj in cls.compile()),
+                key=lambda description: description['name']
+            ),
+        }
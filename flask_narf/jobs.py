@@ -0,0 +1,138 @@
+from multiprocessing.pool import Pool, ThreadPool
+from threading import Lock
+from time import time
+from uuid import uuid4
+
+from flask.ext.narf.exceptions import ServiceUnavailable
+
+
+class Job(object):
+    """
+    A view function call running in the background
+
+    context is kept for the endpoint serving the result, such as the state of the submitting
+    request.
+    """
+
+    def __init__(self, job_id, endpoint, async_result, context=None):
+        self.id = job_id
+        self.endpoint = endpoint
+        self.async_result = async_result
+        self.context = context
+        self.submitted = time()
+        self.finished = None
+
+    def ready(self):
+        return self.async_result.ready()
+
+    @property
+    def status(self):
+        if not self.async_result.ready():
+            return 'pending'
+        return 'done' if self.async_result.successful() else 'failed'
+
+    def result(self):
+        """
+        Result of the view function, raising its exception if it failed
+        """
+        return self.async_result.get()
+
+
+class JobManager(object):
+    """
+    Runs view functions of job endpoints on a bounded worker pool
+
+    Uses `workers` threads, or processes when processes is set (the view function, its arguments
+    and its result must be picklable then). At most max_pending jobs wait or run at once, further
+    submissions are rejected with a 503. Results are dropped ttl seconds after the job is seen
+    finished. The pool is only started by the first submission.
+    """
+
+    def __init__(self, workers=4, processes=False, ttl=300, max_pending=100, retry_after=1):
+        self.workers = workers
+        self.processes = processes
+        self.ttl = ttl
+        self.max_pending = max_pending
+        self.retry_after = retry_after
+        self.lock = Lock()
+        self.pool = None
+        self.jobs = {}
+        self.submitted = 0
+        self.rejected = 0
+        self.expired = 0
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(
+            workers=config.get('NARF_JOB_WORKERS', 4),
+            processes=config.get('NARF_JOB_PROCESSES', False),
+            ttl=config.get('NARF_JOB_TTL', 300),
+            max_pending=config.get('NARF_JOB_MAX_PENDING', 100),
+        )
+
+    def expire(self):
+        """
+        Drop the results of jobs finished for longer than the ttl (call with the lock held)
+        """
+        now = time()
+        for job_id, job in self.jobs.items():
+            if job.finished is None:
+                if job.ready():
+                    job.finished = now
+            elif job.finished + self.ttl < now:
+                del self.jobs[job_id]
+                self.expired += 1
+
+    def pending(self):
+        return sum(1 for job in self.jobs.itervalues() if job.finished is None)
+
+    def submit(self, endpoint, func, args, kwargs, context=None):
+        """
+        Start running func(*args, **kwargs) for an endpoint, returning its Job (with context)
+        """
+        with self.lock:
+            self.expire()
+            if self.max_pending is not None and self.pending() >= self.max_pending:
+                self.rejected += 1
+                raise ServiceUnavailable('Too many pending jobs', retry_after=self.retry_after)
+            if self.pool is None:
+                self.pool = (Pool if self.processes else ThreadPool)(self.workers)
+            async_result = self.pool.apply_async(func, args, kwargs)
+            job = Job(uuid4().hex, endpoint, async_result, context)
+            self.jobs[job.id] = job
+            self.submitted += 1
+        return job
+
+    def get(self, job_id):
+        """
+        The job with this id, or None if it's unknown or expired
+        """
+        with self.lock:
+            self.expire()
+            return self.jobs.get(job_id)
+
+    def close(self):
+        """
+        Stop the worker pool, abandoning unfinished jobs
+        """
+        with self.lock:
+            if self.pool is not None:
+                self.pool.terminate()
+                self.pool = None
+            self.jobs.clear()
+
+    def stats(self):
+        """
+        Snapshot of the job counts
+        """
+        with self.lock:
+            self.expire()
+            return {
+                'workers': self.workers,
+                'processes': self.processes,
+                'jobs': len(self.jobs),
+                'pending': self.pending(),
+                'submitted': self.submitted,
+                'rejected': self.rejected,
+                'expired': self.expired,
+            }
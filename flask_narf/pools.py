@@ -0,0 +1,205 @@
+from collections import deque
+from sqlite3 import connect
+from threading import Condition, Lock
+from time import time
+
+from flask.ext.narf.exceptions import ServiceUnavailable
+
+
+class ResourcePool(object):
+    """
+    Pool of reusable resources, such as database connections
+
+    Resources are made by factory, at most max_size of them at once. min_size of them are made
+    up front and kept even when idle; beyond that, resources idle for longer than max_idle
+    seconds are closed. Checking out a resource waits up to timeout seconds for one to be
+    returned when the pool is exhausted (None waits until one is) and raises ServiceUnavailable
+    after that.
+
+    health_check is called on idle resources before handing them out and reset on returned
+    ones; a resource failing either (returning False or raising) is closed instead of reused.
+    """
+
+    def __init__(self, factory, min_size=0, max_size=10, timeout=None, max_idle=None,
+                 health_check=None, reset=None, close=None, retry_after=1):
+        if min_size > max_size:
+            raise ValueError('min_size can not be larger than max_size')
+        self.factory = factory
+        self.min_size = min_size
+        self.max_size = max_size
+        self.timeout = timeout
+        self.max_idle = max_idle
+        self.health_check = health_check
+        self.reset = reset
+        self.close = close
+        self.retry_after = retry_after
+        self.condition = Condition(Lock())
+        # idle resources as (resource, returned at), most recently returned last
+        self.idle = deque()
+        self.size = 0
+        self.in_use = 0
+        self.peak_in_use = 0
+        self.created = 0
+        self.discarded = 0
+        self.evicted = 0
+        self.waits = 0
+        self.timeouts = 0
+        for _ in xrange(min_size):
+            self.idle.append((self.factory(), time()))
+            self.size += 1
+            self.created += 1
+
+    def destroy(self, resource):
+        """
+        Close a resource that left the pool (call with the lock held)
+        """
+        self.size -= 1
+        if self.close is not None:
+            try:
+                self.close(resource)
+            except Exception:
+                pass
+
+    def is_healthy(self, resource):
+        if self.health_check is None:
+            return True
+        try:
+            return self.health_check(resource) is not False
+        except Exception:
+            return False
+
+    def evict_idle(self):
+        """
+        Close the resources idle for longer than max_idle, keeping min_size resources
+        """
+        if self.max_idle is None:
+            return
+        deadline = time() - self.max_idle
+        with self.condition:
+            while self.idle and self.idle[0][1] < deadline and self.size > self.min_size:
+                resource, _ = self.idle.popleft()
+                self.destroy(resource)
+                self.evicted += 1
+
+    def acquire(self):
+        """
+        Check out a resource
+
+        Health checks and new resources are made without holding the pool lock.
+        """
+        self.evict_idle()
+        deadline = time() + self.timeout if self.timeout is not None else None
+        while True:
+            with self.condition:
+                while not self.idle and self.size >= self.max_size:
+                    remaining = deadline - time() if deadline is not None else None
+                    if remaining is not None and remaining <= 0:
+                        self.timeouts += 1
+                        raise ServiceUnavailable(
+                            'No resources available', retry_after=self.retry_after
+                        )
+                    self.waits += 1
+                    self.condition.wait(remaining)
+                self.in_use += 1
+                self.peak_in_use = max(self.peak_in_use, self.in_use)
+                if self.idle:
+                    resource, _ = self.idle.pop()
+                else:
+                    # reserve the slot so concurrent checkouts don't go over max_size
+                    resource = None
+                    self.size += 1
+            if resource is None:
+                try:
+                    resource = self.factory()
+                except Exception:
+                    with self.condition:
+                        self.size -= 1
+                        self.in_use -= 1
+                        self.condition.notify()
+                    raise
+                with self.condition:
+                    self.created += 1
+                return resource
+            if self.is_healthy(resource):
+                return resource
+            with self.condition:
+                self.in_use -= 1
+                self.destroy(resource)
+                self.discarded += 1
+
+    def release(self, resource):
+        """
+        Return a checked out resource to the pool
+        """
+        healthy = True
+        if self.reset is not None:
+            try:
+                healthy = self.reset(resource) is not False
+            except Exception:
+                healthy = False
+        with self.condition:
+            self.in_use -= 1
+            if healthy:
+                self.idle.append((resource, time()))
+            else:
+                self.destroy(resource)
+                self.discarded += 1
+            self.condition.notify()
+
+    def clear(self):
+        """
+        Close every idle resource
+        """
+        with self.condition:
+            while self.idle:
+                resource, _ = self.idle.pop()
+                self.destroy(resource)
+
+    def stats(self):
+        """
+        Snapshot of the pool utilization and counters
+        """
+        with self.condition:
+            return {
+                'size': self.size,
+                'idle': len(self.idle),
+                'in_use': self.in_use,
+                'min_size': self.min_size,
+                'max_size': self.max_size,
+                'utilization': float(self.in_use) / self.max_size if self.max_size else 0.0,
+                'peak_in_use': self.peak_in_use,
+                'created': self.created,
+                'discarded': self.discarded,
+                'evicted': self.evicted,
+                'waits': self.waits,
+                'timeouts': self.timeouts,
+            }
+
+
+def ping_connection(connection):
+    connection.execute('SELECT 1')
+
+
+def rollback_connection(connection):
+    # drop whatever the request left uncommitted
+    connection.rollback()
+
+
+class SQLitePool(ResourcePool):
+    """
+    Pool of SQLite connections to a database file
+
+    Connections are checked with a trivial query before being handed out and rolled back when
+    returned. Extra keyword arguments go to the ResourcePool.
+    """
+
+    def __init__(self, database, **kwargs):
+        self.database = database
+        kwargs.setdefault('health_check', ping_connection)
+        kwargs.setdefault('reset', rollback_connection)
+        kwargs.setdefault('close', lambda connection: connection.close())
+        super(SQLitePool, self).__init__(self.connect, **kwargs)
+
+    def connect(self):
+        # connections are handed to whichever thread serves the next request
+        return connect(self.database, check_same_thread=False)
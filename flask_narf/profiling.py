@@ -0,0 +1,321 @@
+from collections import Counter
+from contextlib import contextmanager
+from cProfile import Profile
+from os import path
+from pstats import Stats
+from random import random
+from threading import Lock
+from time import time
+from uuid import uuid4
+
+from flask import current_app, request
+
+try:
+    import tracemalloc
+except ImportError:
+    # Python 2 only has tracemalloc through the pytracemalloc backport
+    tracemalloc = None
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+class Profiler(object):
+    """
+    Per-request Profiler
+
+    Runs individual endpoint requests under cProfile when they are explicitly requested through a
+    trusted header or picked by the sampling rate.
+    """
+
+    def __init__(self, header=None, token=None, sample_rate=0.0, output_dir=None, summary_size=5):
+        self.header = header
+        self.token = token
+        self.sample_rate = sample_rate
+        self.output_dir = output_dir
+        self.summary_size = summary_size
+
+    @classmethod
+    def from_config(cls, config):
+        """
+        Build a Profiler from the app config, or None when profiling is disabled
+        """
+        token = config.get('NARF_PROFILE_TOKEN')
+        sample_rate = config.get('NARF_PROFILE_SAMPLE_RATE') or 0.0
+        if not token and sample_rate <= 0:
+            return None
+        return cls(
+            header=config.get('NARF_PROFILE_HEADER', 'X-NARF-Profile'),
+            token=token,
+            sample_rate=sample_rate,
+            output_dir=config.get('NARF_PROFILE_DIR'),
+            summary_size=config.get('NARF_PROFILE_SUMMARY_SIZE', 5)
+        )
+
+    def is_requested(self):
+        """
+        Whether the client explicitly asked for profiling with the trusted token
+        """
+        return bool(self.token) and request.headers.get(self.header) == self.token
+
+    def should_profile(self):
+        """
+        Whether the current request should be profiled
+        """
+        return self.is_requested() or (self.sample_rate > 0 and random() < self.sample_rate)
+
+    def summarize(self, stats):
+        """
+        Summarize the most expensive functions (by own time) of a profile
+        """
+        entries = sorted(stats.stats.items(), key=lambda entry: entry[1][2], reverse=True)
+        summary = []
+        for (filename, line, func_name), (_, _, own_time, _, _) in entries[:self.summary_size]:
+            summary.append('{0} ({1}:{2}) {3:.6f}'.format(
+                func_name, path.basename(filename), line, own_time
+            ))
+        return summary
+
+    def dump(self, endpoint, stats):
+        """
+        Store the profile as a pstats file and return its path
+        """
+        filename = path.join(self.output_dir, '{0}-{1}-{2}.prof'.format(
+            endpoint.func.__name__, int(time() * 1000), uuid4().hex[:8]
+        ))
+        stats.dump_stats(filename)
+        return filename
+
+    def run(self, endpoint, args, kwargs):
+        """
+        Handle the request for this endpoint under the profiler
+        """
+        requested = self.is_requested()
+        profile = Profile()
+        response = profile.runcall(endpoint.handle_request, *args, **kwargs)
+        stats = Stats(profile)
+        summary = self.summarize(stats)
+        filename = self.dump(endpoint, stats) if self.output_dir else None
+        if requested:
+            # Only expose the profile to clients that hold the trusted token
+            response.headers['X-NARF-Profile-Calls'] = str(stats.total_calls)
+            response.headers['X-NARF-Profile-Time'] = '{0:.6f}'.format(stats.total_tt)
+            response.headers['X-NARF-Profile-Summary'] = '; '.join(summary)
+            if filename:
+                response.headers['X-NARF-Profile-File'] = path.basename(filename)
+        elif filename is None:
+            current_app.logger.info(
+                'Profiled %s: %d calls in %.6fs; %s',
+                endpoint.path, stats.total_calls, stats.total_tt, '; '.join(summary)
+            )
+        return response
+
+
+def max_rss():
+    """
+    Peak resident set size of the process in bytes (0 where getrusage isn't available)
+    """
+    if resource is None:
+        return 0
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class MemoryTracker(object):
+    """
+    Per-request memory instrumentation
+
+    Tracks the memory allocated by each phase (view, serialization, response) of the requests that
+    send the trusted header or are picked by the sampling rate, aggregated per endpoint and phase.
+    With tracemalloc the peak, the bytes still allocated at the end of the phase and the top
+    allocation sites are recorded. Without it only the growth of the peak RSS of the process is.
+
+    tracemalloc traces the whole process, so a single request is tracked at a time: requests
+    picked while one is tracked are handled untracked (counted as skipped). The allocations of
+    requests handled at the same time are still included. When something else started tracing,
+    its traces and peak are left alone and phases are measured as differences.
+    """
+
+    def __init__(self, header=None, token=None, sample_rate=0.0, top_sites=5, frames=1):
+        self.header = header
+        self.token = token
+        self.sample_rate = sample_rate
+        self.top_sites = top_sites
+        self.frames = frames
+        self.lock = Lock()
+        self.tracking = 0
+        self.started = False
+        self.skipped = 0
+        self.phases = {}
+
+    @classmethod
+    def from_config(cls, config):
+        """
+        Build a MemoryTracker from the app config, or None when memory tracking is disabled
+        """
+        token = config.get('NARF_MEMORY_TOKEN')
+        sample_rate = config.get('NARF_MEMORY_SAMPLE_RATE') or 0.0
+        if not token and sample_rate <= 0:
+            return None
+        return cls(
+            header=config.get('NARF_MEMORY_HEADER', 'X-NARF-Memory'),
+            token=token,
+            sample_rate=sample_rate,
+            top_sites=config.get('NARF_MEMORY_TOP_SITES', 5),
+            frames=config.get('NARF_MEMORY_FRAMES', 1)
+        )
+
+    @property
+    def backend(self):
+        return 'tracemalloc' if tracemalloc is not None else 'rusage'
+
+    def is_requested(self):
+        """
+        Whether the client explicitly asked for memory tracking with the trusted token
+        """
+        return bool(self.token) and request.headers.get(self.header) == self.token
+
+    def should_track(self):
+        """
+        Whether the memory of the current request should be tracked
+        """
+        return self.is_requested() or (self.sample_rate > 0 and random() < self.sample_rate)
+
+    def start(self):
+        """
+        Start tracking a request, returning False when another one is tracked already
+
+        Allocations are traced from here, unless something else traces them already.
+        """
+        with self.lock:
+            if self.tracking:
+                self.skipped += 1
+                return False
+            if tracemalloc is not None and not tracemalloc.is_tracing():
+                tracemalloc.start(self.frames)
+                self.started = True
+            self.tracking += 1
+            return True
+
+    def stop(self):
+        with self.lock:
+            self.tracking -= 1
+            if not self.tracking and self.started:
+                tracemalloc.stop()
+                self.started = False
+
+    @contextmanager
+    def phase(self, sample, name):
+        """
+        Measure the memory allocated by a phase of a tracked request into sample
+        """
+        if tracemalloc is None:
+            before = max_rss()
+            try:
+                yield
+            finally:
+                sample[name] = {'peak': max_rss() - before, 'retained': None, 'sites': []}
+            return
+        before = None
+        current_before = peak_before = 0
+        if self.started:
+            # only this request is traced by us, so the traces can be cleared for the phase
+            tracemalloc.clear_traces()
+        else:
+            # someone else's traces are kept, the phase is what changed during it
+            current_before, peak_before = tracemalloc.get_traced_memory()
+            before = self.snapshot()
+        try:
+            yield
+        finally:
+            current, peak = tracemalloc.get_traced_memory()
+            retained = current - current_before
+            # a peak reached before the phase can't be told apart, the retained size is a bound
+            peak = peak - current_before if peak > peak_before else max(retained, 0)
+            snapshot = self.snapshot()
+            if before is None:
+                statistics = [
+                    (statistic.traceback[0], statistic.size)
+                    for statistic in snapshot.statistics('lineno')
+                ]
+            else:
+                statistics = [
+                    (statistic.traceback[0], statistic.size_diff)
+                    for statistic in snapshot.compare_to(before, 'lineno')
+                    if statistic.size_diff > 0
+                ]
+            sites = [
+                ('{0}:{1}'.format(frame.filename, frame.lineno), size)
+                for frame, size in statistics[:self.top_sites]
+            ]
+            sample[name] = {'peak': peak, 'retained': retained, 'sites': sites}
+
+    def snapshot(self):
+        """
+        Snapshot of the traced allocations, without those of tracemalloc itself
+        """
+        return tracemalloc.take_snapshot().filter_traces([
+            tracemalloc.Filter(False, tracemalloc.__file__)
+        ])
+
+    def record(self, endpoint, sample):
+        """
+        Add the phases measured for a request to the totals of its endpoint
+        """
+        with self.lock:
+            for name, measured in sample.items():
+                key = (endpoint.func.__name__, name)
+                totals = self.phases.get(key)
+                if totals is None:
+                    totals = self.phases[key] = {
+                        'samples': 0, 'peak': 0, 'max_peak': 0, 'retained': 0, 'sites': Counter()
+                    }
+                totals['samples'] += 1
+                totals['peak'] += measured['peak']
+                totals['max_peak'] = max(totals['max_peak'], measured['peak'])
+                totals['retained'] += measured['retained'] or 0
+                for site, size in measured['sites']:
+                    totals['sites'][site] += size
+
+    def run(self, endpoint, args, kwargs):
+        """
+        Handle the request for this endpoint with its memory tracked
+        """
+        if not self.start():
+            return endpoint.handle_request(*args, **kwargs)
+        sample = {}
+        endpoint.local.memory_sample = sample
+        try:
+            response = endpoint.handle_request(*args, **kwargs)
+        finally:
+            self.stop()
+            endpoint.local.memory_sample = None
+        self.record(endpoint, sample)
+        if self.is_requested():
+            # Only expose the measurements to clients that hold the trusted token
+            response.headers['X-NARF-Memory-Peak'] = '; '.join(
+                '{0}={1}'.format(name, sample[name]['peak']) for name in sorted(sample)
+            )
+        return response
+
+    def stats(self):
+        """
+        Memory allocated per endpoint and phase of the tracked requests, in bytes
+        """
+        endpoints = {}
+        with self.lock:
+            for (name, phase), totals in self.phases.items():
+                samples = totals['samples']
+                endpoints.setdefault(name, {})[phase] = {
+                    'samples': samples,
+                    'mean_peak': totals['peak'] // samples,
+                    'max_peak': totals['max_peak'],
+                    'mean_retained': totals['retained'] // samples,
+                    'top_sites': totals['sites'].most_common(self.top_sites),
+                }
+        return {
+            'backend': self.backend, 'tracking': self.tracking, 'skipped': self.skipped,
+            'endpoints': endpoints,
+        }
@@ -0,0 +1,107 @@
+from itertools import islice
+
+from flask import request
+from werkzeug.http import parse_range_header
+
+from flask.ext.narf.exceptions import RangeNotSatisfiable
+
+
+def parse_range(units):
+    """
+    The single range of the Range header of the current request if it's in these units
+
+    Ranges in other units, malformed headers and multiple ranges are ignored, so the whole
+    representation is served instead (as RFC 7233 allows).
+    """
+    parsed = parse_range_header(request.headers.get('Range'))
+    if parsed is None or parsed.units != units or len(parsed.ranges) != 1:
+        return None
+    return parsed
+
+
+class ItemRange(object):
+    """
+    Range of items of a list result requested with `Range: items=start-end`
+
+    start and stop follow slice semantics (stop excluded, None for an open range); a negative
+    start without a stop selects that many items from the end.
+    """
+
+    UNITS = 'items'
+
+    def __init__(self, start, stop=None):
+        self.start = start
+        self.stop = stop
+
+    @classmethod
+    def from_request(cls):
+        """
+        The item range requested by the current request, or None
+        """
+        parsed = parse_range(cls.UNITS)
+        if parsed is None:
+            return None
+        start, stop = parsed.ranges[0]
+        return cls(start, stop)
+
+    def key(self):
+        return (self.start, self.stop)
+
+    def limit(self):
+        """
+        Number of leading items the range needs, or None when it needs all of them
+        """
+        if self.start < 0 or self.stop is None:
+            return None
+        return self.stop
+
+    def select(self, items, total=None):
+        """
+        Select the range from the items of a view function result, returns (items, Content-Range)
+
+        Results supporting slices (lists, database queries) are sliced, other iterables are
+        consumed up to the end of the range only, so the skipped items are never serialized.
+        The total is only reported for results with a length, or given as total when the items
+        were already cut down to the limit.
+        """
+        if total is None and hasattr(items, '__len__'):
+            total = len(items)
+        start, stop = self.start, self.stop
+        if start < 0:
+            if total is None:
+                items = list(items)
+                total = len(items)
+            start, stop = max(total + start, 0), total
+        if total is not None:
+            stop = total if stop is None else min(stop, total)
+            if start >= stop:
+                raise RangeNotSatisfiable(content_range='items */{0}'.format(total))
+        if hasattr(items, '__getitem__'):
+            selected = items[start:stop]
+        else:
+            selected = islice(items, start, stop)
+        if total is None:
+            selected = list(selected)
+            if not selected:
+                raise RangeNotSatisfiable(content_range='items */*')
+            stop = start + len(selected)
+        content_range = 'items {0}-{1}/{2}'.format(
+            start, stop - 1, '*' if total is None else total
+        )
+        return selected, content_range
+
+
+def select_bytes(body):
+    """
+    Apply the `Range: bytes=...` header of the current request to a rendered body
+
+    Returns (body, Content-Range), or None when no byte range was requested.
+    """
+    parsed = parse_range('bytes')
+    if parsed is None:
+        return None
+    length = len(body)
+    byte_range = parsed.range_for_length(length)
+    if byte_range is None:
+        raise RangeNotSatisfiable(content_range='bytes */{0}'.format(length))
+    return body[byte_range[0]:byte_range[1]], parsed.to_content_range_header(length)
@@ -0,0 +1,351 @@
+from collections import OrderedDict
+from contextlib import contextmanager
+from hashlib import md5
+from threading import RLock
+
+from flask import json, request, url_for
+from werkzeug.http import quote_etag
+
+from flask.ext.narf.exceptions import (
+    BadRequest, MethodNotAllowed, NotFound, PreconditionFailed, ValidationError
+)
+from flask.ext.narf.fields import IntegerField, get_raw_value
+
+
+# methods that never write, HEAD being routed by Flask wherever GET is
+READ_METHODS = ('GET', 'HEAD')
+
+
+class Reply(object):
+    """
+    A view function result with the status and headers of its response
+
+    obj is serialized like any view function result. An ETag header makes GET and HEAD requests
+    with a matching If-None-Match get a 304 Not Modified without serializing obj.
+    """
+
+    def __init__(self, obj, status=None, headers=None):
+        self.obj = obj
+        self.status = status
+        self.headers = headers
+
+
+class Storage(object):
+    """
+    Storage adapter Base class
+
+    For reading and writing the records of a Resource. Records are the raw items its Serializer
+    serializes, values are what its Deserializer deserializes. Writes happen inside transaction();
+    adapters of transactional stores begin, commit and roll back there. The *_many methods write
+    a batch of records in one transaction, adapters can override them with bulk statements.
+    """
+
+    @contextmanager
+    def transaction(self):
+        yield
+
+    def list(self, filterset=None):
+        """
+        Records of the collection, filtered by the adapter according to the filter values
+        """
+        raise NotImplementedError
+
+    def get(self, pk):
+        """
+        Record with this pk, or None
+        """
+        raise NotImplementedError
+
+    def create(self, values):
+        """
+        Create a record from values, returning it
+        """
+        raise NotImplementedError
+
+    def update(self, pk, values):
+        """
+        Replace the values of the record with this pk, returning it or None when it's missing
+        """
+        raise NotImplementedError
+
+    def delete(self, pk):
+        """
+        Delete the record with this pk, returning it or None when it's missing
+        """
+        raise NotImplementedError
+
+    def create_many(self, values_list):
+        return [self.create(values) for values in values_list]
+
+    def update_many(self, changes):
+        """
+        Apply a list of (pk, values), raising NotFound for a missing record
+        """
+        records = []
+        for pk, values in changes:
+            record = self.update(pk, values)
+            if record is None:
+                raise NotFound('No item with pk "{0}"'.format(pk))
+            records.append(record)
+        return records
+
+    def delete_many(self, pks):
+        records = []
+        for pk in pks:
+            record = self.delete(pk)
+            if record is None:
+                raise NotFound('No item with pk "{0}"'.format(pk))
+            records.append(record)
+        return records
+
+    def version(self, record):
+        """
+        Opaque version of a record, used as its ETag
+
+        Hashes the JSON of the record by default; adapters of stores with row versions or update
+        timestamps should return those instead.
+        """
+        return md5(json.dumps(record, sort_keys=True)).hexdigest()
+
+
+class MemoryStorage(Storage):
+    """
+    Storage of dict records in memory, keyed by their `pk` item
+
+    Created records without a pk get the next integer; pks given as digit strings (as routed
+    without a converter) find the records with integer pks. Transactions hold a lock and restore
+    the records when they fail.
+    """
+
+    def __init__(self, records=(), pk='id'):
+        self.pk = pk
+        self.lock = RLock()
+        self.records = OrderedDict()
+        self.next_pk = 1
+        for record in records:
+            self.create(record)
+
+    @contextmanager
+    def transaction(self):
+        with self.lock:
+            # records are replaced and never changed in place, so a shallow copy is a snapshot
+            snapshot = OrderedDict(self.records), self.next_pk
+            try:
+                yield
+            except Exception:
+                self.records, self.next_pk = snapshot
+                raise
+
+    def list(self, filterset=None):
+        """
+        Copies of the records, with scalar filter values matched against the item of that name
+        """
+        conditions = []
+        for filter_obj in filterset.filters if filterset is not None else ():
+            value = filter_obj.validated_value
+            if value is not None and not isinstance(value, (list, tuple)):
+                conditions.append((filter_obj.filter_field, value))
+        with self.lock:
+            records = self.records.values()
+        return [
+            dict(record) for record in records
+            if all(record.get(name, value) == value for name, value in conditions)
+        ]
+
+    def key(self, pk):
+        """
+        Key of the record with this pk
+        """
+        if pk not in self.records and isinstance(pk, basestring) and pk.isdigit():
+            return int(pk)
+        return pk
+
+    def get(self, pk):
+        record = self.records.get(self.key(pk))
+        return dict(record) if record is not None else None
+
+    def create(self, values):
+        record = dict(values)
+        with self.lock:
+            pk = record.get(self.pk)
+            if pk is None:
+                pk = record[self.pk] = self.next_pk
+            if isinstance(pk, (int, long)) and pk >= self.next_pk:
+                self.next_pk = pk + 1
+            self.records[pk] = record
+        return dict(record)
+
+    def update(self, pk, values):
+        with self.lock:
+            pk = self.key(pk)
+            if pk not in self.records:
+                return None
+            record = self.records[pk] = dict(values, **{self.pk: pk})
+        return dict(record)
+
+    def delete(self, pk):
+        with self.lock:
+            return self.records.pop(self.key(pk), None)
+
+
+class Resource(object):
+    """
+    Resource Base class
+
+    For declaring a collection whose routes are generated by NARF.resource from its components:
+        - path: GET lists the records (filtered by FilterSet, sortable and paginated with Range
+          headers), POST creates one record or a list of them, PUT updates a list of records
+          (each with its pk) and DELETE deletes a list of pks
+        - path/<pk>: GET, PUT and DELETE one record
+
+    Records are served with their version as ETag: reads answer a matching If-None-Match with 304
+    and writes with a stale If-Match fail with 412. Without a Deserializer the resource is read
+    only. Bulk writes are validated before anything is written, then written in transactions of
+    `batch_size` records; a failing batch is rolled back (batches written before it stay).
+    """
+
+    path = None
+    name = None
+    Serializer = None
+    Deserializer = None
+    FilterSet = None
+    storage = None
+    # URL converter of the pk, such as 'int', by default 'int' for an IntegerField pk
+    pk_converter = None
+    batch_size = 100
+    max_bulk = 1000
+
+    def __init__(self):
+        self.name = self.name or self.__class__.__name__.lower()
+        self.item_name = self.name + '_item'
+
+    @property
+    def item_path(self):
+        converter = self.pk_converter or self.default_pk_converter()
+        pk = '<{0}:pk>'.format(converter) if converter else '<pk>'
+        return '{0}/{1}'.format(self.path.rstrip('/'), pk)
+
+    def default_pk_converter(self):
+        for _, field in self.Serializer.compile():
+            if field.pk:
+                return 'int' if isinstance(field, IntegerField) else None
+        return None
+
+    @property
+    def collection_methods(self):
+        return ['GET', 'POST', 'PUT', 'DELETE'] if self.Deserializer else ['GET']
+
+    @property
+    def item_methods(self):
+        return ['GET', 'PUT', 'DELETE'] if self.Deserializer else ['GET']
+
+    def pk_of(self, record):
+        pk_source = self.Serializer.pk_source()
+        return get_raw_value(record, pk_source) if pk_source is not None else None
+
+    def etag(self, record):
+        return quote_etag(self.storage.version(record))
+
+    def read_input(self):
+        """
+        The JSON body of the current request
+        """
+        data = request.get_json(silent=True)
+        if data is None:
+            raise BadRequest('The request body must be JSON')
+        return data
+
+    def read_bulk_input(self):
+        data = self.read_input()
+        if not isinstance(data, list):
+            raise BadRequest('The request body must be a list')
+        if len(data) > self.max_bulk:
+            raise BadRequest('At most {0} items can be written at once'.format(self.max_bulk))
+        return data
+
+    def deserialize(self, raw_data):
+        """
+        Values of an input object, raising a ValidationError when it's invalid
+        """
+        if not isinstance(raw_data, dict):
+            raise ValidationError('Every item must be an object')
+        try:
+            return self.Deserializer(raw_data).deserialize()
+        except ValueError as error:
+            raise ValidationError(str(error))
+
+    def batches(self, values):
+        for start in xrange(0, len(values), self.batch_size):
+            yield values[start:start + self.batch_size]
+
+    def write_many(self, write, values):
+        """
+        Write a validated list in batches, one transaction per batch
+        """
+        written = []
+        for batch in self.batches(values):
+            with self.storage.transaction():
+                written.extend(write(batch))
+        return written
+
+    def collection(self, filterset=None):
+        """
+        View function of the collection route
+        """
+        method = request.method
+        if method in READ_METHODS:
+            return self.storage.list(filterset)
+        if self.Deserializer is None:
+            raise MethodNotAllowed()
+        if method == 'POST':
+            data = self.read_input()
+            if isinstance(data, list):
+                data = self.read_bulk_input()
+                values = [self.deserialize(raw_data) for raw_data in data]
+                return Reply(self.write_many(self.storage.create_many, values), 201)
+            values = self.deserialize(data)
+            with self.storage.transaction():
+                record = self.storage.create(values)
+            headers = {'ETag': self.etag(record)}
+            pk = self.pk_of(record)
+            if pk is not None:
+                headers['Location'] = url_for(self.item_name, pk=pk, _external=True)
+            return Reply(record, 201, headers)
+        if method == 'PUT':
+            pk_source = self.Serializer.pk_source()
+            changes = []
+            for raw_data in self.read_bulk_input():
+                values = self.deserialize(raw_data)
+                pk = get_raw_value(raw_data, pk_source) if pk_source is not None else None
+                if pk is None:
+                    raise ValidationError('Every item to update needs its pk')
+                changes.append((pk, values))
+            return self.write_many(self.storage.update_many, changes)
+        if method == 'DELETE':
+            return self.write_many(self.storage.delete_many, self.read_bulk_input())
+        raise MethodNotAllowed()
+
+    def item(self, pk):
+        """
+        View function of the item route
+        """
+        method = request.method
+        if method in READ_METHODS:
+            record = self.storage.get(pk)
+            if record is None:
+                raise NotFound()
+            return Reply(record, headers={'ETag': self.etag(record)})
+        if self.Deserializer is None or method not in ('PUT', 'DELETE'):
+            raise MethodNotAllowed()
+        values = self.deserialize(self.read_input()) if method == 'PUT' else None
+        with self.storage.transaction():
+            # checked and written in one transaction, so no other write gets in between
+            record = self.storage.get(pk)
+            if record is None:
+                raise NotFound()
+            if request.if_match and not request.if_match.contains(self.storage.version(record)):
+                raise PreconditionFailed()
+            if method == 'DELETE':
+                return self.storage.delete(pk)
+            record = self.storage.update(pk, values)
+        return Reply(record, headers={'ETag': self.etag(record)})
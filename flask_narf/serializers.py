@@ -1,4 +1,4 @@
-from flask.ext.narf.fields import Field
+from flask.ext.narf.fields import Field, LoadedField, get_raw_value
 
 
 class Serializer(object):
@@ -6,8 +6,15 @@ class Serializer(object):
     Serializer Base class
 
     For defining the output object of an endpoint
+
+    Set CACHE_ITEMS to reuse serialized items (keyed by their pk) across responses. VERSION_FIELD
+    names an attribute of the raw items that changes whenever an item does, so changed items are
+    reserialized instead of served stale.
     """
 
+    CACHE_ITEMS = False
+    VERSION_FIELD = None
+
     def __init__(self, raw_data=None, **kwargs):
         """
         Initialize the Serializer
@@ -17,7 +24,84 @@ class Serializer(object):
         super(Serializer, self).__init__(**kwargs)
         self.raw_data = raw_data
         self.fields = []
-        for field_name, field in self.__class__.__dict__.items():
-            if isinstance(field, Field):
-                field.bind(self, field_name, raw_data)
-                self.fields.append(field)
+        for field_name, declared_field in self.compile():
+            field = declared_field.clone()
+            setattr(self, field_name, field)
+            field.bind(self, field_name, raw_data)
+            self.fields.append(field)
+
+    @classmethod
+    def compile(cls):
+        """
+        Collect the Field's defined on this Serializer once per class
+        """
+        declared_fields = cls.__dict__.get('_declared_fields')
+        if declared_fields is None:
+            declared_fields = [
+                (field_name, field) for field_name, field in cls.__dict__.items()
+                if isinstance(field, Field)
+            ]
+            cls._declared_fields = declared_fields
+        return declared_fields
+
+    @classmethod
+    def pk_source(cls):
+        """
+        Source of the pk field on the raw items, or None without a pk field
+        """
+        if '_pk_source' not in cls.__dict__:
+            cls._pk_source = None
+            for field_name, field in cls.compile():
+                if field.pk:
+                    cls._pk_source = field._source if field._source is not None else field_name
+                    break
+        return cls._pk_source
+
+    @classmethod
+    def loaders(cls):
+        """
+        (source, BatchLoader) of every LoadedField, once per class
+        """
+        if '_loaders' not in cls.__dict__:
+            cls._loaders = [
+                (field._source if field._source is not None else field_name, field.loader)
+                for field_name, field in cls.compile() if isinstance(field, LoadedField)
+            ]
+        return cls._loaders
+
+    @classmethod
+    def prime_loaders(cls, items):
+        """
+        Load the values of the LoadedFields of all the items, a batch per loader
+        """
+        for source, loader in cls.loaders():
+            keys = [get_raw_value(item, source) for item in items]
+            loader.prime([key for key in keys if key is not None])
+
+    @classmethod
+    def cache_key(cls, raw_data):
+        """
+        Identity (pk and version) of a raw item for the item cache, or None if it has no pk
+        """
+        pk_source = cls.pk_source()
+        if pk_source is None:
+            return None
+        pk = get_raw_value(raw_data, pk_source)
+        if pk is None:
+            return None
+        if cls.VERSION_FIELD is None:
+            return (pk,)
+        return (pk, get_raw_value(raw_data, cls.VERSION_FIELD))
+
+    @classmethod
+    def describe(cls):
+        """
+        Describe this Serializer's fields for endpoint introspection
+        """
+        return {
+            'name': cls.__name__,
+            'fields': sorted(
+                (field.describe(field_name) for field_name, field in cls.compile()),
+                key=lambda description: description['name']
+            ),
+        }
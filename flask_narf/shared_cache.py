@@ -0,0 +1,224 @@
+from fcntl import LOCK_EX, LOCK_UN, flock, lockf
+from hashlib import md5
+from mmap import mmap
+from os import O_CREAT, O_RDWR, close, fstat, ftruncate, open as os_open, read
+from struct import Struct
+from threading import Lock
+from time import time
+
+
+MAGIC = 'NARFSHM1'
+FILE_HEADER = Struct('!8sIII')
+# seq, key hash, stored at, expires at (0 for never), key length, value length
+SLOT_HEADER = Struct('!IQddHI')
+# attempts to read a slot while a writer keeps changing it before treating it as a miss
+READ_ATTEMPTS = 5
+
+
+class SharedMemoryCache(object):
+    """
+    Cache shared by every process of a host through a memory-mapped file
+
+    The file holds a fixed number of fixed-size slots grouped in sets of `ways` slots. A key can
+    only live in the set its hash points to; storing into a full set evicts the slot that was
+    written longest ago (or an expired one).
+
+    Writers lock the set with a POSIX record lock (and a thread lock within the process) and
+    publish every slot with a sequence counter that is odd while the slot is being written.
+    Readers take no locks: they copy the slot and retry when the counter moved, so they never
+    return a torn value. The value is sliced straight out of the mapping (a single copy), since a
+    slot may be overwritten as soon as the read is done.
+    """
+
+    def __init__(self, path, slots=1024, slot_size=64 * 1024, ways=4):
+        if slots % ways:
+            raise ValueError('slots must be a multiple of ways')
+        self.path = path
+        self.slots = slots
+        self.slot_size = slot_size
+        self.ways = ways
+        self.sets = slots // ways
+        self.max_item_size = slot_size - SLOT_HEADER.size
+        self.size = FILE_HEADER.size + slots * slot_size
+        self.lock = Lock()
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+        self.rejected = 0
+        self.fd = os_open(path, O_RDWR | O_CREAT, 0o600)
+        try:
+            self.mmap = self.map_file()
+        except Exception:
+            close(self.fd)
+            raise
+
+    def map_file(self):
+        """
+        Map the cache file, laying it out first if this is the first process to open it
+        """
+        flock(self.fd, LOCK_EX)
+        try:
+            if fstat(self.fd).st_size == 0:
+                ftruncate(self.fd, self.size)
+                mm = mmap(self.fd, self.size)
+                FILE_HEADER.pack_into(mm, 0, MAGIC, self.slots, self.slot_size, self.ways)
+                return mm
+            layout = (MAGIC, self.slots, self.slot_size, self.ways)
+            if fstat(self.fd).st_size != self.size or FILE_HEADER.unpack(
+                read(self.fd, FILE_HEADER.size)
+            ) != layout:
+                raise ValueError('{0} was created with a different layout'.format(self.path))
+            return mmap(self.fd, self.size)
+        finally:
+            flock(self.fd, LOCK_UN)
+
+    def close(self):
+        self.mmap.close()
+        close(self.fd)
+
+    def key_hash(self, key):
+        # 0 marks empty slots
+        return int(md5(key).hexdigest()[:16], 16) or 1
+
+    def slot_offsets(self, key_hash):
+        first = FILE_HEADER.size + (key_hash % self.sets) * self.ways * self.slot_size
+        return [first + way * self.slot_size for way in xrange(self.ways)]
+
+    def read_slot(self, offset, key_hash, key):
+        """
+        Consistent read of the value in a slot, or None if it holds another key or is expired
+        """
+        mm = self.mmap
+        for _ in xrange(READ_ATTEMPTS):
+            seq, slot_hash, _, expires, key_length, value_length = SLOT_HEADER.unpack_from(
+                mm, offset
+            )
+            if seq & 1:
+                continue
+            if slot_hash != key_hash:
+                return None
+            start = offset + SLOT_HEADER.size
+            if key_length + value_length > self.max_item_size:
+                continue
+            data = mm[start:start + key_length + value_length]
+            if SLOT_HEADER.unpack_from(mm, offset)[0] != seq:
+                continue
+            if data[:key_length] != key or (expires and expires < time()):
+                return None
+            return data[key_length:]
+        return None
+
+    def get(self, key):
+        key_hash = self.key_hash(key)
+        for offset in self.slot_offsets(key_hash):
+            value = self.read_slot(offset, key_hash, key)
+            if value is not None:
+                self.hits += 1
+                return value
+        self.misses += 1
+        return None
+
+    def write_slot(self, offset, key_hash, stored, expires, key, value):
+        mm = self.mmap
+        seq = SLOT_HEADER.unpack_from(mm, offset)[0]
+        SLOT_HEADER.pack_into(mm, offset, seq + 1, 0, 0, 0, 0, 0)
+        start = offset + SLOT_HEADER.size
+        mm[start:start + len(key) + len(value)] = key + value
+        SLOT_HEADER.pack_into(mm, offset, seq + 2, key_hash, stored, expires, len(key), len(value))
+
+    def lock_region(self, offset, length):
+        self.lock.acquire()
+        lockf(self.fd, LOCK_EX, length, offset)
+
+    def unlock_region(self, offset, length):
+        lockf(self.fd, LOCK_UN, length, offset)
+        self.lock.release()
+
+    def set(self, key, value, timeout=None):
+        """
+        Store a value, returning False if it doesn't fit in a slot
+        """
+        if len(key) + len(value) > self.max_item_size:
+            self.rejected += 1
+            return False
+        key_hash = self.key_hash(key)
+        now = time()
+        expires = now + timeout if timeout else 0
+        offsets = self.slot_offsets(key_hash)
+        length = self.ways * self.slot_size
+        self.lock_region(offsets[0], length)
+        try:
+            match = empty = oldest = None
+            for offset in offsets:
+                _, slot_hash, stored, slot_expires, key_length, _ = SLOT_HEADER.unpack_from(
+                    self.mmap, offset
+                )
+                start = offset + SLOT_HEADER.size
+                if slot_hash == key_hash and self.mmap[start:start + key_length] == key:
+                    match = offset
+                    break
+                if slot_hash == 0 or (slot_expires and slot_expires < now):
+                    if empty is None:
+                        empty = offset
+                elif oldest is None or stored < oldest[0]:
+                    oldest = (stored, offset)
+            if match is not None:
+                target = match
+            elif empty is not None:
+                target = empty
+            else:
+                target = oldest[1]
+                self.evictions += 1
+            self.write_slot(target, key_hash, now, expires, key, value)
+            self.stores += 1
+        finally:
+            self.unlock_region(offsets[0], length)
+        return True
+
+    def delete(self, key):
+        key_hash = self.key_hash(key)
+        offsets = self.slot_offsets(key_hash)
+        length = self.ways * self.slot_size
+        self.lock_region(offsets[0], length)
+        try:
+            for offset in offsets:
+                if self.read_slot(offset, key_hash, key) is not None:
+                    self.write_slot(offset, 0, 0, 0, '', '')
+        finally:
+            self.unlock_region(offsets[0], length)
+
+    def clear(self):
+        length = self.ways * self.slot_size
+        for first_slot in xrange(0, self.slots, self.ways):
+            offset = FILE_HEADER.size + first_slot * self.slot_size
+            self.lock_region(offset, length)
+            try:
+                for way in xrange(self.ways):
+                    self.write_slot(offset + way * self.slot_size, 0, 0, 0, '', '')
+            finally:
+                self.unlock_region(offset, length)
+
+    def stats(self):
+        """
+        Counters of this process and the occupancy of the shared slots
+        """
+        now = time()
+        used = 0
+        for slot in xrange(self.slots):
+            offset = FILE_HEADER.size + slot * self.slot_size
+            _, slot_hash, _, expires, _, _ = SLOT_HEADER.unpack_from(self.mmap, offset)
+            if slot_hash and not (expires and expires < now):
+                used += 1
+        lookups = self.hits + self.misses
+        return {
+            'slots': self.slots,
+            'slot_size': self.slot_size,
+            'used_slots': used,
+            'hits': self.hits,
+            'misses': self.misses,
+            'stores': self.stores,
+            'evictions': self.evictions,
+            'rejected': self.rejected,
+            'hit_rate': float(self.hits) / lookups if lookups else 0.0,
+        }
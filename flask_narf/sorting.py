@@ -0,0 +1,145 @@
+from collections import namedtuple
+from heapq import nlargest, nsmallest
+from operator import itemgetter
+
+from flask.ext.narf.fields import ListField, TypedField, URIField, get_raw_value
+from flask.ext.narf.filters import Filter
+
+
+# a validated sort order is a tuple of these, highest priority first
+SortKey = namedtuple('SortKey', ['field_name', 'source', 'descending'])
+
+
+def field_sources(serializer_class, fields=None):
+    """
+    Source on the raw items of the fields of a Serializer holding values (not links) by name
+
+    Only the fields named in `fields` are included when it's given.
+    """
+    sources = {}
+    for field_name, field in serializer_class.compile():
+        if isinstance(field, URIField):
+            continue
+        if fields is not None and field_name not in fields:
+            continue
+        sources[field_name] = field._source if field._source is not None else field_name
+    return sources
+
+
+class Reversed(object):
+    """
+    Wraps a value so it orders in reverse, for the descending keys of mixed order sorts
+    """
+
+    __slots__ = ('value',)
+
+    def __init__(self, value):
+        self.value = value
+
+    def __lt__(self, other):
+        return other.value < self.value
+
+    def __eq__(self, other):
+        return self.value == other.value
+
+
+class Sort(Filter):
+    """
+    Order of a list result, from a comma separated list of field names (`sort=name,-id`)
+
+    Any field of serializer_class but links can be used (only those in `fields` when given),
+    prefixed with '-' for a descending order. The value validates to a tuple of SortKeys; without
+    the parameter it's the `default` field names, if any.
+
+    Endpoints with a Sort filter sort list results themselves (see sort_items), views don't have
+    to.
+    """
+
+    def __init__(self, serializer_class, fields=None, default=None, **kwargs):
+        super(Sort, self).__init__(ListField(TypedField(), **kwargs))
+        self.serializer_class = serializer_class
+        self.fields = fields
+        self.default = default
+        # shared by the clones bound to requests, filled on first use
+        self.sources = {}
+
+    def sortable(self):
+        """
+        Source on the raw items of every field that can be sorted by
+        """
+        if not self.sources:
+            self.sources.update(field_sources(self.serializer_class, self.fields))
+        return self.sources
+
+    def validate_input(self):
+        names = self.field_type.deserialize_value() or self.default or ()
+        sortable = self.sortable()
+        sort_keys = []
+        for name in names:
+            descending = name.startswith('-')
+            field_name = name[1:] if descending else name
+            if field_name not in sortable:
+                raise ValueError('can not sort by "{0}"'.format(field_name))
+            sort_keys.append(SortKey(field_name, sortable[field_name], descending))
+        self.validated_value = tuple(sort_keys)
+
+    def describe(self, filter_field):
+        description = super(Sort, self).describe(filter_field)
+        description['sortable'] = sorted(self.sortable())
+        return description
+
+
+def sort_key(sort_keys, mappings=False):
+    """
+    (key function, reverse) ordering raw items like sort_keys
+
+    Sorts in a single direction compare the raw values as they are, the keys going the other way
+    of mixed order sorts are wrapped in Reversed. Values of mappings are looked up with
+    itemgetters, which raise KeyError for missing values.
+    """
+    reverse = sort_keys[0].descending
+    if mappings and all(key.descending == reverse for key in sort_keys):
+        return itemgetter(*[key.source for key in sort_keys]), reverse
+    getters = []
+    for key in sort_keys:
+        if mappings:
+            getter = itemgetter(key.source)
+        else:
+            getter = lambda item, source=key.source: get_raw_value(item, source)
+        if key.descending != reverse:
+            getter = lambda item, get=getter: Reversed(get(item))
+        getters.append(getter)
+    if len(getters) == 1:
+        return getters[0], reverse
+    return lambda item: tuple([getter(item) for getter in getters]), reverse
+
+
+def order(items, key, reverse, limit):
+    if limit is not None:
+        select = nlargest if reverse else nsmallest
+        return select(limit, items, key=key)
+    return sorted(items, key=key, reverse=reverse)
+
+
+def sort_items(items, sort_keys, limit=None):
+    """
+    Items of a view function result in the order of sort_keys
+
+    Results with a sort_by method (such as a query of a data source) sort themselves: sort_by is
+    called with the SortKeys and returns the sorted result. Other results are sorted here; with a
+    limit, only the first `limit` items are selected with a heap (O(n log limit)) instead of
+    sorting all of them.
+    """
+    if not sort_keys:
+        return items
+    if hasattr(items, 'sort_by'):
+        return items.sort_by(sort_keys)
+    if isinstance(items, list) and items and isinstance(items[0], dict):
+        try:
+            key, reverse = sort_key(sort_keys, mappings=True)
+            return order(items, key, reverse, limit)
+        except KeyError:
+            # some items miss a value, which sorts as None like on other items
+            pass
+    key, reverse = sort_key(sort_keys)
+    return order(items, key, reverse, limit)
@@ -0,0 +1,157 @@
+from datetime import datetime
+from decimal import Decimal
+from unittest import TestCase, skipIf
+
+from flask import Flask, json
+from flask.ext.narf import NARF
+from flask.ext.narf.aggregation import (
+    COUNT, Aggregate, AggregateSpec, GroupBy, GroupField, aggregate, aggregate_items, numpy
+)
+from flask.ext.narf.exceptions import ValidationError
+from flask.ext.narf.fields import DateTimeField, DecimalField, Field, IntegerField, StringField
+from flask.ext.narf.filters import FilterSet
+from flask.ext.narf.serializers import Serializer
+
+
+class OrderSerializer(Serializer):
+    id = Field(pk=True)
+    category = StringField()
+    quantity = IntegerField()
+    price = DecimalField(places=2)
+    created = DateTimeField()
+
+
+class OrderFilterSet(FilterSet):
+    aggregate = Aggregate(OrderSerializer)
+    group_by = GroupBy(OrderSerializer)
+
+
+ORDERS = [
+    {'id': 1, 'category': 'b', 'quantity': 2, 'price': Decimal('1.50'),
+     'created': datetime(2015, 10, 21, 16, 29)},
+    {'id': 2, 'category': 'a', 'quantity': 1, 'price': Decimal('2.25'),
+     'created': datetime(2015, 10, 22, 8, 0)},
+    {'id': 3, 'category': 'b', 'quantity': None, 'price': Decimal('0.75'),
+     'created': datetime(2015, 10, 20, 12, 0)},
+]
+
+QUANTITY = {
+    function: AggregateSpec(function, 'quantity', 'quantity')
+    for function in ('count', 'sum', 'min', 'max', 'avg')
+}
+
+
+class TestAggregate(TestCase):
+
+    def setUp(self):
+        self.app = Flask(__name__)
+
+    def parse(self, query_string):
+        with self.app.test_request_context('/?' + query_string):
+            values = OrderFilterSet.parse()
+            return values.aggregate.validated_value, values.group_by.validated_value
+
+    def test_specs(self):
+        """
+        Test aggregate and group_by parameters validate against the Serializer fields
+        """
+        self.assertEqual(self.parse('aggregate=count,sum:quantity&group_by=category'), (
+            (COUNT, QUANTITY['sum']), GroupField('category', 'category')
+        ))
+        self.assertEqual(self.parse(''), ((), None))
+        for query_string in ('aggregate=median:quantity', 'aggregate=sum', 'aggregate=max:nope',
+                             'group_by=nope'):
+            with self.assertRaises(ValidationError):
+                self.parse(query_string)
+
+    def test_aggregate_items(self):
+        """
+        Test aggregating in one pass over an iterable, skipping missing values
+        """
+        specs = (COUNT,) + tuple(QUANTITY[function] for function in sorted(QUANTITY))
+        self.assertEqual(aggregate_items(iter(ORDERS), specs), [{
+            'count': 3, 'count_quantity': 2, 'sum_quantity': 3, 'min_quantity': 1,
+            'max_quantity': 2, 'avg_quantity': 1.5,
+        }])
+        grouped = aggregate_items(iter(ORDERS), specs[:2], GroupField('category', 'category'))
+        self.assertEqual(grouped, [
+            {'category': 'a', 'count': 1, 'avg_quantity': 1.0},
+            {'category': 'b', 'count': 2, 'avg_quantity': 2.0},
+        ])
+        self.assertEqual(aggregate_items([], (COUNT, QUANTITY['sum'], QUANTITY['max'])), [
+            {'count': 0, 'sum_quantity': 0, 'max_quantity': None}
+        ])
+
+    def test_formatting(self):
+        """
+        Test aggregated values are serialized like their fields
+        """
+        specs = (
+            AggregateSpec('sum', 'price', 'price'), AggregateSpec('max', 'created', 'created')
+        )
+        rows = aggregate(ORDERS, specs, serializer_class=OrderSerializer).rows
+        self.assertEqual(rows, [{'sum_price': '4.50', 'max_created': '2015-10-22T08:00:00'}])
+
+    def test_pushdown(self):
+        """
+        Test results with an aggregate_by method aggregate themselves
+        """
+
+        class Query(list):
+            def aggregate_by(self, specs, group):
+                return [{'count': 42}]
+
+        self.assertEqual(aggregate(Query(ORDERS), (COUNT,)).rows, [{'count': 42}])
+
+    @skipIf(numpy is None, 'numpy is not installed')
+    def test_array(self):
+        """
+        Test structured arrays are aggregated with vectorized operations
+        """
+        array = numpy.array(
+            [('b', 2, 1.5), ('a', 1, 2.25), ('b', 4, 0.75)],
+            dtype=[('category', 'S1'), ('quantity', 'i4'), ('price', 'f8')]
+        )
+        specs = (COUNT, QUANTITY['sum'], QUANTITY['min'], AggregateSpec('avg', 'price', 'price'))
+        self.assertEqual(aggregate(array, specs, GroupField('category', 'category')).rows, [
+            {'category': 'a', 'count': 1, 'sum_quantity': 1, 'min_quantity': 1, 'avg_price': 2.25},
+            {'category': 'b', 'count': 2, 'sum_quantity': 6, 'min_quantity': 2, 'avg_price': 1.125},
+        ])
+        self.assertEqual(aggregate(array, (COUNT, QUANTITY['max'])).rows, [
+            {'count': 3, 'max_quantity': 4}
+        ])
+
+
+class TestAggregatingEndpoint(TestCase):
+
+    def setUp(self):
+        app = Flask(__name__)
+        api = NARF(app)
+
+        @api.register(OrderSerializer)
+        @api.register(OrderFilterSet)
+        @api.endpoint('/orders')
+        def orders(filterset):
+            return (order for order in ORDERS)
+
+        self.client = app.test_client()
+
+    def test_aggregates(self):
+        """
+        Test requests for aggregates get the aggregated rows in the negotiated Content-Type
+        """
+        response = self.client.get('/orders?aggregate=count,sum:price&group_by=category')
+        self.assertEqual(json.loads(response.data), {'aggregates': [
+            {'category': 'a', 'count': 1, 'sum_price': '2.25'},
+            {'category': 'b', 'count': 2, 'sum_price': '2.25'},
+        ]})
+        head = self.client.head('/orders?aggregate=count,sum:price&group_by=category')
+        self.assertEqual(head.headers['Content-Length'], str(len(response.data)))
+        response = self.client.get(
+            '/orders?group_by=category', headers={'Accept': 'application/vnd.collection+json'}
+        )
+        items = json.loads(response.data)['collection']['items']
+        self.assertEqual(items[1], {'data': [
+            {'name': 'category', 'value': 'b'}, {'name': 'count', 'value': 2}
+        ]})
+        self.assertEqual(self.client.get('/orders?aggregate=avg').status_code, 400)
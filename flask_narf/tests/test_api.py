@@ -1,12 +1,15 @@
+from itertools import count
 from unittest import TestCase
 
-from flask import Flask
+from flask import Flask, json
 from flask.ext.narf import NARF, Endpoint
 from flask.ext.narf.fields import Field, StringField, URIField, RelatedURIField
-from flask.ext.narf.filters import FilterSet
+from flask.ext.narf.filters import Filter, FilterSet
 from flask.ext.narf.serializers import Serializer
 from flask.ext.narf.deserializers import Deserializer
 from flask.ext.narf.content_types import ContentType
+from flask.ext.narf.exceptions import ConfigurationError, NotFound
+from flask.ext.narf.pools import ResourcePool
 
 
 class APITest(TestCase):
@@ -228,6 +231,260 @@ class EndpointDeclaration(APITest):
         self.assertIsInstance(after_endpoint, Endpoint)
         self.verify_endpoint_declaration(after_endpoint)
 
+    def test_several_apps(self):
+        """
+        Test endpoints shared by several apps with their own content-types and state
+        """
+        api = NARF()
+
+        class ItemSerializer(Serializer):
+            id = Field(pk=True)
+
+        class TestContentType(ContentType):
+            CONTENT_TYPE = 'application/test'
+
+        @api.register(ItemSerializer)
+        @api.endpoint('/items')
+        def items():
+            return [{'id': 1}]
+
+        first, second = Flask(__name__), Flask(__name__)
+        second.config['DEFAULT_CONTENT_TYPE_MAP'] = {'application/test': TestContentType}
+        api.init_app(first)
+        api.init_app(second)
+
+        @api.endpoint('/')
+        def home():
+            return {'hello': 'world'}
+
+        self.assertIsNot(api.state_of(first), api.state_of(second))
+        self.assertIs(api.state, api.state_of(second))
+        endpoint = api.endpoints['items']
+        with first.test_request_context('/'):
+            self.assertNotIn('application/test', endpoint.content_type_map)
+            self.assertIs(api.item_cache, api.state_of(first).item_cache)
+        with second.test_request_context('/'):
+            self.assertEqual(endpoint.content_type_map.keys(), ['application/test'])
+        self.assertEqual(first.test_client().get('/items').data, '{"items": [{"id": 1}]}')
+        self.assertIn('home', second.view_functions)
+        self.assertTrue(endpoint.compiled)
+
+    def test_several_extensions(self):
+        """
+        Test several NARF extensions initialized with one app keep their own state
+        """
+        app = Flask(__name__)
+        first, second = NARF(app), NARF(app)
+        first.add_pool('counter', ResourcePool(count))
+        self.assertIs(first.state.api, first)
+        self.assertIs(second.state.api, second)
+        with app.test_request_context('/'):
+            self.assertIsNot(first.response_cache, second.response_cache)
+            self.assertEqual(first.pools.keys(), ['counter'])
+            self.assertEqual(second.pools, {})
+
+
+class EndpointWarmUp(APITest):
+
+    def test_warm_up(self):
+        """
+        Test warming up compiles every endpoint and reports its setup time
+        """
+
+        class ItemSerializer(Serializer):
+            id = Field(pk=True)
+            home = RelatedURIField('home')
+
+        @self.api.endpoint('/')
+        def home():
+            return {'hello': 'world'}
+
+        @self.api.register(ItemSerializer)
+        @self.api.endpoint('/items')
+        def items():
+            return [{'id': 1}]
+
+        report = self.api.warm_up()
+        self.assertItemsEqual(report.keys(), ['home', 'items'])
+        self.assertIs(report, self.api.warm_up_report)
+        items_endpoint = self.api.endpoints['items']
+        self.assertTrue(items_endpoint.compiled)
+        self.assertItemsEqual(items_endpoint.accept_types, items_endpoint.content_type_map.keys())
+        self.assertEqual(ItemSerializer.__dict__['home'].url_paths[self.api.app], '/')
+
+        response = self.api.app.test_client().get('/items', headers={'Accept': 'application/json'})
+        self.assertEqual(
+            response.data, '{"items": [{"home": "http://localhost/", "id": 1}]}'
+        )
+
+    def test_warm_up_strict_problems(self):
+        """
+        Test strict warm up raising on an invalid endpoint configuration
+        """
+
+        class ItemSerializer(Serializer):
+            id = Field(pk=True)
+            missing = RelatedURIField('missing')
+
+        @self.api.register(ItemSerializer)
+        @self.api.endpoint('/items')
+        def items():
+            return []
+
+        self.api.warm_up()
+        with self.assertRaises(ConfigurationError) as context:
+            self.api.warm_up(strict=True)
+        self.assertIn('unknown endpoint "missing"', str(context.exception))
+
+    def test_warm_up_config(self):
+        """
+        Test NARF_WARM_UP warming up the endpoints declared before init_app
+        """
+        api = NARF()
+
+        @api.endpoint('/')
+        def home():
+            return {'hello': 'world'}
+
+        app = Flask(__name__)
+        app.config['NARF_WARM_UP'] = True
+        api.init_app(app)
+        self.assertEqual(api.warm_up_report.keys(), ['home'])
+        self.assertTrue(api.endpoints['home'].compiled)
+
+    def test_register_invalidates(self):
+        """
+        Test registering a component on a warmed up endpoint invalidates it
+        """
+
+        class TestContentType(ContentType):
+            CONTENT_TYPE = 'application/test'
+
+        @self.api.endpoint('/')
+        def home():
+            return {'hello': 'world'}
+
+        self.api.warm_up()
+        self.api.register(TestContentType)(home)
+        home_endpoint = self.api.endpoints['home']
+        self.assertFalse(home_endpoint.compiled)
+        home_endpoint.compile()
+        self.assertIn('application/test', home_endpoint.accept_types)
+
+
+class EndpointIntrospection(APITest):
+
+    def setUp(self):
+        super(EndpointIntrospection, self).setUp()
+
+        class ItemSerializer(Serializer):
+            id = Field(pk=True, display_prompt='ID')
+            link = URIField(relation='self')
+
+        class ItemFilterSet(FilterSet):
+            name = Filter(StringField())
+
+        @self.api.register(ItemSerializer)
+        @self.api.register(ItemFilterSet)
+        @self.api.endpoint('/items')
+        def items(filterset):
+            return []
+
+        self.client = self.api.app.test_client()
+
+    def test_options(self):
+        """
+        Test OPTIONS describing the endpoint
+        """
+        response = self.client.open('/items', method='OPTIONS')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.headers['Allow'], 'GET, HEAD, OPTIONS')
+        description = json.loads(response.data)
+        self.assertEqual(description['name'], 'items')
+        self.assertEqual(description['path'], '/items')
+        self.assertIn('application/vnd.collection+json', description['content_types'])
+        self.assertEqual(description['serializer']['fields'], [
+            {'name': 'id', 'type': 'Field', 'pk': True, 'prompt': 'ID'},
+            {'name': 'link', 'type': 'URIField', 'pk': False, 'relation': 'self'},
+        ])
+        self.assertEqual(description['filter_set']['filters'], [
+            {'name': 'name', 'type': 'StringField'},
+        ])
+
+    def test_options_etag(self):
+        """
+        Test OPTIONS answering 304 Not Modified for a known ETag
+        """
+        etag = self.client.open('/items', method='OPTIONS').headers['ETag']
+        response = self.client.open('/items', method='OPTIONS', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.data, '')
+
+    def test_schema_cached(self):
+        """
+        Test the description is computed once and recomputed when endpoints change
+        """
+        with self.api.app.test_request_context():
+            schema = self.api.schema()
+            self.assertIs(schema, self.api.schema())
+
+            @self.api.endpoint('/other')
+            def other():
+                return {}
+
+            updated_schema = self.api.schema()
+        self.assertNotEqual(schema[1], updated_schema[1])
+        names = [endpoint['name'] for endpoint in json.loads(updated_schema[0])['endpoints']]
+        self.assertEqual(names, ['items', 'other'])
+
+    def test_schema_url(self):
+        """
+        Test serving the description of every endpoint on NARF_SCHEMA_URL
+        """
+        app = Flask(__name__)
+        app.config['NARF_SCHEMA_URL'] = '/schema'
+        self.api.init_app(app)
+        response = app.test_client().get('/schema')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('ETag', response.headers)
+        endpoints = json.loads(response.data)['endpoints']
+        self.assertEqual([endpoint['name'] for endpoint in endpoints], ['items'])
+
+
+class EndpointHead(APITest):
+
+    def test_head_hook(self):
+        """
+        Test a HEAD request answered by the head hook without calling the view function
+        """
+        calls = []
+
+        def head(**kwargs):
+            return {'ETag': '"v1"'}
+
+        @self.api.endpoint('/', head=head)
+        def home():
+            calls.append('home')
+            return {'hello': 'world'}
+
+        response = self.api.app.test_client().head('/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.headers['ETag'], '"v1"')
+        self.assertEqual(calls, [])
+
+    def test_head_hook_fallback(self):
+        """
+        Test a HEAD request falling back to the view function when the hook returns None
+        """
+
+        @self.api.endpoint('/', head=lambda: None)
+        def home():
+            return {'hello': 'world'}
+
+        response = self.api.app.test_client().head('/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content_length, len('{"hello": "world"}'))
+
 
 class TestObject(object):
     pass
@@ -281,3 +538,8 @@ def obj_fields():
     obj.string = 'string'
     obj.uri_field = 'http://api.narf.com/'
     return [obj]
+
+
+@TEST_API.endpoint('/error/not_found')
+def error_not_found():
+    raise NotFound()
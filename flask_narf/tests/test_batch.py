@@ -0,0 +1,154 @@
+from threading import Event, Lock
+from unittest import TestCase
+
+from flask import Flask, json, request
+from flask.ext.narf import NARF
+from flask.ext.narf.content_types import EventStream
+from flask.ext.narf.fields import Field, StringField
+from flask.ext.narf.filters import Filter, FilterSet
+from flask.ext.narf.resources import Reply
+from flask.ext.narf.serializers import Serializer
+
+
+class TestBatch(TestCase):
+
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.app.config['NARF_BATCH_URL'] = '/batch'
+        self.app.config['NARF_BATCH_CONCURRENCY'] = 2
+        self.api = NARF(self.app)
+        self.lock = Lock()
+        self.running = 0
+        self.peak = 0
+
+        class ItemSerializer(Serializer):
+            id = Field(pk=True)
+            name = StringField()
+
+        class ItemFilterSet(FilterSet):
+            name = Filter(StringField())
+
+        @self.api.register(ItemSerializer)
+        @self.api.register(ItemFilterSet)
+        @self.api.endpoint('/items')
+        def items(filterset):
+            with self.lock:
+                self.running += 1
+                self.peak = max(self.peak, self.running)
+            Event().wait(0.01)
+            with self.lock:
+                self.running -= 1
+            return [{'id': 1, 'name': filterset.name.validated_value or request.headers['X-User']}]
+
+        @self.api.endpoint('/free')
+        def free():
+            return {'free': True}
+
+        @self.api.register(EventStream)
+        @self.api.endpoint('/feed')
+        def feed():
+            return [{'id': 1}]
+
+        @self.api.endpoint('/versioned')
+        def versioned():
+            return Reply({'version': 1}, headers={'ETag': '"v1"'})
+
+        @self.api.endpoint('/admin')
+        def admin():
+            return {'secret': True}
+
+        @self.app.before_request
+        def guard():
+            if request.path == '/admin':
+                return json.dumps({'error': 'Forbidden'}), 403
+
+        @self.app.after_request
+        def tag(response):
+            response.headers['X-Tagged'] = 'yes'
+            return response
+
+        @self.app.route('/plain')
+        def plain():
+            return 'not a NARF endpoint'
+
+        self.client = self.app.test_client()
+
+    def batch(self, sub_requests, headers=None):
+        headers = dict(headers or {})
+        headers['X-User'] = 'batcher'
+        return self.client.post('/batch', data=json.dumps(sub_requests), headers=headers)
+
+    def test_batch(self):
+        """
+        Test sub-requests are answered in order in one response
+        """
+        response = self.batch([
+            {'path': '/items', 'query': {'name': 'one'}},
+            {'path': '/items?name=two', 'accept': 'application/vnd.collection+json'},
+            {'path': '/free', 'method': 'head'},
+            {'path': '/items'},
+        ])
+        self.assertEqual(response.status_code, 200)
+        responses = json.loads(response.data)['responses']
+        self.assertEqual(
+            [sub_response['status'] for sub_response in responses], [200, 200, 200, 200]
+        )
+        self.assertEqual(responses[0]['body'], {'items': [{'id': 1, 'name': 'one'}]})
+        self.assertEqual(
+            responses[1]['headers']['Content-Type'], 'application/vnd.collection+json'
+        )
+        data = responses[1]['body']['collection']['items'][0]['data']
+        self.assertIn({'name': 'name', 'value': 'two'}, data)
+        self.assertIsNone(responses[2]['body'])
+        # headers of the batch request are passed on to the sub-requests
+        self.assertEqual(responses[3]['body']['items'][0]['name'], 'batcher')
+        self.assertEqual(self.api.metrics()['batch']['sub_requests'], 4)
+
+    def test_concurrency_cap(self):
+        """
+        Test a batch runs at most its concurrency of sub-requests at once
+        """
+        response = self.batch([{'path': '/items'}] * 6)
+        self.assertEqual(len(json.loads(response.data)['responses']), 6)
+        self.assertLessEqual(self.peak, 2)
+
+    def test_errors(self):
+        """
+        Test failing sub-requests get error responses and invalid batches are rejected
+        """
+        responses = json.loads(self.batch([
+            {'path': '/missing'}, {'path': '/plain'}, {'path': '/free', 'method': 'DELETE'},
+        ]).data)['responses']
+        self.assertEqual(
+            [sub_response['status'] for sub_response in responses], [404, 404, 405]
+        )
+        self.assertEqual(responses[0]['body']['error'], 'Not Found')
+        self.assertEqual(self.client.post('/batch', data='nope').status_code, 400)
+        self.assertEqual(self.batch({'path': '/items'}).status_code, 400)
+        self.assertEqual(self.batch([{'path': '/items'}] * 51).status_code, 400)
+
+    def test_app_hooks(self):
+        """
+        Test sub-requests go through the before_request and after_request functions of the app
+        """
+        responses = json.loads(self.batch([{'path': '/admin'}, {'path': '/free'}]).data)
+        self.assertEqual(responses['responses'][0]['status'], 403)
+        self.assertNotIn('secret', responses['responses'][0]['body'])
+        self.assertEqual(responses['responses'][1]['headers']['X-Tagged'], 'yes')
+
+    def test_streams_and_conditional_headers(self):
+        """
+        Test streamed sub-responses are refused and closed, and conditional headers of the batch
+        request are not passed on
+        """
+        for _ in range(3):
+            responses = json.loads(self.batch(
+                [{'path': '/feed', 'accept': EventStream.CONTENT_TYPE}]
+            ).data)['responses']
+            self.assertEqual(responses[0]['status'], 406)
+        self.assertEqual(self.api.streams.in_flight, 0)
+        response = self.batch([{'path': '/versioned'}], headers={'If-None-Match': '"v1"'})
+        self.assertEqual(json.loads(response.data)['responses'][0]['body'], {'version': 1})
+        # bodiless sub-responses, such as a 304, render as null
+        rendered = self.api.batch.render([(304, {}, 'application/json', '')])
+        self.assertIsNone(json.loads(rendered)['responses'][0]['body'])
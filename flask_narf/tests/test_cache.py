@@ -0,0 +1,137 @@
+from unittest import TestCase
+
+from flask import Flask, json
+from flask.ext.narf import NARF
+from flask.ext.narf.cache import LRUCache
+from flask.ext.narf.fields import Field, StringField
+from flask.ext.narf.serializers import Serializer
+
+
+class TestLRUCache(TestCase):
+
+    def test_get_set(self):
+        """
+        Test cached values and hit/miss counters
+        """
+        cache = LRUCache()
+        self.assertIsNone(cache.get('key'))
+        cache.set('key', 'value')
+        self.assertEqual(cache.get('key'), 'value')
+        stats = cache.stats()
+        self.assertEqual(stats['hits'], 1)
+        self.assertEqual(stats['misses'], 1)
+        self.assertEqual(stats['hit_rate'], 0.5)
+
+    def test_evict_least_recently_used(self):
+        """
+        Test the least recently used entry is evicted beyond max_entries
+        """
+        cache = LRUCache(max_entries=2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+        self.assertEqual(cache.get('a'), 1)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('c'), 3)
+        self.assertEqual(cache.stats()['evictions'], 1)
+
+    def test_evict_by_bytes(self):
+        """
+        Test entries are evicted to stay below max_bytes
+        """
+        cache = LRUCache(max_bytes=100, sizeof=len)
+        cache.set('a', 'x' * 60)
+        cache.set('b', 'x' * 30)
+        self.assertEqual(cache.stats()['bytes'], 90)
+        cache.set('c', 'x' * 30)
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(cache.stats()['bytes'], 60)
+        # values larger than the whole cache are never stored
+        cache.set('d', 'x' * 101)
+        self.assertIsNone(cache.get('d'))
+        self.assertEqual(len(cache), 2)
+
+    def test_delete_and_clear(self):
+        """
+        Test removing entries keeps the memory accounting right
+        """
+        cache = LRUCache(max_bytes=100, sizeof=len)
+        cache.set('a', 'xx')
+        cache.set('b', 'xxx')
+        cache.delete('a')
+        self.assertEqual(cache.stats()['bytes'], 3)
+        cache.clear()
+        self.assertEqual(cache.stats()['bytes'], 0)
+        self.assertEqual(len(cache), 0)
+
+
+class CountingField(StringField):
+
+    calls = []
+
+    def serialize_value(self):
+        self.calls.append(self.raw_value)
+        return super(CountingField, self).serialize_value()
+
+
+class TestItemCache(TestCase):
+
+    def setUp(self):
+        CountingField.calls = []
+        self.app = Flask(__name__)
+        self.api = NARF(self.app)
+        self.items = [
+            {'id': 1, 'name': 'one', 'version': 1},
+            {'id': 2, 'name': 'two', 'version': 1},
+        ]
+
+        class ItemSerializer(Serializer):
+            CACHE_ITEMS = True
+            VERSION_FIELD = 'version'
+            id = Field(pk=True)
+            name = CountingField()
+
+        @self.api.register(ItemSerializer)
+        @self.api.endpoint('/items')
+        def items():
+            return self.items
+
+        self.client = self.app.test_client()
+
+    def get(self, content_type='application/json'):
+        return self.client.get('/items', headers={'Accept': content_type})
+
+    def test_items_reused(self):
+        """
+        Test serialized items are reused by later responses
+        """
+        first = self.get()
+        second = self.get()
+        self.assertEqual(first.data, second.data)
+        self.assertEqual(CountingField.calls, ['one', 'two'])
+        stats = self.api.metrics()['item_cache']
+        self.assertEqual(stats['hits'], 2)
+        self.assertEqual(stats['misses'], 2)
+        self.assertGreater(stats['bytes'], 0)
+
+    def test_changed_version_reserialized(self):
+        """
+        Test an item with a new version is serialized again
+        """
+        self.get()
+        self.items[0] = {'id': 1, 'name': 'uno', 'version': 2}
+        response = self.get()
+        self.assertEqual(CountingField.calls, ['one', 'two', 'uno'])
+        names = [item['name'] for item in json.loads(response.data)['items']]
+        self.assertEqual(names, ['uno', 'two'])
+
+    def test_cached_per_content_type(self):
+        """
+        Test items are cached separately for every Content-Type
+        """
+        self.get()
+        response = self.get('application/vnd.collection+json')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('collection', json.loads(response.data))
+        self.assertEqual(CountingField.calls, ['one', 'two', 'one', 'two'])
@@ -0,0 +1,177 @@
+from threading import Event, Thread
+from time import sleep
+from unittest import TestCase
+
+from flask import Flask
+from flask.ext.narf import NARF
+from flask.ext.narf.coalescing import SingleFlight
+from flask.ext.narf.fields import Field, StringField
+from flask.ext.narf.filters import Filter, FilterSet
+from flask.ext.narf.resources import Reply
+from flask.ext.narf.serializers import Serializer
+
+
+def wait_for(condition):
+    while not condition():
+        sleep(0.001)
+
+
+class TestSingleFlight(TestCase):
+
+    def test_concurrent_calls_share_result(self):
+        """
+        Test concurrent calls with the same key run the function once
+        """
+        single_flight = SingleFlight()
+        release = Event()
+        calls = []
+        results = []
+
+        def compute():
+            calls.append(1)
+            release.wait()
+            return 'result'
+
+        threads = [
+            Thread(target=lambda: results.append(single_flight.do('key', compute)))
+            for _ in range(4)
+        ]
+        for thread in threads:
+            thread.start()
+        wait_for(lambda: single_flight.stats()['shared'] == 3)
+        release.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(calls, [1])
+        self.assertEqual(results, ['result'] * 4)
+        self.assertEqual(single_flight.stats(), {'in_flight': 0, 'executions': 1, 'shared': 3})
+
+    def test_sequential_calls_not_shared(self):
+        """
+        Test a call after the previous one finished runs the function again
+        """
+        single_flight = SingleFlight()
+        self.assertEqual(single_flight.do('key', lambda: 1), 1)
+        self.assertEqual(single_flight.do('key', lambda: 2), 2)
+        self.assertEqual(single_flight.stats()['executions'], 2)
+
+    def test_error_shared(self):
+        """
+        Test an error of the leader is raised for the followers
+        """
+        single_flight = SingleFlight()
+        release = Event()
+        errors = []
+
+        def compute():
+            release.wait()
+            raise ValueError('failed')
+
+        def call():
+            try:
+                single_flight.do('key', compute)
+            except ValueError as error:
+                errors.append(error)
+
+        threads = [Thread(target=call) for _ in range(2)]
+        for thread in threads:
+            thread.start()
+        wait_for(lambda: single_flight.stats()['shared'] == 1)
+        release.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(errors), 2)
+        self.assertIs(errors[0], errors[1])
+
+
+class TestEndpointCoalescing(TestCase):
+
+    def test_coalesced_requests(self):
+        """
+        Test concurrent identical requests share one view call and its response
+        """
+        app = Flask(__name__)
+        api = NARF(app)
+        release = Event()
+        calls = []
+
+        class ItemSerializer(Serializer):
+            id = Field(pk=True)
+
+        class ItemFilterSet(FilterSet):
+            name = Filter(StringField())
+
+        @api.register(ItemSerializer)
+        @api.register(ItemFilterSet)
+        @api.endpoint('/items', coalesce=True)
+        def items(filterset):
+            calls.append(filterset.name.validated_value)
+            if filterset.name.validated_value == 'slow':
+                release.wait()
+            return [{'id': 1}]
+
+        responses = []
+
+        def fetch():
+            responses.append(app.test_client().get('/items?name=slow'))
+
+        threads = [Thread(target=fetch) for _ in range(3)]
+        for thread in threads:
+            thread.start()
+        coalescer = api.endpoints['items'].coalescer
+        wait_for(lambda: coalescer.stats()['shared'] == 2)
+        # a request with different filter values is not coalesced with the others
+        other = app.test_client().get('/items?name=other')
+        release.set()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(sorted(calls), ['other', 'slow'])
+        self.assertEqual(other.status_code, 200)
+        for response in responses:
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.data, '{"items": [{"id": 1}]}')
+            self.assertEqual(response.mimetype, 'application/json')
+        metrics = api.metrics()['endpoints']['items']['coalescing']
+        self.assertEqual(metrics['executions'], 2)
+        self.assertEqual(metrics['shared'], 2)
+
+    def test_conditional_requests(self):
+        """
+        Test If-None-Match is applied to a coalesced response for each request, and other
+        methods are never coalesced
+        """
+        app = Flask(__name__)
+        api = NARF(app)
+        release = Event()
+        calls = []
+
+        @api.endpoint('/versioned', coalesce=True, methods=['GET', 'POST'])
+        def versioned():
+            calls.append(1)
+            release.wait()
+            return Reply({'version': 1}, headers={'ETag': '"v1"'})
+
+        responses = {}
+
+        def fetch(name, headers):
+            responses[name] = app.test_client().get('/versioned', headers=headers)
+
+        threads = [
+            Thread(target=fetch, args=('conditional', {'If-None-Match': '"v1"'})),
+            Thread(target=fetch, args=('unconditional', {})),
+        ]
+        for thread in threads:
+            thread.start()
+        coalescer = api.endpoints['versioned'].coalescer
+        wait_for(lambda: coalescer.stats()['shared'] == 1)
+        release.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(calls, [1])
+        self.assertEqual(responses['conditional'].status_code, 304)
+        self.assertEqual(responses['conditional'].data, '')
+        self.assertEqual(responses['unconditional'].status_code, 200)
+        self.assertEqual(responses['unconditional'].data, '{"version": 1}')
+        self.assertEqual(app.test_client().post('/versioned').status_code, 200)
+        self.assertEqual(coalescer.stats()['executions'], 1)
@@ -0,0 +1,123 @@
+from threading import Event, Thread
+from unittest import TestCase
+
+from flask import Flask, json
+from flask.ext.narf import NARF
+from flask.ext.narf.concurrency import ConcurrencyLimiter
+from flask.ext.narf.fields import Field
+from flask.ext.narf.serializers import Serializer
+
+
+class TestConcurrencyLimiter(TestCase):
+
+    def test_admit_and_shed(self):
+        """
+        Test requests beyond max_in_flight are shed without a queue
+        """
+        limiter = ConcurrencyLimiter(2)
+        self.assertTrue(limiter.acquire())
+        self.assertTrue(limiter.acquire())
+        self.assertFalse(limiter.acquire())
+        limiter.release()
+        self.assertTrue(limiter.acquire())
+        stats = limiter.stats()
+        self.assertEqual(stats['in_flight'], 2)
+        self.assertEqual(stats['admitted'], 3)
+        self.assertEqual(stats['shed'], 1)
+        self.assertEqual(stats['peak_in_flight'], 2)
+
+    def test_queue_timeout(self):
+        """
+        Test a queued request is shed once the queue timeout expires
+        """
+        limiter = ConcurrencyLimiter(1, max_queue=1, queue_timeout=0.01)
+        self.assertTrue(limiter.acquire())
+        self.assertFalse(limiter.acquire())
+        stats = limiter.stats()
+        self.assertEqual(stats['timed_out'], 1)
+        self.assertEqual(stats['peak_queued'], 1)
+        self.assertEqual(stats['queued'], 0)
+
+    def test_queue_admitted_on_release(self):
+        """
+        Test a queued request is admitted when a slot is released
+        """
+        limiter = ConcurrencyLimiter(1, max_queue=1)
+        self.assertTrue(limiter.acquire())
+        results = []
+        waiter = Thread(target=lambda: results.append(limiter.acquire()))
+        waiter.start()
+        while not limiter.stats()['queued']:
+            pass
+        # the queue is full, so another request is shed right away
+        self.assertFalse(limiter.acquire())
+        limiter.release()
+        waiter.join()
+        self.assertEqual(results, [True])
+        self.assertEqual(limiter.stats()['in_flight'], 1)
+
+
+class TestEndpointLimiter(TestCase):
+
+    def test_endpoint_sheds_with_503(self):
+        """
+        Test an endpoint at its concurrency limit answers 503 with Retry-After
+        """
+        app = Flask(__name__)
+        api = NARF(app)
+        entered = Event()
+        release = Event()
+
+        @api.endpoint('/slow', limiter=ConcurrencyLimiter(1, retry_after=5))
+        def slow():
+            entered.set()
+            release.wait()
+            return {'slow': True}
+
+        responses = []
+        request = Thread(target=lambda: responses.append(app.test_client().get('/slow')))
+        request.start()
+        entered.wait()
+        shed_response = app.test_client().get('/slow', headers={'Accept': 'application/json'})
+        release.set()
+        request.join()
+
+        self.assertEqual(responses[0].status_code, 200)
+        self.assertEqual(shed_response.status_code, 503)
+        self.assertEqual(shed_response.headers['Retry-After'], '5')
+        self.assertEqual(json.loads(shed_response.data)['code'], '503')
+        stats = api.metrics()['endpoints']['slow']['concurrency']
+        self.assertEqual(stats['shed'], 1)
+        self.assertEqual(stats['admitted'], 1)
+        self.assertEqual(stats['in_flight'], 0)
+
+    def test_concurrent_serialization(self):
+        """
+        Test concurrent requests on one endpoint don't share request state
+        """
+        app = Flask(__name__)
+        api = NARF(app)
+
+        class ItemSerializer(Serializer):
+            id = Field(pk=True)
+
+        @api.register(ItemSerializer)
+        @api.endpoint('/items/<int:item_id>')
+        def items(item_id):
+            return {'id': item_id}
+
+        results = {}
+
+        def fetch(item_id):
+            client = app.test_client()
+            for _ in range(20):
+                response = client.get('/items/{0}'.format(item_id))
+                results.setdefault(item_id, set()).add(response.data)
+
+        threads = [Thread(target=fetch, args=(item_id,)) for item_id in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        for item_id in range(8):
+            self.assertEqual(results[item_id], set(['{"items": [{"id": %d}]}' % item_id]))
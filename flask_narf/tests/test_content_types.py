@@ -1,5 +1,17 @@
-from flask import json
-from flask.ext.narf.fields import URIField
+from threading import Event
+from time import sleep, time
+from unittest import TestCase
+
+from flask import Flask, json
+from flask.ext.narf import NARF
+from flask.ext.narf.content_types import (
+    DEFAULT_ERRORS, JSON, CollectionPlusJSON, Event as StreamEvent, EventStream, last_event_id
+)
+from flask.ext.narf.deserializers import Deserializer
+from flask.ext.narf.exceptions import NotFound
+from flask.ext.narf.fields import Field, StringField, URIField
+from flask.ext.narf.filters import Filter, FilterSet
+from flask.ext.narf.serializers import Serializer
 
 from test_api import APITest, TEST_API
 
@@ -16,6 +28,20 @@ class ContentTypeTest(APITest):
     def get(self, path):
         return self.client.get(path, headers={'Accept': self.CONTENT_TYPE})
 
+    def head(self, path):
+        return self.client.head(path, headers={'Accept': self.CONTENT_TYPE})
+
+    def verify_head_response(self, path):
+        """
+        Verify a HEAD response has no body but the headers of the GET response
+        """
+        head_response = self.head(path)
+        get_response = self.get(path)
+        self.assertEqual(head_response.status_code, 200)
+        self.assertEqual(head_response.data, '')
+        self.assertEqual(head_response.mimetype, get_response.mimetype)
+        self.assertEqual(head_response.content_length, len(get_response.data))
+
 
 class TestJSON(ContentTypeTest):
     """
@@ -63,6 +89,65 @@ class TestJSON(ContentTypeTest):
         self.assertEqual(response.status_code, 500)
         # TODO(Dom): Update with more details once better error handling has been introduced
 
+    def test_json_head_default_endpoint_dict(self):
+        """
+        Test Content-Type: JSON HEAD request on default endpoint returning a dict
+        """
+        self.verify_head_response('/dict')
+
+    def test_json_head_fields_endpoint_list(self):
+        """
+        Test Content-Type: JSON HEAD request on an endpoint with fields returning a list
+        """
+        self.verify_head_response('/list/fields')
+
+    def test_json_error_not_found(self):
+        """
+        Test Content-Type: JSON on an endpoint raising a NotFound error
+        """
+        response = self.get('/error/not_found')
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(response.mimetype, self.CONTENT_TYPE)
+        data = json.loads(response.data)
+        self.assertEqual(data['error'], 'Not Found')
+        self.assertEqual(data['code'], '404')
+        self.assertNotIn('stacktrace', data)
+
+    def test_json_error_hides_unexpected_exception(self):
+        """
+        Test Content-Type: JSON hides details of unexpected errors without tracebacks enabled
+        """
+        response = self.get('/obj')
+        data = json.loads(response.data)
+        self.assertEqual(data['error'], 'Internal Server Error')
+        self.assertNotIn('stacktrace', data)
+
+    def test_json_error_tracebacks_enabled(self):
+        """
+        Test Content-Type: JSON includes the exception and stacktrace with tracebacks enabled
+        """
+        TEST_API.app.config['NARF_ERROR_TRACEBACKS'] = True
+        try:
+            response = self.get('/obj')
+        finally:
+            del TEST_API.app.config['NARF_ERROR_TRACEBACKS']
+        self.assertEqual(response.status_code, 500)
+        data = json.loads(response.data)
+        self.assertIn('TypeError', data['error'])
+        self.assertIsInstance(data['stacktrace'], list)
+
+    def test_json_error_bodies_memoized(self):
+        """
+        Test only the bodies of errors with their default message are memoized
+        """
+        not_found = JSON.error_body('Not Found', '404', NotFound.message)
+        self.assertIs(JSON.error_body('Not Found', '404', NotFound.message), not_found)
+        for index in range(300):
+            message = 'Invalid value for filter "q": {0}'.format(index)
+            body = JSON.error_body('Validation Error', '400', message)
+            self.assertEqual(json.loads(body)['message'], message)
+        self.assertLessEqual(set(JSON.__dict__['_error_bodies']), DEFAULT_ERRORS)
+
     def test_json_fields_endpoint_dict(self):
         """
         Test Content-Type: JSON on an endpoint with each kind of supported field returning a dict
@@ -94,9 +179,6 @@ class TestCollectionPlusJSON(ContentTypeTest):
     """
     CONTENT_TYPE = 'application/vnd.collection+json'
 
-    # TODO(Dom): Additional tests:
-    #   1. Endpoint with no pk field
-
     def verify_response_format(self, raw_data, fields):
         """
         Verify the response format for Content-Type: vnd.collection+json
@@ -157,6 +239,30 @@ class TestCollectionPlusJSON(ContentTypeTest):
         self.assertEqual(response.status_code, 500)
         # TODO(Dom): Update with more details once better error handling has been introduced
 
+    def test_collection_head_fields_endpoint_dict(self):
+        """
+        Test Content-Type: CollectionPlusJSON HEAD request on an endpoint with fields returning a dict
+        """
+        self.verify_head_response('/dict/fields')
+
+    def test_collection_head_fields_endpoint_obj(self):
+        """
+        Test Content-Type: CollectionPlusJSON HEAD request on an endpoint with fields returning an object
+        """
+        self.verify_head_response('/obj/fields')
+
+    def test_collection_error_not_found(self):
+        """
+        Test Content-Type: CollectionPlusJSON on an endpoint raising a NotFound error
+        """
+        response = self.get('/error/not_found')
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(response.mimetype, self.CONTENT_TYPE)
+        collection = json.loads(response.data)['collection']
+        self.assertEqual(collection['title'], 'Not Found')
+        self.assertEqual(collection['code'], '404')
+        self.assertNotIn('stacktrace', collection)
+
     def test_collection_fields_endpoint_dict(self):
         """
         Test Content-Type: CollectionPlusJSON on an endpoint with each kind of supported field returning a dict
@@ -180,3 +286,197 @@ class TestCollectionPlusJSON(ContentTypeTest):
         response = self.get('/obj/fields')
         self.assertEqual(response.status_code, 200)
         self.verify_response_format(response.data, {'field': basestring})
+
+
+class TestCollectionLayout(TestCase):
+
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.api = NARF(self.app)
+
+        class BookSerializer(Serializer):
+            id = Field(pk=True)
+            title = StringField(display_prompt='Title')
+            cover = URIField(relation='image')
+
+        class NoteSerializer(Serializer):
+            text = StringField()
+
+        class BookDeserializer(Deserializer):
+            title = StringField(display_prompt='Title')
+            author = StringField(source='author_id')
+
+        class BookFilterSet(FilterSet):
+            title = Filter(StringField(display_prompt='Title contains'))
+
+        self.BookSerializer = BookSerializer
+
+        @self.api.register(BookFilterSet)
+        @self.api.register(BookDeserializer)
+        @self.api.register(BookSerializer)
+        @self.api.endpoint('/books')
+        def books(filterset):
+            return [{'id': 1, 'title': 'One', 'cover': '/covers/1'}]
+
+        @self.api.register(NoteSerializer)
+        @self.api.endpoint('/notes')
+        def notes():
+            return [{'text': 'first'}, {'text': 'second'}]
+
+        self.client = self.app.test_client()
+
+    def get(self, path):
+        response = self.client.get(path, headers={'Accept': CollectionPlusJSON.CONTENT_TYPE})
+        self.assertEqual(response.status_code, 200)
+        return json.loads(response.data)['collection']
+
+    def test_items(self):
+        """
+        Test items are filled in from the layout computed once per Serializer
+        """
+        self.assertEqual(self.get('/books')['items'], [{
+            'href': 'http://localhost/books/1',
+            'data': [
+                {'name': 'id', 'value': 1}, {'name': 'title', 'value': 'One', 'prompt': 'Title'}
+            ],
+            'links': [{'rel': 'image', 'href': '/covers/1'}],
+        }])
+        layout = CollectionPlusJSON.layout(self.BookSerializer)
+        self.get('/books')
+        self.assertIs(CollectionPlusJSON.layout(self.BookSerializer), layout)
+
+    def test_no_pk(self):
+        """
+        Test items of a Serializer without a pk field have no href
+        """
+        self.assertEqual(self.get('/notes')['items'], [
+            {'data': [{'name': 'text', 'value': 'first'}]},
+            {'data': [{'name': 'text', 'value': 'second'}]},
+        ])
+        self.api.warm_up(strict=True)
+
+    def test_templates(self):
+        """
+        Test NARF_COLLECTION_TEMPLATES adds the template of the Deserializer and the queries of
+        the FilterSet
+        """
+        self.assertNotIn('template', self.get('/books'))
+        self.app.config['NARF_COLLECTION_TEMPLATES'] = True
+        collection = self.get('/books?title=On')
+        self.assertEqual(collection['template'], {'data': [
+            {'name': 'author_id', 'value': ''},
+            {'name': 'title', 'value': '', 'prompt': 'Title'},
+        ]})
+        self.assertEqual(collection['queries'], [{
+            'href': 'http://localhost/books', 'rel': 'search',
+            'data': [{'name': 'title', 'value': '', 'prompt': 'Title contains'}],
+        }])
+        self.assertNotIn('template', self.get('/notes'))
+
+
+class TestEventStream(TestCase):
+
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.app.config['NARF_STREAM_HEARTBEAT'] = 0.01
+        self.app.config['NARF_STREAM_RETRY'] = 2000
+        self.app.config['NARF_MAX_STREAMS'] = 1
+        self.api = NARF(self.app)
+        self.release = Event()
+        changes = [{'id': 1, 'name': 'one'}, {'id': 2, 'name': 'two'}, {'id': 3, 'name': 'three'}]
+
+        class ChangeSerializer(Serializer):
+            id = Field(pk=True)
+            name = StringField()
+
+        @self.api.register(EventStream)
+        @self.api.register(ChangeSerializer)
+        @self.api.endpoint('/changes')
+        def changes_feed():
+            after = int(last_event_id() or 0)
+            return (change for change in changes if change['id'] > after)
+
+        @self.api.register(EventStream)
+        @self.api.endpoint('/slow')
+        def slow():
+            self.release.wait(5)
+            yield StreamEvent({'released': True}, id='r', event='release')
+            raise NotFound('No more events')
+
+        self.client = self.app.test_client()
+
+    def stream(self, path, headers=None):
+        return self.client.get(
+            path, headers=dict(headers or {}, Accept=EventStream.CONTENT_TYPE), buffered=False
+        )
+
+    def test_events(self):
+        """
+        Test items are pushed as events with their pk as id, resuming after Last-Event-ID
+        """
+        response = self.stream('/changes')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, 'text/event-stream')
+        self.assertEqual(response.headers['Cache-Control'], 'no-cache')
+        self.assertEqual(response.get_data(), (
+            'retry: 2000\n\n'
+            'id: 1\ndata: {"id": 1, "name": "one"}\n\n'
+            'id: 2\ndata: {"id": 2, "name": "two"}\n\n'
+            'id: 3\ndata: {"id": 3, "name": "three"}\n\n'
+        ))
+        response.close()
+        response = self.stream('/changes', headers={'Last-Event-ID': '2'})
+        self.assertEqual(
+            response.get_data(), 'retry: 2000\n\nid: 3\ndata: {"id": 3, "name": "three"}\n\n'
+        )
+        response.close()
+
+    def test_heartbeat_and_errors(self):
+        """
+        Test idle streams get heartbeats and errors end the stream with an error event
+        """
+        response = self.stream('/slow')
+        chunks = iter(response.response)
+        self.assertEqual(next(chunks), 'retry: 2000\n\n')
+        self.assertEqual(next(chunks), ': heartbeat\n\n')
+        self.release.set()
+        rest = ''.join(chunks)
+        self.assertIn('id: r\nevent: release\ndata: {"released": true}\n\n', rest)
+        self.assertTrue(rest.endswith('event: error\ndata: {0}\n\n'.format(json.dumps(
+            {'error': 'Not Found', 'code': '404', 'message': 'No more events'}
+        ))))
+        response.close()
+
+    def test_max_streams(self):
+        """
+        Test streams beyond NARF_MAX_STREAMS are refused until open streams are closed
+        """
+        response = self.stream('/slow')
+        refused = self.stream('/changes')
+        self.assertEqual(refused.status_code, 503)
+        self.assertTrue(refused.get_data().startswith('event: error\n'))
+        self.release.set()
+        response.close()
+        response = self.stream('/changes')
+        self.assertEqual(response.status_code, 200)
+        response.close()
+        self.assertEqual(self.api.metrics()['streams']['shed'], 1)
+
+    def test_idle_producer_holds_slot(self):
+        """
+        Test a stream closed while its producer waits on an idle feed stays open until the
+        producer stops
+        """
+        response = self.stream('/slow')
+        chunks = iter(response.response)
+        self.assertEqual(next(chunks), 'retry: 2000\n\n')
+        self.assertEqual(next(chunks), ': heartbeat\n\n')
+        response.close()
+        self.assertEqual(self.stream('/changes').status_code, 503)
+        self.release.set()
+        deadline = time() + 5
+        while self.api.streams.in_flight and time() < deadline:
+            sleep(0.001)
+        response = self.stream('/changes')
+        self.assertEqual(response.status_code, 200)
+        response.close()
@@ -0,0 +1,188 @@
+from threading import Condition
+from unittest import TestCase
+
+from flask import Flask, json
+from flask.ext.narf import NARF
+from flask.ext.narf.coroutines import BatchLoader, EventLoop, Return, call, gather
+from flask.ext.narf.exceptions import NotFound
+from flask.ext.narf.fields import Field, LoadedField
+from flask.ext.narf.serializers import Serializer
+
+
+class Rendezvous(object):
+    """
+    Lets calls wait until `parties` of them run at the same time
+    """
+
+    def __init__(self, parties):
+        self.parties = parties
+        self.arrived = 0
+        self.condition = Condition()
+
+    def meet(self, value):
+        with self.condition:
+            self.arrived += 1
+            self.condition.notify_all()
+            while self.arrived < self.parties:
+                self.condition.wait(1)
+            if self.arrived < self.parties:
+                raise RuntimeError('calls did not run concurrently')
+        return value
+
+
+class TestEventLoop(TestCase):
+
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.loop = EventLoop(workers=4)
+        self.loads = []
+        self.loader = BatchLoader(self.load_many)
+
+    def tearDown(self):
+        self.loop.close()
+
+    def load_many(self, keys):
+        self.loads.append(sorted(keys))
+        return {key: key * 10 for key in keys}
+
+    def run_coroutine(self, coroutine):
+        with self.app.test_request_context('/'):
+            return self.loop.run(coroutine)
+
+    def test_gather(self):
+        """
+        Test calls yielded together run concurrently
+        """
+        rendezvous = Rendezvous(2)
+
+        def view():
+            first, second = yield gather(call(rendezvous.meet, 1), call(rendezvous.meet, 2))
+            raise Return(first + second)
+
+        self.assertEqual(self.run_coroutine(view()), 3)
+        self.assertEqual(self.loop.stats()['calls'], 2)
+
+    def test_sub_coroutines(self):
+        """
+        Test coroutines waiting on coroutines, running concurrently
+        """
+        rendezvous = Rendezvous(2)
+
+        def fetch(value):
+            result = yield call(rendezvous.meet, value)
+            raise Return(result * 2)
+
+        def view():
+            results = yield [fetch(1), fetch(2)]
+            raise Return(results)
+
+        self.assertEqual(self.run_coroutine(view()), [2, 4])
+
+    def test_errors(self):
+        """
+        Test errors of calls are raised in the coroutine waiting on them
+        """
+
+        def fail():
+            raise NotFound()
+
+        def view():
+            try:
+                yield call(fail)
+            except NotFound:
+                pass
+            yield call(fail)
+
+        with self.assertRaises(NotFound):
+            self.run_coroutine(view())
+
+        def wrong():
+            yield 'something'
+
+        with self.assertRaises(TypeError):
+            self.run_coroutine(wrong())
+
+    def test_batch_loader(self):
+        """
+        Test loads waited on at the same time share one call and are cached
+        """
+
+        def fetch(key):
+            value = yield self.loader.load(key)
+            raise Return(value)
+
+        def view():
+            values = yield [fetch(1), fetch(2), self.loader.load_many([2, 3])]
+            cached = yield self.loader.load(3)
+            raise Return((values, cached))
+
+        self.assertEqual(self.run_coroutine(view()), ([10, 20, [20, 30]], 30))
+        self.assertEqual(self.loads, [[1, 2, 3]])
+
+    def test_max_batch(self):
+        """
+        Test loads are split in batches of max_batch keys
+        """
+        loader = BatchLoader(self.load_many, max_batch=2)
+        with self.app.test_request_context('/'):
+            loader.prime([1, 2, 3, 1])
+            self.assertEqual(loader.get(3), 30)
+        self.assertEqual(self.loads, [[1, 2], [3]])
+
+
+class TestCoroutineEndpoint(TestCase):
+
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.api = NARF(self.app)
+        self.loads = []
+
+        def load_authors(keys):
+            self.loads.append(sorted(keys))
+            return {key: 'author {0}'.format(key) for key in keys}
+
+        class BookSerializer(Serializer):
+            id = Field(pk=True)
+            author = LoadedField(BatchLoader(load_authors), source='author_id')
+
+        def fetch_books():
+            return [{'id': 1, 'author_id': 7}, {'id': 2, 'author_id': 8}, {'id': 3, 'author_id': 7}]
+
+        @self.api.register(BookSerializer)
+        @self.api.endpoint('/books', coroutine=True)
+        def books():
+            books = yield call(fetch_books)
+            raise Return(books)
+
+        @self.api.endpoint('/missing', coroutine=True)
+        def missing():
+            yield call(fetch_books)
+            raise NotFound()
+
+        self.client = self.app.test_client()
+
+    def tearDown(self):
+        self.api.loop.close()
+
+    def test_coroutine_view(self):
+        """
+        Test coroutine views are serialized like any view, loading related fields in a batch
+        """
+        response = self.client.get('/books')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [item['author'] for item in json.loads(response.data)['items']],
+            ['author 7', 'author 8', 'author 7']
+        )
+        self.assertEqual(self.loads, [[7, 8]])
+        response = self.client.get('/books', headers={'Accept': 'application/vnd.collection+json'})
+        self.assertEqual(len(json.loads(response.data)['collection']['items']), 3)
+        # the loaded values are only cached for a request
+        self.assertEqual(self.loads, [[7, 8], [7, 8]])
+        self.assertEqual(self.api.metrics()['coroutines']['coroutines'], 2)
+
+    def test_coroutine_error(self):
+        """
+        Test errors raised by coroutine views give error responses
+        """
+        self.assertEqual(self.client.get('/missing').status_code, 404)
@@ -1,7 +1,17 @@
+from datetime import date, datetime, timedelta, tzinfo
+from decimal import Decimal
 from mock import patch
 from unittest import TestCase
 
-from flask.ext.narf.fields import Field, StringField, URIField, RelatedURIField, FieldRef
+from flask import Flask
+
+from flask.ext.narf.deserializers import Deserializer
+from flask.ext.narf.fields import (
+    Field, StringField, URIField, RelatedURIField, FieldRef, IntegerField, FloatField,
+    BooleanField, DecimalField, DateTimeField, DateField, EnumField, ListField, NestedField
+)
+from flask.ext.narf.filters import Filter
+from flask.ext.narf.serializers import Serializer
 
 
 class TestField(TestCase):
@@ -144,7 +154,7 @@ class TestRelatedURIField(TestCase):
         """
         Test a RelatedURIField with default configuration
         """
-        request.url_root = 'http://api.narf.com/'
+        request.url_root = request.host_url = 'http://api.narf.com/'
         url_for.return_value = '/api/v1/endpoint'
         field = RelatedURIField('endpoint')
         value = 'http://api.narf.com/api/v1/endpoint'
@@ -161,7 +171,7 @@ class TestRelatedURIField(TestCase):
         """
         Test a RelatedURIField with filters overriden
         """
-        request.url_root = 'http://api.narf.com/'
+        request.url_root = request.host_url = 'http://api.narf.com/'
         url_for.return_value = '/api/v1/endpoint'
         field = RelatedURIField('endpoint', filters={'filter': 'filter'})
         value = 'http://api.narf.com/api/v1/endpoint?filter=filter'
@@ -175,7 +185,7 @@ class TestRelatedURIField(TestCase):
         """
         Test a RelatedURIField with filters overriden and a field reference
         """
-        request.url_root = 'http://api.narf.com/'
+        request.url_root = request.host_url = 'http://api.narf.com/'
         url_for.return_value = '/api/v1/endpoint'
         field = RelatedURIField('endpoint', filters={'filter': FieldRef('source')})
         value = 'http://api.narf.com/api/v1/endpoint?filter=source_value'
@@ -205,3 +215,168 @@ class TestRelatedURIField(TestCase):
         value = 'relation'
         field = RelatedURIField('endpoint', relation=value)
         self.assertEqual(value, field.relation)
+
+    def test_script_root(self):
+        """
+        Test links under a script root are the same whether the field was prepared or not
+        """
+        app = Flask(__name__)
+        app.add_url_rule('/others', 'others', view_func=lambda: '')
+        field = RelatedURIField('others')
+        links = []
+        for prepared in (False, True):
+            if prepared:
+                field.prepare(app)
+            with app.test_request_context('/items', base_url='http://localhost/api'):
+                field.bind(self, 'field_name', {})
+                links.append(field.serialize_value())
+        self.assertEqual(links, ['http://localhost/api/others'] * 2)
+
+
+class UTCPlusTwo(tzinfo):
+
+    def utcoffset(self, dt):
+        return timedelta(hours=2)
+
+    def dst(self, dt):
+        return timedelta(0)
+
+
+class TestTypedFields(TestCase):
+
+    def serialize(self, field, value):
+        field.bind(Serializer(), 'field_name', {'field_name': value})
+        return field.serialize_value()
+
+    def deserialize(self, field, value):
+        field.bind(Filter(field), 'field_name', {'field_name': value})
+        return field.deserialize_value()
+
+    def test_numbers(self):
+        """
+        Test IntegerField and FloatField conversions
+        """
+        self.assertEqual(self.serialize(IntegerField(), '3'), 3)
+        self.assertEqual(self.deserialize(IntegerField(), '3'), 3)
+        self.assertEqual(self.serialize(FloatField(), 2), 2.0)
+        self.assertEqual(self.deserialize(FloatField(), '2.5'), 2.5)
+        self.assertIsNone(self.deserialize(IntegerField(), None))
+        with self.assertRaises(ValueError):
+            self.deserialize(IntegerField(), 'three')
+
+    def test_boolean(self):
+        """
+        Test BooleanField spellings of raw and input values
+        """
+        self.assertIs(self.serialize(BooleanField(), 1), True)
+        self.assertIs(self.serialize(BooleanField(), 'false'), False)
+        self.assertIs(self.serialize(BooleanField(), '0'), False)
+        self.assertIs(self.serialize(BooleanField(), ' On'), True)
+        self.assertIs(self.serialize(BooleanField(), 0.0), False)
+        self.assertIs(self.deserialize(BooleanField(), 'Yes'), True)
+        self.assertIs(self.deserialize(BooleanField(), '0'), False)
+        with self.assertRaises(ValueError):
+            self.deserialize(BooleanField(), 'maybe')
+
+    def test_decimal(self):
+        """
+        Test DecimalField keeps its precision
+        """
+        self.assertEqual(self.serialize(DecimalField(), Decimal('1.10')), '1.10')
+        self.assertEqual(self.serialize(DecimalField(places=2), 3), '3.00')
+        self.assertEqual(self.deserialize(DecimalField(), '0.1'), Decimal('0.1'))
+        with self.assertRaises(ValueError):
+            self.deserialize(DecimalField(), 'abc')
+
+    def test_datetime(self):
+        """
+        Test DateTimeField formatting with and without microseconds and offsets
+        """
+        field = DateTimeField()
+        value = datetime(2015, 10, 21, 16, 29, 1)
+        self.assertEqual(self.serialize(field, value), '2015-10-21T16:29:01')
+        self.assertEqual(
+            self.serialize(field, value.replace(microsecond=5)), '2015-10-21T16:29:01.000005'
+        )
+        self.assertEqual(
+            self.serialize(field, value.replace(tzinfo=UTCPlusTwo(), microsecond=5)),
+            '2015-10-21T16:29:01.000005+02:00'
+        )
+        self.assertEqual(
+            self.serialize(DateTimeField(format='%d/%m/%Y %H:%M'), value), '21/10/2015 16:29'
+        )
+        self.assertEqual(self.deserialize(field, '2015-10-21T16:29:01Z'), value)
+        self.assertEqual(
+            self.deserialize(field, '2015-10-21T16:29:01.5'), value.replace(microsecond=500000)
+        )
+
+    def test_datetime_memoized_per_second(self):
+        """
+        Test datetimes within the same second are formatted once
+        """
+        field = DateTimeField()
+        value = datetime(2015, 10, 21, 16, 29, 1)
+        for microsecond in (0, 10, 20):
+            self.serialize(field.clone(), value.replace(microsecond=microsecond))
+        self.serialize(field.clone(), value + timedelta(seconds=1))
+        self.assertEqual(len(field.memo), 2)
+
+    def test_date(self):
+        """
+        Test DateField conversions
+        """
+        self.assertEqual(self.serialize(DateField(), date(2015, 10, 21)), '2015-10-21')
+        self.assertEqual(self.deserialize(DateField(), '2015-10-21'), date(2015, 10, 21))
+
+    def test_enum(self):
+        """
+        Test EnumField only accepts its choices
+        """
+        field = EnumField([1, 2])
+        self.assertEqual(self.deserialize(field, '2'), 2)
+        self.assertEqual(field.describe('field_name')['choices'], [1, 2])
+        with self.assertRaises(ValueError):
+            self.deserialize(EnumField(['a', 'b']), 'c')
+
+    def test_list(self):
+        """
+        Test ListField converts every value with its item field
+        """
+        self.assertEqual(self.serialize(ListField(IntegerField()), ['1', 2]), [1, 2])
+        self.assertEqual(self.deserialize(ListField(IntegerField()), '1,2,3'), [1, 2, 3])
+        self.assertEqual(self.deserialize(ListField(IntegerField()), ''), [])
+
+    def test_nested(self):
+        """
+        Test NestedField serializes items with their own Serializer
+        """
+
+        class ChildSerializer(Serializer):
+            id = IntegerField()
+            name = StringField()
+
+        field = NestedField(ChildSerializer)
+        self.assertEqual(
+            self.serialize(field, {'id': '1', 'name': 'child'}), {'id': 1, 'name': u'child'}
+        )
+        self.assertEqual(
+            self.serialize(ListField(NestedField(ChildSerializer)), [{'id': 2, 'name': 'x'}]),
+            [{'id': 2, 'name': u'x'}]
+        )
+        with self.assertRaises(ValueError):
+            self.deserialize(field, 'not an object')
+
+    def test_deserializer(self):
+        """
+        Test typed fields on a Deserializer
+        """
+
+        class InputDeserializer(Deserializer):
+            count = IntegerField()
+            enabled = BooleanField()
+            tags = ListField(EnumField(['a', 'b']))
+
+        deserializer = InputDeserializer({'count': '4', 'enabled': 'true', 'tags': ['a']})
+        self.assertEqual(deserializer.deserialize(), {'count': 4, 'enabled': True, 'tags': ['a']})
+        with self.assertRaises(ValueError):
+            InputDeserializer({'count': '4', 'enabled': 'true'})
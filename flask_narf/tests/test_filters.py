@@ -1,6 +1,9 @@
 from mock import patch
 from unittest import TestCase
 
+from flask import Flask, json
+from flask.ext.narf import NARF
+from flask.ext.narf.exceptions import ValidationError
 from flask.ext.narf.fields import Field, StringField
 from flask.ext.narf.filters import Filter, FilterSet
 
@@ -52,3 +55,97 @@ class TestFilterSet(TestCase):
         filter_set.validate_inputs()
         self.assertIsNone(filter_set.field.validated_value)
         self.assertIsNone(filter_set.string_field.validated_value)
+
+    @patch('flask.ext.narf.filters.request')
+    def test_filter_set_invalid_input(self, request):
+        """
+        Test a FilterSet with an input its field can't deserialize
+        """
+        request.args = {'number': 'one'}
+
+        class NumberField(Field):
+
+            def deserialize_value(self):
+                return int(self.raw_value)
+
+        class MyFilterSet(FilterSet):
+            number = Filter(NumberField())
+
+        filter_set = MyFilterSet()
+        with self.assertRaises(ValidationError) as context:
+            filter_set.validate_inputs()
+        self.assertEqual(context.exception.status_code, 400)
+        self.assertIn('"number"', context.exception.message)
+
+    def test_parse_cached(self):
+        """
+        Test parsing the same filters twice validates them once
+        """
+        calls = []
+
+        class CountingField(Field):
+
+            def deserialize_value(self):
+                calls.append(self.raw_value)
+                return self.raw_value
+
+        class MyFilterSet(FilterSet):
+            field = Filter(CountingField())
+            other = Filter(StringField(source='renamed'))
+
+        first = MyFilterSet.parse({'field': 'input', 'renamed': 'x'})
+        # parameters no filter reads are ignored
+        second = MyFilterSet.parse({'renamed': 'x', 'field': 'input', 'page': '2'})
+        self.assertIs(first, second)
+        self.assertEqual(calls, ['input'])
+        self.assertEqual(first.field.validated_value, 'input')
+        self.assertEqual(first.other.validated_value, 'x')
+        self.assertEqual(first.key(), (('field', 'input'), ('other', u'x')))
+        self.assertIsNot(MyFilterSet.parse({'field': 'other'}), first)
+        with self.assertRaises(AttributeError):
+            first.field = None
+
+    def test_parse_keeps_interface(self):
+        """
+        Test the methods and properties of a FilterSet subclass work on its parsed values
+        """
+        app = Flask(__name__)
+        api = NARF(app)
+
+        class MyFilterSet(FilterSet):
+            name = Filter(StringField())
+            LABEL = 'Name'
+
+            @property
+            def is_set(self):
+                return self.name.validated_value is not None
+
+            def label(self):
+                return u'{0}: {1}'.format(self.LABEL, self.name.validated_value)
+
+        @api.register(MyFilterSet)
+        @api.endpoint('/label')
+        def label(filterset):
+            return {'label': filterset.label(), 'is_set': filterset.is_set}
+
+        response = app.test_client().get('/label?name=narf')
+        self.assertEqual(json.loads(response.data), {'label': 'Name: narf', 'is_set': True})
+        with self.assertRaises(AttributeError):
+            MyFilterSet.parse({}).missing
+
+    def test_parse_invalid_input(self):
+        """
+        Test invalid input raises a ValidationError on every parse
+        """
+
+        class NumberField(Field):
+
+            def deserialize_value(self):
+                return int(self.raw_value)
+
+        class MyFilterSet(FilterSet):
+            number = Filter(NumberField())
+
+        for _ in range(2):
+            with self.assertRaises(ValidationError):
+                MyFilterSet.parse({'number': 'one'})
@@ -0,0 +1,194 @@
+from threading import Event
+from time import sleep, time
+from unittest import TestCase
+
+import mock
+from flask import Flask, json
+from flask.ext.narf import NARF
+from flask.ext.narf.exceptions import NotFound, ServiceUnavailable
+from flask.ext.narf.fields import Field
+from flask.ext.narf.filters import FilterSet
+from flask.ext.narf.jobs import JobManager
+from flask.ext.narf.resources import Reply
+from flask.ext.narf.serializers import Serializer
+from flask.ext.narf.sorting import Sort
+
+
+def wait_for(job):
+    while not job.ready():
+        sleep(0.001)
+
+
+class TestJobManager(TestCase):
+
+    def tearDown(self):
+        self.jobs.close()
+
+    def test_result(self):
+        """
+        Test a job runs in the background and keeps its result
+        """
+        self.jobs = JobManager(workers=1)
+        job = self.jobs.submit('endpoint', lambda value: value * 2, (21,), {})
+        wait_for(job)
+        self.assertEqual(job.status, 'done')
+        self.assertEqual(job.result(), 42)
+        self.assertIs(self.jobs.get(job.id), job)
+
+    def test_failed(self):
+        """
+        Test a failed job raises its error for its result
+        """
+        self.jobs = JobManager(workers=1)
+
+        def fail():
+            raise NotFound()
+
+        job = self.jobs.submit('endpoint', fail, (), {})
+        wait_for(job)
+        self.assertEqual(job.status, 'failed')
+        with self.assertRaises(NotFound):
+            job.result()
+
+    def test_processes(self):
+        """
+        Test jobs can run on a process pool
+        """
+        self.jobs = JobManager(workers=1, processes=True)
+        job = self.jobs.submit('endpoint', pow, (2, 10), {})
+        self.assertEqual(job.async_result.get(5), 1024)
+
+    def test_max_pending(self):
+        """
+        Test submissions beyond max_pending are rejected
+        """
+        self.jobs = JobManager(workers=1, max_pending=1)
+        release = Event()
+        job = self.jobs.submit('endpoint', release.wait, (), {})
+        with self.assertRaises(ServiceUnavailable):
+            self.jobs.submit('endpoint', release.wait, (), {})
+        release.set()
+        wait_for(job)
+        self.jobs.submit('endpoint', release.wait, (), {})
+        self.assertEqual(self.jobs.stats()['rejected'], 1)
+
+    def test_ttl(self):
+        """
+        Test results are dropped ttl seconds after the job finished
+        """
+        self.jobs = JobManager(workers=1, ttl=10)
+        job = self.jobs.submit('endpoint', lambda: 1, (), {})
+        wait_for(job)
+        self.assertIs(self.jobs.get(job.id), job)
+        with mock.patch('flask_narf.jobs.time', return_value=time() + 20):
+            self.assertIsNone(self.jobs.get(job.id))
+        self.assertEqual(self.jobs.stats()['expired'], 1)
+
+
+class TestJobEndpoint(TestCase):
+
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.api = NARF(self.app)
+        self.release = Event()
+
+        class ReportSerializer(Serializer):
+            id = Field(pk=True)
+            total = Field()
+
+        @self.api.register(ReportSerializer)
+        @self.api.endpoint('/reports', job=True)
+        def reports():
+            self.release.wait()
+            return [{'id': 1, 'total': 10}]
+
+        class ReportFilterSet(FilterSet):
+            sort = Sort(ReportSerializer)
+
+        @self.api.register(ReportSerializer)
+        @self.api.register(ReportFilterSet)
+        @self.api.endpoint('/sorted', job=True)
+        def sorted_reports(filterset):
+            return [{'id': 2, 'total': 20}, {'id': 3, 'total': 30}, {'id': 1, 'total': 10}]
+
+        @self.api.endpoint('/versioned', job=True)
+        def versioned():
+            return Reply({'total': 10}, 203, {'ETag': '"v1"'})
+
+        @self.api.endpoint('/broken', job=True)
+        def broken():
+            raise NotFound('No such report')
+
+        self.client = self.app.test_client()
+
+    def tearDown(self):
+        self.api.jobs.close()
+
+    def test_job(self):
+        """
+        Test a job endpoint answers 202 and serves the result from its status URL
+        """
+        response = self.client.get('/reports')
+        self.assertEqual(response.status_code, 202)
+        status = json.loads(response.data)
+        self.assertEqual(status['status'], 'pending')
+        self.assertEqual(status['href'], 'http://localhost/reports/jobs/{0}'.format(status['job']))
+        self.assertEqual(response.headers['Location'], status['href'])
+
+        pending = self.client.get(status['href'])
+        self.assertEqual(pending.status_code, 202)
+        self.assertEqual(pending.headers['Retry-After'], '1')
+
+        self.release.set()
+        wait_for(self.api.jobs.get(status['job']))
+        done = self.client.get(status['href'])
+        self.assertEqual(done.status_code, 200)
+        self.assertEqual(json.loads(done.data), {'items': [{'id': 1, 'total': 10}]})
+        done = self.client.get(
+            status['href'], headers={'Accept': 'application/vnd.collection+json'}
+        )
+        self.assertEqual(done.mimetype, 'application/vnd.collection+json')
+        self.assertEqual(self.api.metrics()['jobs']['submitted'], 1)
+
+    def result(self, path, headers=None):
+        status = json.loads(self.client.get(path, headers=headers).data)
+        wait_for(self.api.jobs.get(status['job']))
+        return self.client.get(status['href'])
+
+    def test_processed_result(self):
+        """
+        Test job results are sorted and ranged for the submitting request
+        """
+        response = self.result('/sorted?sort=-id', headers={'Range': 'items=0-1'})
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response.headers['Content-Range'], 'items 0-1/3')
+        self.assertEqual([item['id'] for item in json.loads(response.data)['items']], [3, 2])
+
+    def test_reply_result(self):
+        """
+        Test a Reply job result responds with its status and headers
+        """
+        response = self.result('/versioned')
+        self.assertEqual(response.status_code, 203)
+        self.assertEqual(response.headers['ETag'], '"v1"')
+        self.assertEqual(json.loads(response.data), {'total': 10})
+
+    def test_failed_job(self):
+        """
+        Test a failed job responds with its error
+        """
+        status = json.loads(self.client.get('/broken').data)
+        wait_for(self.api.jobs.get(status['job']))
+        response = self.client.get(status['href'])
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(json.loads(response.data)['message'], 'No such report')
+
+    def test_unknown_job(self):
+        """
+        Test unknown jobs and jobs of other endpoints are not found
+        """
+        self.assertEqual(self.client.get('/reports/jobs/unknown').status_code, 404)
+        self.release.set()
+        status = json.loads(self.client.get('/reports').data)
+        response = self.client.get('/broken/jobs/{0}'.format(status['job']))
+        self.assertEqual(response.status_code, 404)
@@ -0,0 +1,168 @@
+from itertools import count
+from os import path
+from shutil import rmtree
+from tempfile import mkdtemp
+from threading import Thread
+from time import time
+from unittest import TestCase
+
+import mock
+from flask import Flask, json
+from flask.ext.narf import NARF
+from flask.ext.narf.exceptions import ServiceUnavailable
+from flask.ext.narf.pools import ResourcePool, SQLitePool
+
+
+class TestResourcePool(TestCase):
+
+    def setUp(self):
+        self.counter = count()
+        self.closed = []
+
+    def make_pool(self, **kwargs):
+        return ResourcePool(lambda: next(self.counter), close=self.closed.append, **kwargs)
+
+    def test_reuse(self):
+        """
+        Test returned resources are handed out again
+        """
+        pool = self.make_pool()
+        resource = pool.acquire()
+        pool.release(resource)
+        self.assertEqual(pool.acquire(), resource)
+        stats = pool.stats()
+        self.assertEqual(stats['created'], 1)
+        self.assertEqual(stats['in_use'], 1)
+        self.assertEqual(stats['utilization'], 0.1)
+
+    def test_min_size(self):
+        """
+        Test min_size resources are made up front
+        """
+        pool = self.make_pool(min_size=2, max_size=2)
+        self.assertEqual(pool.stats()['idle'], 2)
+        with self.assertRaises(ValueError):
+            self.make_pool(min_size=3, max_size=2)
+
+    def test_exhausted(self):
+        """
+        Test checking out of an exhausted pool waits up to the timeout
+        """
+        pool = self.make_pool(max_size=1, timeout=0.01)
+        resource = pool.acquire()
+        with self.assertRaises(ServiceUnavailable) as context:
+            pool.acquire()
+        self.assertEqual(context.exception.headers['Retry-After'], '1')
+        self.assertEqual(pool.stats()['timeouts'], 1)
+
+        pool.timeout = None
+        acquired = []
+        waiter = Thread(target=lambda: acquired.append(pool.acquire()))
+        waiter.start()
+        while not pool.stats()['waits'] > 1:
+            waiter.join(0.001)
+        pool.release(resource)
+        waiter.join()
+        self.assertEqual(acquired, [resource])
+
+    def test_unhealthy_discarded(self):
+        """
+        Test resources failing their health check or reset are closed
+        """
+        pool = self.make_pool(health_check=lambda resource: resource != 0)
+        pool.release(pool.acquire())
+        self.assertEqual(pool.acquire(), 1)
+        self.assertEqual(self.closed, [0])
+
+        pool = self.make_pool(reset=mock.Mock(side_effect=RuntimeError))
+        pool.release(pool.acquire())
+        self.assertEqual(pool.stats()['discarded'], 1)
+        self.assertEqual(pool.stats()['size'], 0)
+
+    def test_failed_factory(self):
+        """
+        Test a failing factory doesn't use up the pool
+        """
+        pool = ResourcePool(mock.Mock(side_effect=RuntimeError), max_size=1)
+        for _ in range(2):
+            with self.assertRaises(RuntimeError):
+                pool.acquire()
+        self.assertEqual(pool.stats()['size'], 0)
+        self.assertEqual(pool.stats()['in_use'], 0)
+
+    def test_idle_eviction(self):
+        """
+        Test resources idle for too long are closed, keeping min_size
+        """
+        pool = self.make_pool(min_size=1, max_idle=10)
+        resources = [pool.acquire(), pool.acquire()]
+        for resource in resources:
+            pool.release(resource)
+        with mock.patch('flask_narf.pools.time', return_value=time() + 20):
+            pool.evict_idle()
+        stats = pool.stats()
+        self.assertEqual(stats['size'], 1)
+        self.assertEqual(stats['evicted'], 1)
+
+
+class TestSQLitePool(TestCase):
+
+    def setUp(self):
+        self.directory = mkdtemp()
+        self.pool = SQLitePool(path.join(self.directory, 'test.db'), max_size=1)
+
+    def tearDown(self):
+        self.pool.clear()
+        rmtree(self.directory)
+
+    def test_uncommitted_rolled_back(self):
+        """
+        Test connections are rolled back when returned
+        """
+        connection = self.pool.acquire()
+        connection.execute('CREATE TABLE items (id INTEGER)')
+        connection.commit()
+        connection.execute('INSERT INTO items VALUES (1)')
+        self.pool.release(connection)
+        connection = self.pool.acquire()
+        self.assertEqual(connection.execute('SELECT COUNT(*) FROM items').fetchone()[0], 0)
+        self.pool.release(connection)
+
+
+class TestRequestResources(TestCase):
+
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.api = NARF(self.app)
+        self.pool = self.api.add_pool('counter', ResourcePool(count, max_size=1, timeout=0))
+
+        @self.api.endpoint('/resource')
+        def resource():
+            first = self.api.acquire('counter')
+            self.assertIs(self.api.acquire('counter'), first)
+            return {'value': next(first)}
+
+        @self.api.endpoint('/error')
+        def error():
+            self.api.acquire('counter')
+            raise RuntimeError('failed')
+
+        self.client = self.app.test_client()
+
+    def test_returned_on_teardown(self):
+        """
+        Test a resource is checked out once per request and returned afterwards
+        """
+        self.assertEqual(json.loads(self.client.get('/resource').data), {'value': 0})
+        self.assertEqual(json.loads(self.client.get('/resource').data), {'value': 1})
+        stats = self.api.metrics()['pools']['counter']
+        self.assertEqual(stats['in_use'], 0)
+        self.assertEqual(stats['created'], 1)
+
+    def test_returned_after_error(self):
+        """
+        Test a resource is returned when the view raised
+        """
+        self.assertEqual(self.client.get('/error').status_code, 500)
+        self.assertEqual(self.pool.stats()['in_use'], 0)
+        self.assertEqual(self.client.get('/resource').status_code, 200)
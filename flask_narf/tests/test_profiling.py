@@ -0,0 +1,166 @@
+from os import listdir
+from shutil import rmtree
+from tempfile import mkdtemp
+from unittest import TestCase
+
+import mock
+from flask import Flask, json
+from flask.ext.narf import NARF
+
+
+class ProfilingTest(TestCase):
+
+    def make_api(self, **config):
+        app = Flask(__name__)
+        app.config.update(config)
+        api = NARF(app)
+
+        @api.endpoint('/')
+        def home():
+            return {'hello': 'world'}
+
+        return api
+
+    def test_profiling_disabled(self):
+        """
+        Test that no Profiler is set up without profiling config
+        """
+        api = self.make_api()
+        self.assertIsNone(api.profiler)
+        response = api.app.test_client().get('/', headers={'X-NARF-Profile': 'secret'})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('X-NARF-Profile-Time', response.headers)
+
+    def test_profiling_trusted_header(self):
+        """
+        Test profiling a request that sends the trusted header
+        """
+        api = self.make_api(NARF_PROFILE_TOKEN='secret')
+        client = api.app.test_client()
+        response = client.get('/', headers={'X-NARF-Profile': 'secret'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, '{"hello": "world"}')
+        self.assertIn('X-NARF-Profile-Time', response.headers)
+        self.assertIn('X-NARF-Profile-Summary', response.headers)
+        self.assertGreater(int(response.headers['X-NARF-Profile-Calls']), 0)
+
+    def test_profiling_untrusted_header(self):
+        """
+        Test that a wrong token does not trigger profiling
+        """
+        api = self.make_api(NARF_PROFILE_TOKEN='secret')
+        response = api.app.test_client().get('/', headers={'X-NARF-Profile': 'guess'})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('X-NARF-Profile-Time', response.headers)
+
+    def test_profiling_sampled_to_directory(self):
+        """
+        Test sampled profiling storing pstats files without exposing them to the client
+        """
+        output_dir = mkdtemp()
+        try:
+            api = self.make_api(NARF_PROFILE_SAMPLE_RATE=1.0, NARF_PROFILE_DIR=output_dir)
+            response = api.app.test_client().get('/')
+            self.assertEqual(response.status_code, 200)
+            self.assertNotIn('X-NARF-Profile-Time', response.headers)
+            profiles = listdir(output_dir)
+            self.assertEqual(len(profiles), 1)
+            self.assertTrue(profiles[0].startswith('home-'))
+            self.assertTrue(profiles[0].endswith('.prof'))
+        finally:
+            rmtree(output_dir)
+
+
+class MemoryTrackingTest(ProfilingTest):
+
+    def test_memory_tracking_disabled(self):
+        """
+        Test that no MemoryTracker is set up without memory tracking config
+        """
+        api = self.make_api()
+        self.assertIsNone(api.memory)
+        response = api.app.test_client().get('/', headers={'X-NARF-Memory': 'secret'})
+        self.assertNotIn('X-NARF-Memory-Peak', response.headers)
+        self.assertNotIn('memory', api.metrics())
+
+    def test_memory_tracking(self):
+        """
+        Test tracking the memory of each phase of a request that sends the trusted header
+        """
+        api = self.make_api(NARF_MEMORY_TOKEN='secret', NARF_METRICS_URL='/metrics')
+        client = api.app.test_client()
+        response = client.get('/', headers={'X-NARF-Memory': 'secret'})
+        self.assertEqual(response.data, '{"hello": "world"}')
+        peaks = response.headers['X-NARF-Memory-Peak'].split('; ')
+        self.assertEqual(
+            [peak.split('=')[0] for peak in peaks], ['response', 'serialization', 'view']
+        )
+        self.assertNotIn('X-NARF-Memory-Peak', client.get('/').headers)
+        memory = json.loads(client.get('/metrics').data)['memory']
+        self.assertEqual(memory['tracking'], 0)
+        self.assertEqual(memory['endpoints']['home']['view']['samples'], 1)
+
+    def test_tracemalloc(self):
+        """
+        Test tracemalloc measurements are aggregated per endpoint and phase
+        """
+        api = self.make_api(NARF_MEMORY_SAMPLE_RATE=1.0)
+        statistic = mock.Mock(size=64, traceback=[mock.Mock(filename='views.py', lineno=3)])
+        with mock.patch('flask_narf.profiling.tracemalloc') as tracemalloc:
+            tracemalloc.__file__ = 'tracemalloc.py'
+            tracemalloc.is_tracing.return_value = False
+            tracemalloc.get_traced_memory.return_value = (100, 300)
+            snapshot = tracemalloc.take_snapshot.return_value.filter_traces.return_value
+            snapshot.statistics.return_value = [statistic]
+            client = api.app.test_client()
+            client.get('/')
+            client.get('/')
+            stats = api.memory.stats()
+        self.assertEqual(tracemalloc.start.call_count, 2)
+        self.assertEqual(tracemalloc.stop.call_count, 2)
+        self.assertEqual(stats['backend'], 'tracemalloc')
+        self.assertEqual(stats['endpoints']['home']['serialization'], {
+            'samples': 2, 'mean_peak': 300, 'max_peak': 300, 'mean_retained': 100,
+            'top_sites': [('views.py:3', 128)],
+        })
+
+    def test_tracemalloc_started_elsewhere(self):
+        """
+        Test traces started by something else are never cleared, phases are measured as deltas
+        """
+        api = self.make_api(NARF_MEMORY_SAMPLE_RATE=1.0)
+        statistic = mock.Mock(size_diff=32, traceback=[mock.Mock(filename='views.py', lineno=3)])
+        with mock.patch('flask_narf.profiling.tracemalloc') as tracemalloc:
+            tracemalloc.__file__ = 'tracemalloc.py'
+            tracemalloc.is_tracing.return_value = True
+            # (current, peak) before and after each phase: a new peak, then an older one
+            tracemalloc.get_traced_memory.side_effect = [
+                (1000, 5000), (1100, 6000), (1100, 6000), (1050, 6000), (1050, 6000), (1080, 6000)
+            ]
+            snapshot = tracemalloc.take_snapshot.return_value.filter_traces.return_value
+            snapshot.compare_to.return_value = [statistic]
+            api.app.test_client().get('/')
+        self.assertFalse(tracemalloc.start.called)
+        self.assertFalse(tracemalloc.clear_traces.called)
+        self.assertFalse(tracemalloc.stop.called)
+        endpoints = api.memory.stats()['endpoints']['home']
+        self.assertEqual(endpoints['view']['mean_peak'], 5000)
+        self.assertEqual(endpoints['view']['mean_retained'], 100)
+        self.assertEqual(endpoints['serialization']['mean_peak'], 0)
+        self.assertEqual(endpoints['response']['mean_peak'], 30)
+        self.assertEqual(endpoints['view']['top_sites'], [('views.py:3', 32)])
+
+    def test_one_request_at_a_time(self):
+        """
+        Test requests picked while another one is tracked are handled untracked
+        """
+        api = self.make_api(NARF_MEMORY_TOKEN='secret')
+        api.memory.start()
+        try:
+            response = api.app.test_client().get('/', headers={'X-NARF-Memory': 'secret'})
+        finally:
+            api.memory.stop()
+        self.assertEqual(response.data, '{"hello": "world"}')
+        self.assertNotIn('X-NARF-Memory-Peak', response.headers)
+        stats = api.memory.stats()
+        self.assertEqual((stats['skipped'], stats['endpoints']), (1, {}))
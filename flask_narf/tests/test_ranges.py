@@ -0,0 +1,109 @@
+from unittest import TestCase
+
+from flask import Flask, json
+from flask.ext.narf import NARF
+from flask.ext.narf.fields import Field
+from flask.ext.narf.serializers import Serializer
+
+
+class TestRanges(TestCase):
+
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.api = NARF(self.app)
+        self.produced = []
+
+        class ItemSerializer(Serializer):
+            id = Field(pk=True)
+
+        @self.api.register(ItemSerializer)
+        @self.api.endpoint('/items', cache_timeout=60)
+        def items():
+            return [{'id': i} for i in range(5)]
+
+        def generate():
+            for i in range(5):
+                self.produced.append(i)
+                yield {'id': i}
+
+        @self.api.register(ItemSerializer)
+        @self.api.endpoint('/lazy')
+        def lazy():
+            return generate()
+
+        self.client = self.app.test_client()
+
+    def get(self, path, range_header=None):
+        headers = {'Range': range_header} if range_header else {}
+        return self.client.get(path, headers=headers)
+
+    def ids(self, response):
+        return [item['id'] for item in json.loads(response.data)['items']]
+
+    def test_item_range(self):
+        """
+        Test an item range gives a 206 with the selected items
+        """
+        response = self.get('/items', 'items=1-2')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response.headers['Content-Range'], 'items 1-2/5')
+        self.assertEqual(self.ids(response), [1, 2])
+        full = self.get('/items')
+        self.assertEqual(full.status_code, 200)
+        self.assertEqual(self.ids(full), range(5))
+
+    def test_open_and_suffix_ranges(self):
+        """
+        Test open ended ranges and ranges counted from the end
+        """
+        response = self.get('/items', 'items=3-')
+        self.assertEqual(response.headers['Content-Range'], 'items 3-4/5')
+        self.assertEqual(self.ids(response), [3, 4])
+        response = self.get('/items', 'items=-2')
+        self.assertEqual(response.headers['Content-Range'], 'items 3-4/5')
+        self.assertEqual(self.ids(response), [3, 4])
+        # the end of a range is capped to the available items
+        response = self.get('/items', 'items=4-10')
+        self.assertEqual(response.headers['Content-Range'], 'items 4-4/5')
+
+    def test_lazy_results(self):
+        """
+        Test a range only consumes lazy results up to its end
+        """
+        response = self.get('/lazy', 'items=1-2')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response.headers['Content-Range'], 'items 1-2/*')
+        self.assertEqual(self.ids(response), [1, 2])
+        self.assertEqual(self.produced, [0, 1, 2])
+
+    def test_not_satisfiable(self):
+        """
+        Test a range past the end of the items is a 416
+        """
+        response = self.get('/items', 'items=5-9')
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response.headers['Content-Range'], 'items */5')
+        self.assertEqual(self.get('/lazy', 'items=7-9').status_code, 416)
+
+    def test_ignored_ranges(self):
+        """
+        Test malformed ranges, multiple ranges and other units serve the whole response
+        """
+        for range_header in ('items=a-b', 'items=0-1,3-4', 'pages=0-1'):
+            response = self.get('/lazy', range_header)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(self.ids(response), range(5))
+
+    def test_byte_range_of_cached_body(self):
+        """
+        Test byte ranges are served from cached bodies
+        """
+        body = self.get('/items').data
+        response = self.get('/items', 'bytes=0-9')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response.data, body[:10])
+        self.assertEqual(response.headers['Content-Range'], 'bytes 0-9/{0}'.format(len(body)))
+        self.assertEqual(response.content_length, 10)
+        response = self.get('/items', 'bytes={0}-'.format(len(body)))
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(self.api.metrics()['response_cache']['hits'], 2)
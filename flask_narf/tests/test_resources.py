@@ -0,0 +1,267 @@
+from unittest import TestCase
+
+from flask import Flask, json
+from flask.ext.narf import NARF
+from flask.ext.narf.deserializers import Deserializer
+from flask.ext.narf.exceptions import ConfigurationError, NotFound
+from flask.ext.narf.fields import Field, IntegerField, StringField
+from flask.ext.narf.filters import Filter, FilterSet
+from flask.ext.narf.resources import MemoryStorage, Resource
+from flask.ext.narf.serializers import Serializer
+from flask.ext.narf.sorting import Sort
+
+
+class BookSerializer(Serializer):
+    id = Field(pk=True)
+    title = StringField()
+    year = IntegerField()
+
+
+class BookDeserializer(Deserializer):
+    title = StringField()
+    year = IntegerField()
+
+
+class BookFilterSet(FilterSet):
+    year = Filter(IntegerField())
+    sort = Sort(BookSerializer)
+
+
+class CountingStorage(MemoryStorage):
+    """
+    MemoryStorage counting its transactions
+    """
+
+    def __init__(self, *args, **kwargs):
+        super(CountingStorage, self).__init__(*args, **kwargs)
+        self.transactions = 0
+
+    def transaction(self):
+        self.transactions += 1
+        return super(CountingStorage, self).transaction()
+
+
+class TestMemoryStorage(TestCase):
+
+    def test_transaction(self):
+        """
+        Test failing transactions restore the records
+        """
+        storage = MemoryStorage([{'title': 'One'}, {'id': 5, 'title': 'Five'}])
+        self.assertEqual(storage.create({'title': 'Six'}), {'id': 6, 'title': 'Six'})
+        with self.assertRaises(NotFound):
+            with storage.transaction():
+                storage.delete(1)
+                storage.create({'title': 'Seven'})
+                storage.update_many([(5, {'title': 'V'}), (9, {'title': 'IX'})])
+        self.assertEqual([record['id'] for record in storage.list()], [1, 5, 6])
+        self.assertEqual(storage.get(5), {'id': 5, 'title': 'Five'})
+        self.assertEqual(storage.create({'title': 'Seven'})['id'], 7)
+
+
+class TestResource(TestCase):
+
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.api = NARF(self.app)
+        self.storage = CountingStorage([
+            {'title': 'Dune', 'year': 1965},
+            {'title': 'Neuromancer', 'year': 1984},
+            {'title': 'Hyperion', 'year': 1989},
+        ])
+
+        @self.api.resource
+        class Books(Resource):
+            path = '/books'
+            Serializer = BookSerializer
+            Deserializer = BookDeserializer
+            FilterSet = BookFilterSet
+            storage = self.storage
+            pk_converter = 'int'
+            batch_size = 2
+
+        @self.api.resource
+        class Authors(Resource):
+            path = '/authors'
+            Serializer = BookSerializer
+            storage = MemoryStorage([{'title': 'Anonymous', 'year': 1900}])
+            pk_converter = 'int'
+
+        self.client = self.app.test_client()
+
+    def send(self, method, path, data=None, headers=None):
+        return self.client.open(
+            path, method=method, data=json.dumps(data), content_type='application/json',
+            headers=headers
+        )
+
+    def items(self, response):
+        return json.loads(response.data)['items']
+
+    def titles(self):
+        return [item['title'] for item in self.items(self.client.get('/books?sort=id'))]
+
+    def test_list(self):
+        """
+        Test the collection lists the records, filtered, sorted and paginated
+        """
+        self.assertEqual(self.titles(), ['Dune', 'Neuromancer', 'Hyperion'])
+        response = self.client.get('/books?year=1984')
+        self.assertEqual(self.items(response), [{'id': 2, 'title': 'Neuromancer', 'year': 1984}])
+        response = self.client.get('/books?sort=-year', headers={'Range': 'items=0-1'})
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response.headers['Content-Range'], 'items 0-1/3')
+        self.assertEqual([item['id'] for item in self.items(response)], [3, 2])
+
+    def test_item(self):
+        """
+        Test items are served with their ETag, answering a matching If-None-Match with 304 to GET
+        and HEAD requests
+        """
+        response = self.client.get('/books/1')
+        self.assertEqual(self.items(response), [{'id': 1, 'title': 'Dune', 'year': 1965}])
+        etag = response.headers['ETag']
+        response = self.client.get('/books/1', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.data, '')
+        response = self.client.head('/books/1', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+        response = self.client.head('/books/2', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.client.get('/books/9').status_code, 404)
+
+    def test_create(self):
+        """
+        Test creating one record, with its Location, or a list of them in batches
+        """
+        response = self.send('POST', '/books', {'title': 'Ubik', 'year': '1969'})
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.headers['Location'], 'http://localhost/books/4')
+        self.assertEqual(self.items(response), [{'id': 4, 'title': 'Ubik', 'year': 1969}])
+        self.storage.transactions = 0
+        response = self.send('POST', '/books', [
+            {'title': 'Solaris', 'year': 1961}, {'title': 'Blindsight', 'year': 2006},
+            {'title': 'Anathem', 'year': 2008},
+        ])
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual([item['id'] for item in self.items(response)], [5, 6, 7])
+        self.assertEqual(self.storage.transactions, 2)
+
+    def test_invalid_input(self):
+        """
+        Test invalid input is rejected before anything is written
+        """
+        response = self.send('POST', '/books', [{'title': 'Ubik', 'year': 1969}, {'title': 'X'}])
+        self.assertEqual(response.status_code, 400)
+        response = self.send('POST', '/books', {'title': 'Ubik', 'year': 'soon'})
+        self.assertEqual(response.status_code, 400)
+        response = self.client.post('/books', data='title=Ubik')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(len(self.titles()), 3)
+
+    def test_update(self):
+        """
+        Test updating an item, with If-Match preconditions
+        """
+        etag = self.client.get('/books/1').headers['ETag']
+        response = self.send('PUT', '/books/1', {'title': 'Dune', 'year': 1966})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.headers['ETag'], etag)
+        response = self.send(
+            'PUT', '/books/1', {'title': 'Dune', 'year': 1967}, headers={'If-Match': etag}
+        )
+        self.assertEqual(response.status_code, 412)
+        self.assertEqual(self.storage.get(1)['year'], 1966)
+
+    def test_bulk_update_and_delete(self):
+        """
+        Test bulk writes are written in transactions of batch_size records
+        """
+        response = self.send('PUT', '/books', [
+            {'id': 1, 'title': 'Dune', 'year': 1966}, {'id': 2, 'title': 'N', 'year': 1984},
+            {'id': 3, 'title': 'H', 'year': 1990}, {'id': 9, 'title': 'Missing', 'year': 2000},
+        ])
+        self.assertEqual(response.status_code, 404)
+        # the first batch was written, the failing one rolled back
+        self.assertEqual(self.titles(), ['Dune', 'N', 'Hyperion'])
+        response = self.send('PUT', '/books', [{'title': 'No pk', 'year': 2000}])
+        self.assertEqual(response.status_code, 400)
+        response = self.send('DELETE', '/books', [1, 3])
+        self.assertEqual([item['id'] for item in self.items(response)], [1, 3])
+        self.assertEqual(self.titles(), ['N'])
+
+    def test_delete(self):
+        """
+        Test deleting an item
+        """
+        response = self.client.delete('/books/2')
+        self.assertEqual(self.items(response)[0]['title'], 'Neuromancer')
+        self.assertEqual(self.client.delete('/books/2').status_code, 404)
+
+    def test_read_only(self):
+        """
+        Test resources without a Deserializer only route GET
+        """
+        self.assertEqual(self.client.get('/authors').status_code, 200)
+        self.assertEqual(self.send('POST', '/authors', {'title': 'X'}).status_code, 405)
+        self.assertEqual(self.client.delete('/authors/1').status_code, 405)
+        self.assertEqual(
+            json.loads(self.client.open('/books', method='OPTIONS').data)['methods'],
+            ['DELETE', 'GET', 'HEAD', 'OPTIONS', 'POST', 'PUT']
+        )
+
+    def test_head(self):
+        """
+        Test HEAD requests read like GET requests and never write
+        """
+        for path in ('/books', '/books/1', '/authors', '/authors/1'):
+            response = self.client.head(path)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.content_length, len(self.client.get(path).data))
+        self.assertEqual(len(self.titles()), 3)
+        self.assertEqual(self.client.get('/authors/1').status_code, 200)
+
+    def test_default_pk_converter(self):
+        """
+        Test items are found by their integer pk without a pk_converter
+        """
+
+        class CountedSerializer(Serializer):
+            id = IntegerField(pk=True)
+            title = StringField()
+
+        @self.api.resource
+        class Things(Resource):
+            path = '/things'
+            Serializer = BookSerializer
+            Deserializer = BookDeserializer
+            storage = MemoryStorage()
+
+        @self.api.resource
+        class Counted(Resource):
+            path = '/counted'
+            Serializer = CountedSerializer
+            storage = MemoryStorage([{'title': 'One'}])
+
+        response = self.send('POST', '/things', {'title': 'Ubik', 'year': 1969})
+        location = response.headers['Location']
+        self.assertEqual(location, 'http://localhost/things/1')
+        self.assertEqual(self.items(self.client.get(location))[0]['title'], 'Ubik')
+        response = self.send('PUT', location, {'title': 'Ubik', 'year': 1970})
+        self.assertEqual(self.items(response), [{'id': 1, 'title': 'Ubik', 'year': 1970}])
+        self.assertEqual(self.client.delete(location).status_code, 200)
+        self.assertEqual(self.client.get(location).status_code, 404)
+        self.assertEqual(self.client.get('/counted/1').status_code, 200)
+        rules = [rule.rule for rule in self.app.url_map.iter_rules()]
+        self.assertIn('/counted/<int:pk>', rules)
+
+    def test_configuration(self):
+        """
+        Test resources missing a component are refused
+        """
+
+        class Incomplete(Resource):
+            path = '/incomplete'
+
+        with self.assertRaises(ConfigurationError):
+            self.api.resource(Incomplete)
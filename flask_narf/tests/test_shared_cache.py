@@ -0,0 +1,203 @@
+from multiprocessing import Process
+from os import path
+from shutil import rmtree
+from tempfile import mkdtemp
+from time import time
+from unittest import TestCase
+
+import mock
+from flask import Flask, request
+from flask.ext.narf import NARF
+from flask.ext.narf.cache import LRUCache
+from flask.ext.narf.fields import Field
+from flask.ext.narf.resources import Reply
+from flask.ext.narf.serializers import Serializer
+from flask.ext.narf.shared_cache import SharedMemoryCache
+
+
+def store_in_child(cache_path, key, value):
+    cache = SharedMemoryCache(cache_path, slots=8, slot_size=256, ways=2)
+    cache.set(key, value)
+    cache.close()
+
+
+class TestSharedMemoryCache(TestCase):
+
+    def setUp(self):
+        self.directory = mkdtemp()
+        self.path = path.join(self.directory, 'cache')
+        self.cache = self.open()
+
+    def tearDown(self):
+        self.cache.close()
+        rmtree(self.directory)
+
+    def open(self, **kwargs):
+        options = {'slots': 8, 'slot_size': 256, 'ways': 2}
+        options.update(kwargs)
+        return SharedMemoryCache(self.path, **options)
+
+    def test_get_set(self):
+        """
+        Test stored values are returned and overwritten
+        """
+        self.assertIsNone(self.cache.get('key'))
+        self.assertTrue(self.cache.set('key', 'value'))
+        self.assertEqual(self.cache.get('key'), 'value')
+        self.cache.set('key', 'other')
+        self.assertEqual(self.cache.get('key'), 'other')
+        stats = self.cache.stats()
+        self.assertEqual(stats['used_slots'], 1)
+        self.assertEqual(stats['hits'], 2)
+        self.assertEqual(stats['misses'], 1)
+
+    def test_expiry(self):
+        """
+        Test values are not returned after their timeout
+        """
+        self.cache.set('key', 'value', timeout=10)
+        self.assertEqual(self.cache.get('key'), 'value')
+        with mock.patch('flask_narf.shared_cache.time', return_value=time() + 20):
+            self.assertIsNone(self.cache.get('key'))
+
+    def test_evict_oldest_in_set(self):
+        """
+        Test storing into a full set evicts the value written longest ago
+        """
+        keys = ['key{0}'.format(i) for i in range(20)]
+        same_set = [
+            key for key in keys
+            if self.cache.slot_offsets(self.cache.key_hash(key)) ==
+            self.cache.slot_offsets(self.cache.key_hash(keys[0]))
+        ][:3]
+        for key in same_set:
+            self.cache.set(key, key)
+        self.assertIsNone(self.cache.get(same_set[0]))
+        self.assertEqual(self.cache.get(same_set[1]), same_set[1])
+        self.assertEqual(self.cache.get(same_set[2]), same_set[2])
+        self.assertEqual(self.cache.stats()['evictions'], 1)
+
+    def test_too_large(self):
+        """
+        Test values that don't fit in a slot are rejected
+        """
+        self.assertFalse(self.cache.set('key', 'x' * 256))
+        self.assertIsNone(self.cache.get('key'))
+        self.assertEqual(self.cache.stats()['rejected'], 1)
+
+    def test_delete_and_clear(self):
+        """
+        Test values can be removed
+        """
+        self.cache.set('a', '1')
+        self.cache.set('b', '2')
+        self.cache.delete('a')
+        self.assertIsNone(self.cache.get('a'))
+        self.assertEqual(self.cache.get('b'), '2')
+        self.cache.clear()
+        self.assertIsNone(self.cache.get('b'))
+        self.assertEqual(self.cache.stats()['used_slots'], 0)
+
+    def test_shared_between_processes(self):
+        """
+        Test a value stored by another process is visible
+        """
+        child = Process(target=store_in_child, args=(self.path, 'key', 'from child'))
+        child.start()
+        child.join()
+        self.assertEqual(child.exitcode, 0)
+        self.assertEqual(self.cache.get('key'), 'from child')
+
+    def test_layout_mismatch(self):
+        """
+        Test opening an existing file with another layout fails
+        """
+        with self.assertRaises(ValueError):
+            self.open(slots=16)
+
+
+class TestResponseCache(TestCase):
+
+    def make_app(self, **config):
+        app = Flask(__name__)
+        app.config.update(config)
+        api = NARF(app)
+        self.calls = []
+
+        class ItemSerializer(Serializer):
+            id = Field(pk=True)
+
+        @api.register(ItemSerializer)
+        @api.endpoint('/items', cache_timeout=60, methods=['GET', 'POST'])
+        def items():
+            self.calls.append(1)
+            return Reply([{'id': 1}], headers={'ETag': '"v1"'})
+
+        return app, api
+
+    def check_cached(self, app):
+        client = app.test_client()
+        first = client.get('/items')
+        second = client.get('/items')
+        self.assertEqual(self.calls, [1])
+        self.assertEqual(second.status_code, 200)
+        self.assertEqual(second.data, first.data)
+        self.assertEqual(second.headers['Content-Type'], first.headers['Content-Type'])
+        # responses are cached per Content-Type
+        other = client.get('/items', headers={'Accept': 'application/vnd.collection+json'})
+        self.assertEqual(other.mimetype, 'application/vnd.collection+json')
+        self.assertEqual(self.calls, [1, 1])
+
+    def test_in_process_cache(self):
+        """
+        Test endpoints with a cache_timeout reuse rendered responses
+        """
+        app, api = self.make_app()
+        self.assertIsInstance(api.response_cache, LRUCache)
+        self.check_cached(app)
+        self.assertEqual(api.metrics()['response_cache']['hits'], 1)
+
+    def test_query_string(self):
+        """
+        Test requests with different query strings never share a cached response
+        """
+        app, api = self.make_app()
+
+        @api.endpoint('/page', cache_timeout=60)
+        def page():
+            return {'page': request.args.get('page')}
+
+        client = app.test_client()
+        self.assertEqual(client.get('/page?page=1').data, '{"page": "1"}')
+        self.assertEqual(client.get('/page?page=2').data, '{"page": "2"}')
+        self.assertEqual(client.get('/page?b=1&page=2').data, '{"page": "2"}')
+        self.assertEqual(api.metrics()['response_cache']['hits'], 0)
+        client.get('/page?page=2&b=1')
+        self.assertEqual(api.metrics()['response_cache']['hits'], 1)
+
+    def test_only_get_cached(self):
+        """
+        Test other methods never get cached responses, and If-None-Match is applied per request
+        """
+        app, api = self.make_app()
+        client = app.test_client()
+        client.get('/items')
+        posted = client.post('/items')
+        self.assertEqual(self.calls, [1, 1])
+        self.assertEqual(posted.data, '{"items": [{"id": 1}]}')
+        self.assertEqual(client.get('/items', headers={'If-None-Match': '"v1"'}).status_code, 304)
+        self.assertEqual(client.get('/items').data, '{"items": [{"id": 1}]}')
+        self.assertEqual(self.calls, [1, 1])
+
+    def test_shared_cache(self):
+        """
+        Test rendered responses can be cached in a SharedMemoryCache
+        """
+        directory = mkdtemp()
+        try:
+            cache = SharedMemoryCache(path.join(directory, 'cache'), slots=16, slot_size=4096)
+            app, api = self.make_app(NARF_RESPONSE_CACHE=cache)
+            self.check_cached(app)
+            cache.close()
+        finally:
+            rmtree(directory)
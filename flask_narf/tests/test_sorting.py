@@ -0,0 +1,120 @@
+from unittest import TestCase
+
+from flask import Flask, json
+from flask.ext.narf import NARF
+from flask.ext.narf.exceptions import ValidationError
+from flask.ext.narf.fields import Field, IntegerField, StringField, URIField
+from flask.ext.narf.filters import FilterSet
+from flask.ext.narf.serializers import Serializer
+from flask.ext.narf.sorting import Sort, SortKey, sort_items
+
+
+class ItemSerializer(Serializer):
+    id = Field(pk=True)
+    name = StringField()
+    score = IntegerField(source='points')
+    link = URIField()
+
+
+class ItemFilterSet(FilterSet):
+    sort = Sort(ItemSerializer, default=['id'])
+
+
+ITEMS = [
+    {'id': 1, 'name': 'b', 'points': 3, 'link': 'http://example.com/1'},
+    {'id': 2, 'name': 'a', 'points': 1, 'link': 'http://example.com/2'},
+    {'id': 3, 'name': 'c', 'points': 3, 'link': 'http://example.com/3'},
+    {'id': 4, 'name': 'a', 'points': 2, 'link': 'http://example.com/4'},
+]
+
+
+class TestSort(TestCase):
+
+    def setUp(self):
+        self.app = Flask(__name__)
+
+    def parse(self, query_string):
+        with self.app.test_request_context('/?' + query_string):
+            return ItemFilterSet.parse().sort.validated_value
+
+    def test_sort_keys(self):
+        """
+        Test sort parameters validate to SortKeys with the sources of the Serializer fields
+        """
+        self.assertEqual(self.parse('sort=-score,name'), (
+            SortKey('score', 'points', True), SortKey('name', 'name', False)
+        ))
+        self.assertEqual(self.parse(''), (SortKey('id', 'id', False),))
+
+    def test_invalid_sort(self):
+        """
+        Test sorting by unknown fields and links is rejected
+        """
+        for query_string in ('sort=unknown', 'sort=-link'):
+            with self.assertRaises(ValidationError):
+                self.parse(query_string)
+        self.assertEqual(ItemFilterSet.describe()['filters'][0]['sortable'], [
+            'id', 'name', 'score'
+        ])
+
+    def test_sort_items(self):
+        """
+        Test multi-key orders in mixed directions, with and without a limit
+        """
+        sort_keys = (SortKey('name', 'name', False), SortKey('score', 'points', True))
+        ordered = [4, 2, 1, 3]
+        self.assertEqual([item['id'] for item in sort_items(ITEMS, sort_keys)], ordered)
+        self.assertEqual([item['id'] for item in sort_items(ITEMS, sort_keys, 2)], ordered[:2])
+        sort_keys = (SortKey('score', 'points', True), SortKey('id', 'id', True))
+        self.assertEqual([item['id'] for item in sort_items(iter(ITEMS), sort_keys, 3)], [3, 1, 4])
+        # missing values sort as None
+        items = ITEMS + [{'id': 5}]
+        sort_keys = (SortKey('name', 'name', False),)
+        self.assertEqual([item['id'] for item in sort_items(items, sort_keys)], [5, 2, 4, 1, 3])
+
+    def test_sort_pushdown(self):
+        """
+        Test results with a sort_by method sort themselves
+        """
+
+        class Query(list):
+            def sort_by(self, sort_keys):
+                return Query(['sorted by {0}'.format(sort_keys[0].source)])
+
+        sort_keys = (SortKey('score', 'points', False),)
+        self.assertEqual(sort_items(Query(ITEMS), sort_keys), ['sorted by points'])
+
+
+class TestSortedEndpoint(TestCase):
+
+    def setUp(self):
+        app = Flask(__name__)
+        api = NARF(app)
+
+        @api.register(ItemSerializer)
+        @api.register(ItemFilterSet)
+        @api.endpoint('/items')
+        def items(filterset):
+            return ITEMS
+
+        self.client = app.test_client()
+
+    def ids(self, response):
+        return [item['id'] for item in json.loads(response.data)['items']]
+
+    def test_sorted_list(self):
+        """
+        Test list results are sorted by the endpoint
+        """
+        self.assertEqual(self.ids(self.client.get('/items?sort=-score,-id')), [3, 1, 4, 2])
+        self.assertEqual(self.ids(self.client.get('/items')), [1, 2, 3, 4])
+        self.assertEqual(self.client.get('/items?sort=nope').status_code, 400)
+
+    def test_sorted_range(self):
+        """
+        Test a range of a sorted list only selects the items up to its end
+        """
+        response = self.client.get('/items?sort=name,id', headers={'Range': 'items=1-2'})
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response.headers['Content-Range'], 'items 1-2/4')
+        self.assertEqual(self.ids(response), [4, 1])